@@ -6,18 +6,108 @@ from .models import *
 
 from pkg_resources import resource_filename
 LOCATION = resource_filename(__name__, 'metadata.csv')
+KEYFRAMES = resource_filename(__name__, 'keyframes.txt')
+CHECKSUMS = resource_filename(__name__, 'checksums.sha256')
+ANNOTATIONS = resource_filename(__name__, 'data')
+PROTOCOLS = os.path.join(ANNOTATIONS, 'protocols')
 
 class Database(object):
+  """The MAHNOB HCI-Tagging database
 
-  def __init__(self):
+
+  Parameters:
+
+    cache_size (int, optional): If set, data loaded by the
+      :py:class:`File` objects of this database (video frames, signals and
+      face bounding boxes) is kept in memory, up to this total size in bytes,
+      so repeated loads of the same session do not hit the disk. The cache is
+      available as :py:attr:`memory_cache` (see
+      :py:class:`bob.db.hci_tagging.cache.MemoryCache`), and its hit, miss and
+      eviction counters with :py:meth:`cache_stats`.
+
+    location (str, optional): The path to the CSV descriptor of the database.
+      By default, the one shipped with this package (:py:data:`LOCATION`).
+
+    keyframes (str, optional): The path to the keyframe index built with the
+      descriptor (defaults to :py:data:`KEYFRAMES`)
+
+    protocols (str, optional): The directory containing the protocol lists
+      (defaults to :py:data:`PROTOCOLS`)
+
+    annotations (str, optional): The directory containing the face
+      bounding-boxes and metadata (HDF5) files of each session (defaults to
+      :py:data:`ANNOTATIONS`)
+
+    The locations are only needed to work on another copy of the database,
+    such as a synthetic one (see :py:mod:`bob.db.hci_tagging.synthetic`).
+
+    shared (str, optional): If set, the metadata, protocol lists, keyframe
+      index, average heart-rates and face bounding-boxes are read from a
+      compiled index on this directory, which is memory-mapped, instead of
+      being parsed by each process (see :py:mod:`bob.db.hci_tagging.shared`).
+      The index is compiled on first use, and whenever the descriptor, the
+      protocol lists, the keyframe index or the annotation files change.
+      Create the database once in the parent process, before starting
+      workers: they then share the same pages, at no extra memory cost.
+
+  """
+
+  def __init__(self, cache_size=0, location=LOCATION, keyframes=KEYFRAMES,
+      protocols=PROTOCOLS, annotations=ANNOTATIONS, shared=None):
     from .driver import Interface
     self.info = Interface()
+    self.protocols = protocols
+    self.annotations = annotations
+    self.shared = None
+
+    if shared:
+      from .shared import attach
+      self.shared = attach(shared, location, keyframes, protocols,
+          annotations)
+      self.metadata = self.shared
+      self.keyframes = {}
+
+    else:
+      # Loads metadata
+      import csv
+      with open(location) as f:
+        reader = csv.DictReader(f)
+        self.metadata = [row for row in reader]
+
+      # Loads the keyframe index, if one was built with the metadata
+      from .video import load_index
+      self.keyframes = load_index(keyframes)
+
+    self.memory_cache = None
+    if cache_size:
+      from .cache import MemoryCache
+      self.memory_cache = MemoryCache(cache_size)
 
-    # Loads metadata
-    import csv
-    with open(LOCATION) as f:
-      reader = csv.DictReader(f)
-      self.metadata = [row for row in reader]
+
+  def _make_file(self, row, position=None):
+    """Builds a :py:class:`File` from a metadata row (or the position of the
+    row on the shared index)"""
+
+    if self.shared is not None:
+      retval = File(**self.shared[position])
+      retval.keyframes = self.shared.keyframes(position)
+      retval.shared = (self.shared, position)
+    else:
+      retval = File(**row)
+      retval.keyframes = self.keyframes.get(retval.basedir)
+    retval.memory_cache = self.memory_cache
+    retval.annotations = self.annotations
+    return retval
+
+
+  def cache_stats(self):
+    """Returns the counters of the memory cache, or ``None`` if disabled
+
+    See :py:meth:`bob.db.hci_tagging.cache.MemoryCache.stats`.
+    """
+
+    if self.memory_cache is None: return None
+    return self.memory_cache.stats()
 
 
   def objects(self, protocol='all', subset=None):
@@ -46,35 +136,120 @@ class Database(object):
 
     """
 
-    proto_basedir = os.path.join('data', 'protocols')
+    if self.shared is not None:
+      return [self._make_file(None, k) for k in \
+          self.shared.select(protocol, subset)]
+
+    proto_basedir = self.protocols
 
     if protocol in ('cvpr14',):
-      d = resource_filename(__name__, os.path.join(proto_basedir, 'cvpr14', 'li_samples_cvpr14.txt'))
+      d = os.path.join(proto_basedir, 'cvpr14', 'li_samples_cvpr14.txt')
       with open(d, 'rt') as f: sessions = f.read().split()
-      return [File(**k) for k in self.metadata if k['basedir'] in sessions]
+      return [self._make_file(k) for k in self.metadata if k['basedir'] in sessions]
 
     if protocol in ('all'):
 
       if not subset:
-        return [File(**k) for k in self.metadata]
+        return [self._make_file(k) for k in self.metadata]
       else:
         files = []
         if 'train' in subset:
-          d = resource_filename(__name__, os.path.join(proto_basedir, 'all', 'train.txt'))
+          d = os.path.join(proto_basedir, 'all', 'train.txt')
           with open(d, 'rt') as f: sessions = f.read().split()
-          files += [File(**k) for k in self.metadata if k['basedir'] in sessions]
+          files += [self._make_file(k) for k in self.metadata if k['basedir'] in sessions]
         if 'dev' in subset:
-          d = resource_filename(__name__, os.path.join(proto_basedir, 'all', 'dev.txt'))
+          d = os.path.join(proto_basedir, 'all', 'dev.txt')
           with open(d, 'rt') as f: sessions = f.read().split()
-          files += [File(**k) for k in self.metadata if k['basedir'] in sessions]
+          files += [self._make_file(k) for k in self.metadata if k['basedir'] in sessions]
         if 'test' in subset:
-          d = resource_filename(__name__, os.path.join(proto_basedir, 'all', 'test.txt'))
+          d = os.path.join(proto_basedir, 'all', 'test.txt')
           with open(d, 'rt') as f: sessions = f.read().split()
-          files += [File(**k) for k in self.metadata if k['basedir'] in sessions]
+          files += [self._make_file(k) for k in self.metadata if k['basedir'] in sessions]
 
         return files
 
 
+  def windows(self, length=10., step=None, protocol='all', subset=None):
+    """Returns an index of fixed-length windows over the selected sessions
+
+    The index is built from the metadata only, so no media file is opened. Its
+    length is known upfront and windows can be accessed at random, by
+    position. Each window can load its own video frames and physiological
+    signals.
+
+
+    Parameters:
+
+      length (float): The length of each window, in seconds
+
+      step (float, optional): The time between the start of two consecutive
+        windows of a session, in seconds. If not set, windows do not overlap.
+
+      protocol (:py:class:`str`, optional): See :py:meth:`objects`
+
+      subset (:py:class:`str`, optional): See :py:meth:`objects`
+
+
+    Returns:
+
+      bob.db.hci_tagging.windows.WindowIndex: A sequence of
+      :py:class:`bob.db.hci_tagging.windows.Window` objects
+
+    """
+
+    from .windows import WindowIndex
+    return WindowIndex(self.objects(protocol, subset), length, step)
+
+
+  def samples(self, directory, protocol='all', subset=None, workers=4,
+      prefetch=8, processes=False, shuffle=False, seed=None):
+    """Iterates over training samples, loading them in background
+
+    Each sample is loaded by one of ``workers`` threads (or processes), so
+    I/O overlaps with the computation done by the consumer. Stopping the
+    iteration early (e.g. with ``break``) cancels pending loads and shuts the
+    workers down.
+
+
+    Parameters:
+
+      directory (str): The path to the root of the database installation.
+        This is the path leading to the directory ``Sessions`` of the
+        database.
+
+      protocol (:py:class:`str`, optional): See :py:meth:`objects`
+
+      subset (:py:class:`str`, optional): See :py:meth:`objects`
+
+      workers (int): The number of worker threads (or processes)
+
+      prefetch (int): The maximum number of samples loaded ahead of the
+        consumer
+
+      processes (bool): If set, samples are loaded by worker processes
+        instead of threads
+
+      shuffle (bool): If set, samples are yielded in random order. Otherwise,
+        they are yielded in the order of :py:meth:`objects`.
+
+      seed (int, optional): The seed for shuffling, so the random order is
+        reproducible
+
+
+    Yields:
+
+      tuple: For each session, the video frames (a 4D array in
+      (frame,channel,y,x) notation), the face bounding boxes (as returned by
+      :py:meth:`File.load_face_detection`) and the average heart-rate in
+      beats-per-minute.
+
+    """
+
+    from .loader import samples
+    return samples(self.objects(protocol, subset), directory, workers,
+        prefetch, processes, shuffle, seed)
+
+
 # gets sphinx autodoc done right - don't remove it
 def __appropriate__(*args):
   """Says object was actually declared here, an not on the import module.
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Benchmarks of the database access API on a synthetic database
+
+Each benchmark times one operation of the API (listing objects, reading
+signals, estimating the heart-rate, loading or detecting faces and scanning
+the raw files) over all sessions of a synthetic database (see
+:py:mod:`bob.db.hci_tagging.synthetic`), a few times. Results are returned as
+a JSON-serializable dictionary, so they can be saved and compared across
+versions of this package.
+'''
+
+import os
+import sys
+import time
+import platform
+
+
+def measure(function, repeat=3):
+  """Times ``function`` (a callable without arguments) ``repeat`` times
+
+  Returns:
+
+    dict: The wall time of each run (``times``) and their minimum (``best``),
+    mean and median, in seconds
+
+  """
+
+  import numpy
+
+  times = []
+  for k in range(repeat):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+
+  return {
+      'times': times,
+      'best': min(times),
+      'mean': float(numpy.mean(times)),
+      'median': float(numpy.median(times)),
+      }
+
+
+def _windows(objects, directory, length=1.):
+  """Reads the ECG signals of each session in windows of ``length`` seconds"""
+
+  from .utils import bdf_load_signal
+  for obj in objects:
+    path = obj.make_path(directory)
+    for start in range(int(obj.duration / length)):
+      bdf_load_signal(path, 'EXG3', start*length, (start+1)*length, obj.sync)
+
+
+def run(paths, repeat=3, jobs=4):
+  """Runs all benchmarks on a synthetic database
+
+
+  Parameters:
+
+    paths (dict): The locations of the synthetic database, as returned by
+      :py:func:`bob.db.hci_tagging.synthetic.generate`
+
+    repeat (int): The number of times each benchmark is run
+
+    jobs (int): The number of threads used by :py:func:`create.scan`
+
+
+  Returns:
+
+    dict: The results of each benchmark (see :py:func:`measure`), indexed by
+    name. Benchmarks that cannot run (e.g. because of a missing dependency)
+    have an ``error`` entry instead.
+
+  """
+
+  import argparse
+  from . import synthetic
+  from .utils import bdf_load_signal
+  from .create import scan
+
+  directory = paths['directory']
+  db = synthetic.database(paths)
+  objects = db.objects()
+
+  def _load_signals():
+    for obj in objects:
+      bdf_load_signal(obj.make_path(directory), 'EXG3', sync=obj.sync)
+
+  def _heartrate():
+    for obj in objects: obj.estimate_heartrate_in_bpm(directory)
+
+  def _load_face_detection():
+    for obj in objects: obj.load_face_detection()
+
+  def _run_face_detector():
+    for obj in objects: obj.run_face_detector(directory, max_frames=10)
+
+  def _scan():
+    args = argparse.Namespace(basedir=directory, jobs=jobs, checksums=False,
+        verbose=0)
+    list(scan(args))
+
+  benchmarks = [
+      ('Database', lambda: synthetic.database(paths)),
+      ('Database.objects', db.objects),
+      ('bdf_load_signal', _load_signals),
+      ('bdf_load_signal.windows', lambda: _windows(objects, directory)),
+      ('File.estimate_heartrate_in_bpm', _heartrate),
+      ('File.load_face_detection', _load_face_detection),
+      ('File.run_face_detector', _run_face_detector),
+      ('create.scan', _scan),
+      ]
+
+  results = {}
+  for name, function in benchmarks:
+    try:
+      results[name] = measure(function, repeat)
+    except (ImportError, IOError, RuntimeError) as e:
+      results[name] = {'error': str(e)}
+
+  return results
+
+
+def environment():
+  """Describes the environment benchmarks run on"""
+
+  import pkg_resources
+  try:
+    version = pkg_resources.require('bob.db.hci_tagging')[0].version
+  except pkg_resources.DistributionNotFound:
+    version = None
+
+  return {
+      'version': version,
+      'python': sys.version.split()[0],
+      'platform': platform.platform(),
+      'machine': platform.machine(),
+      'cpus': os.cpu_count(),
+      'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+      }
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Caching of expensive results computed from the raw database files
+
+Results are stored on disk, under a key derived from the identity of the raw
+files they were computed from (by default, their size and modification time)
+and the parameters of the computation. Changing any of these yields a
+different key, so stale results are never returned. The total size of the
+store is bounded: least recently used results are evicted first.
+
+Data loaded repeatedly within a process (such as video frames or signals of
+the same session, across evaluation passes) can be kept in memory by a
+:py:class:`MemoryCache`, shared by all :py:class:`bob.db.hci_tagging.File`
+objects of a :py:class:`bob.db.hci_tagging.Database`.
+'''
+
+import os
+import json
+import pickle
+import hashlib
+import collections
+import tempfile
+import threading
+
+
+class ResultCache(object):
+  """An on-disk store of results, keyed by raw file identity and parameters
+
+
+  Parameters:
+
+    directory (str): The directory where results are stored. It is created
+      if it does not exist.
+
+    max_bytes (int): The maximum total size of stored results, in bytes. When
+      it is exceeded, least recently used results are removed.
+
+    identity (str): How raw files are identified: ``stat`` (default) uses
+      their size and modification time, while ``checksum`` uses the SHA-256
+      digest of their contents, which survives copies and ``touch``, at the
+      cost of reading each file once per process.
+
+  """
+
+  def __init__(self, directory, max_bytes=2**30, identity='stat'):
+
+    if identity not in ('stat', 'checksum'):
+      raise ValueError("unknown raw file identity `%s'" % identity)
+
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.identity = identity
+    self._digests = {}
+    self._total = None #running estimate of the store size
+    self._lock = threading.Lock()
+    if not os.path.exists(self.directory): os.makedirs(self.directory)
+
+
+  def _identify(self, path):
+    """Returns the identity of a raw file"""
+
+    if not os.path.exists(path):
+      raise IOError("file `%s' does not exist" % path)
+
+    st = os.stat(path)
+    retval = [os.path.abspath(path), st.st_size, int(st.st_mtime)]
+    if self.identity == 'stat': return retval
+
+    from .manifest import checksum
+    with self._lock: digest = self._digests.get(tuple(retval))
+    if digest is None:
+      digest = checksum(path)
+      with self._lock: self._digests[tuple(retval)] = digest
+    return [digest]
+
+
+  def key(self, paths, name, **parameters):
+    """Computes the key of a result
+
+    Parameters:
+
+      paths (list): The paths of all raw files the result depends on
+
+      name (str): The name of the computation (e.g. the method name)
+
+      parameters: Any further (JSON-serializable) parameter the result depends
+        on, such as a channel list, or a version number for the algorithm
+
+
+    Returns:
+
+      str: A hexadecimal digest identifying the result
+
+    """
+
+    description = {
+        'inputs': [self._identify(k) for k in paths],
+        'name': name,
+        'parameters': parameters,
+        }
+    encoded = json.dumps(description, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+  def _path(self, key):
+    return os.path.join(self.directory, key[:2], key + '.pkl')
+
+
+  def get(self, key):
+    """Returns a stored result, raises :py:class:`KeyError` if not there"""
+
+    path = self._path(key)
+    try:
+      with open(path, 'rb') as f: retval = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      raise KeyError(key)
+
+    try:
+      os.utime(path, None) #marks as recently used
+    except OSError:
+      pass #evicted by another process meanwhile
+    return retval
+
+
+  def set(self, key, value):
+    """Stores a result, then evicts old results if the store is too large
+
+    The store is only scanned on the first call and when the running estimate
+    of its size exceeds the budget.
+    """
+
+    path = self._path(key)
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory): os.makedirs(directory)
+
+    # writes to a temporary file first, so readers never see partial results
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp, path)
+    except:
+      if os.path.exists(tmp): os.unlink(tmp)
+      raise
+
+    with self._lock:
+      if self._total is None: self._total = self.size()
+      else: self._total += os.path.getsize(path)
+      if self._total > self.max_bytes: self.evict()
+
+
+  def memoize(self, function, paths, name, **parameters):
+    """Returns the stored result for the given key, or computes and stores it
+
+    Parameters:
+
+      function (callable): A callable without arguments that computes the
+        result if it is not stored
+
+      paths, name, parameters: See :py:meth:`key`
+
+    """
+
+    key = self.key(paths, name, **parameters)
+    try:
+      return self.get(key)
+    except KeyError:
+      retval = function()
+      self.set(key, retval)
+      return retval
+
+
+  def size(self):
+    """Returns the total size of stored results, in bytes"""
+
+    return sum(k[1] for k in self._entries())
+
+
+  def _entries(self):
+    """Lists stored results as tuples ``(last use, size, path)``"""
+
+    retval = []
+    for dirpath, dirs, files in os.walk(self.directory):
+      for name in files:
+        if not name.endswith('.pkl'): continue
+        path = os.path.join(dirpath, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        retval.append((st.st_mtime, st.st_size, path))
+    return retval
+
+
+  def evict(self):
+    """Removes least recently used results until the store fits its budget"""
+
+    entries = sorted(self._entries())
+    total = sum(k[1] for k in entries)
+    for last_use, size, path in entries:
+      if total <= self.max_bytes: break
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      total -= size
+    self._total = total
+
+
+  def clear(self):
+    """Removes all stored results"""
+
+    for last_use, size, path in self._entries():
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+    self._total = 0
+
+
+def _nbytes(value):
+  """Estimates the memory used by a loaded value, in bytes"""
+
+  if hasattr(value, 'nbytes'): return int(value.nbytes)
+  if isinstance(value, (tuple, list)): return 64 + sum(_nbytes(k) for k in value)
+  if isinstance(value, dict):
+    return 64 + sum(_nbytes(k) + 100 for k in value.values())
+  return 64
+
+
+def _freeze(value):
+  """Makes arrays of a loaded value read-only, so they can be shared"""
+
+  if hasattr(value, 'setflags'): value.setflags(write=False)
+  elif isinstance(value, (tuple, list)):
+    for k in value: _freeze(k)
+  return value
+
+
+class MemoryCache(object):
+  """An in-memory store of loaded data, bounded by its total size
+
+  Entries are evicted least recently used first, when the total size of the
+  stored values exceeds the budget. Arrays are stored, and returned,
+  read-only: copy them before modifying. Values larger than the budget are
+  not stored. The cache is thread-safe. When pickled (e.g. sent to a worker
+  process), only its budget is kept: each process gets its own (empty) store.
+
+
+  Parameters:
+
+    max_bytes (int): The maximum total size of stored values, in bytes
+
+  """
+
+  def __init__(self, max_bytes=2**30):
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self.clear()
+
+
+  def __getstate__(self):
+    return {'max_bytes': self.max_bytes}
+
+
+  def __setstate__(self, state):
+    self.__init__(state['max_bytes'])
+
+
+  def get(self, key, function):
+    """Returns the stored value for ``key``, or loads and stores it
+
+    Parameters:
+
+      key (tuple): A hashable key, such as the session, the name of the loader
+        and its arguments
+
+      function (callable): A callable without arguments that loads the value
+        if it is not stored
+
+    """
+
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key][0]
+      self.misses += 1
+
+    # loads without holding the lock, so other entries remain available
+    value = _freeze(function())
+    size = _nbytes(value)
+    if size > self.max_bytes: return value
+
+    with self._lock:
+      if key not in self._entries:
+        self._entries[key] = (value, size)
+        self.bytes += size
+      while self.bytes > self.max_bytes:
+        old, (_, old_size) = self._entries.popitem(last=False)
+        self.bytes -= old_size
+        self.evictions += 1
+    return value
+
+
+  def stats(self):
+    """Returns the counters of this cache
+
+    Returns:
+
+      dict: The number of ``hits``, ``misses`` and ``evictions`` since the
+      cache was created (or cleared), and the current number of ``entries``
+      and their total size in ``bytes``
+
+    """
+
+    with self._lock:
+      return dict(hits=self.hits, misses=self.misses,
+          evictions=self.evictions, entries=len(self._entries),
+          bytes=self.bytes)
+
+
+  def clear(self):
+    """Removes all stored values and resets the counters"""
+
+    with self._lock:
+      self._entries = collections.OrderedDict()
+      self.bytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
@@ -9,17 +9,125 @@ import os
 import fnmatch
 import bob.io.video
 
+from .video import probe as probe_video, save_index, load_index
+from .utils import bdf_probe
+from .manifest import checksum, save_manifest, load_manifest
+
+
+COLUMNS = ('basedir', 'bdf', 'video', 'duration', 'frames', 'frame_rate',
+    'channels', 'sample_rates', 'sync_start', 'sync_end', 'size', 'mtime')
+
 
 def estimate_duration(video):
-  """Estimates the duration of a video clip using Bob"""
+  """Estimates the duration of a video clip
+
+  Only the container header is parsed (using PyAV). If the container does not
+  declare its duration, we fall back to Bob's video reader.
+  """
+
+  import av
+
+  with av.open(video) as container:
+    if container.duration is not None:
+      return int(container.duration/float(av.time_base)) #returns in seconds
 
   v = bob.io.video.reader(video)
   return int(v.duration/float(10**6)) #returns in seconds
 
 
-def scan(args):
+def stamp(dirpath, names):
+  """Returns the total size and latest modification time of the given files
+
+  These two values are used to decide if the contents of a session directory
+  changed since the last time it was scanned.
+  """
+
+  stats = [os.stat(os.path.join(dirpath, k)) for k in names]
+  return sum(s.st_size for s in stats), int(max(s.st_mtime for s in stats))
+
+
+def probe(basedir, dirpath, bdf, video, previous, keyframes, digests=None):
+  """Creates the descriptor row of a single session directory
+
+  If ``previous`` (the row for this session from the last scan) matches the
+  current size and modification time of the session files, it is re-used as
+  is. Otherwise, the video file is probed for its duration, properties and
+  keyframes and the BDF file for its channels and synchronization markers.
+
+  If ``digests`` is set (to a dictionary with checksums of a previous scan,
+  possibly empty), the returned row also contains the checksums of the BDF and
+  video files. Checksums of unchanged files are re-used.
+  """
+
+  size, mtime = stamp(dirpath, (bdf, video))
+
+  unchanged = previous is not None and keyframes is not None and \
+      all(previous.get(k) for k in COLUMNS) and \
+      previous['size'] == str(size) and previous['mtime'] == str(mtime)
+
+  if unchanged:
+    retval = dict((k, previous[k]) for k in COLUMNS)
+    retval['keyframes'] = keyframes
+  else:
+    retval = _probe_files(basedir, dirpath, bdf, video, size, mtime)
+
+  if digests is not None:
+    retval['checksums'] = {}
+    for k in (bdf, video):
+      name = os.path.join(basedir, k)
+      retval['checksums'][name] = (unchanged and digests.get(name)) or \
+          checksum(os.path.join(dirpath, k))
+
+  return retval, not unchanged
+
+
+def _probe_files(basedir, dirpath, bdf, video, size, mtime):
+  """Probes the raw files of a session directory, see :py:func:`probe`"""
+
+  path = os.path.join(dirpath, video)
+  properties = probe_video(path)
+  channels, rates, sync_start, sync_end = bdf_probe(os.path.join(dirpath, bdf))
+
+  return {
+          'basedir': basedir,
+          'bdf': os.path.splitext(bdf)[0],
+          'video': os.path.splitext(video)[0],
+          'duration': estimate_duration(path),
+          'frames': properties['frames'],
+          'frame_rate': '%g' % properties['frame_rate'],
+          'channels': ' '.join(channels),
+          'sample_rates': ' '.join('%g' % k for k in rates),
+          'sync_start': sync_start,
+          'sync_end': sync_end,
+          'size': size,
+          'mtime': mtime,
+          'keyframes': properties['keyframes'],
+          }
+
+
+def scan(args, previous=None, keyframes=None, digests=None):
   """Scans the given base directory for the database information to retrieve
 
+  Session directories (video and BDF files) are probed concurrently, using
+  ``args.jobs`` threads.
+
+
+  Parameters:
+
+    args (argparse.Namespace): The command-line arguments
+
+    previous (dict, optional): Rows of a previous scan, indexed by base
+      directory. Sessions whose files did not change since are not probed
+      again.
+
+    keyframes (dict, optional): The keyframe index of a previous scan, indexed
+      by base directory.
+
+    digests (dict, optional): The checksum manifest of a previous scan, as
+      returned by :py:func:`bob.db.hci_tagging.manifest.load_manifest`. Only
+      used if ``args.checksums`` is set.
+
+
   Yields:
 
     Dictionaries, each with the following fields:
@@ -28,48 +136,101 @@ def scan(args):
       'bdf' (str): The stem of the BDF file from its base directory
       'video' (str): The stem of the video file from its base directory
       'duration' (int): The estimated duration of the video file in seconds
+      'frames' (int): The number of frames in the video file
+      'frame_rate' (str): The frame rate of the video file, in Hz
+      'channels' (str): The names of all channels in the BDF file, separated
+        by spaces
+      'sample_rates' (str): The sampling frequency of each channel in the BDF
+        file, in Hz, separated by spaces
+      'sync_start' (int): The first sample of the video period on the BDF
+        file, as marked on its ``Status`` channel
+      'sync_end' (int): The last sample of the video period on the BDF file
+      'size' (int): The total size, in bytes, of the BDF and video files
+      'mtime' (int): The latest modification time of the BDF and video files
+      'keyframes' (numpy.ndarray): The frame numbers of all keyframes in the
+        video file (see :py:func:`bob.db.hci_tagging.video.probe_keyframes`)
+      'checksums' (dict): Only present if ``args.checksums`` is set. The
+        SHA-256 digests of the BDF and video files, indexed by their paths
+        relative to ``args.basedir``
 
   """
 
-  for dirpath, dirs, files in os.walk(args.basedir):
-    bdf = fnmatch.filter(files, '*.bdf')
-    video = fnmatch.filter(files, '*C1 trigger*.avi')
+  from concurrent.futures import ThreadPoolExecutor
 
-    if bdf and video: #interesting directory, yield a new dictionary
-      if args.verbose:
-        print("Adding BDF file `%s'..." % os.path.join(args.basedir, bdf[0]))
+  previous = previous or {}
+  keyframes = keyframes or {}
+  if args.checksums: digests = digests or {}
+  else: digests = None
+
+  with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+
+    futures = []
+    for dirpath, dirs, files in os.walk(args.basedir):
+      bdf = fnmatch.filter(files, '*.bdf')
+      video = fnmatch.filter(files, '*C1 trigger*.avi')
 
-      yield {
-              'basedir': os.path.relpath(dirpath, args.basedir),
-              'bdf': os.path.splitext(bdf[0])[0],
-              'video': os.path.splitext(video[0])[0],
-              'duration': estimate_duration(os.path.join(dirpath, video[0])),
-              }
+      if bdf and video: #interesting directory, probe it
+        basedir = os.path.relpath(dirpath, args.basedir)
+        futures.append(executor.submit(probe, basedir, dirpath, bdf[0],
+          video[0], previous.get(basedir), keyframes.get(basedir), digests))
+
+    for future in futures:
+      row, probed = future.result()
+      if args.verbose:
+        print("%s BDF file `%s'..." % ('Adding' if probed else 'Keeping',
+          os.path.join(row['basedir'], row['bdf'] + '.bdf')))
+      yield row
 
 
 def create(args):
   """Creates or re-creates this database"""
 
-  from . import LOCATION
+  from . import LOCATION, KEYFRAMES, CHECKSUMS
 
-  if os.path.exists(LOCATION) and not args.recreate:
-    print("CSV descriptor exists at `%s' and --recreate was not set" % LOCATION)
+  if os.path.exists(LOCATION) and not (args.recreate or args.incremental):
+    print("CSV descriptor exists at `%s' and neither --recreate nor --incremental were set" % LOCATION)
     return 1
 
-  if os.path.exists(LOCATION): os.unlink(LOCATION)
-
   import csv
-  with open(LOCATION, 'w') as csvfile:
-    writer = csv.DictWriter(csvfile, ('basedir','bdf','video','duration'),
-            delimiter=',')
+
+  previous = {}
+  keyframes = {}
+  if args.incremental and os.path.exists(LOCATION):
+    with open(LOCATION) as f:
+      previous = dict((k['basedir'], k) for k in csv.DictReader(f))
+    keyframes = load_index(KEYFRAMES)
+  digests = load_manifest(CHECKSUMS) if args.incremental else {}
+
+  # writes to temporary files first, so an interrupted scan does not destroy
+  # the current descriptor
+  tmp_location = LOCATION + '~'
+  tmp_keyframes = KEYFRAMES + '~'
+  tmp_checksums = CHECKSUMS + '~'
+
+  index = {}
+  manifest = {}
+  with open(tmp_location, 'w') as csvfile:
+    writer = csv.DictWriter(csvfile, COLUMNS, delimiter=',')
     writer.writeheader()
     counter = 0
-    for row in scan(args):
+    for row in scan(args, previous, keyframes, digests):
+      index[row['basedir']] = row.pop('keyframes')
+      manifest.update(row.pop('checksums', {}))
       writer.writerow(row)
       counter += 1
 
-    if args.verbose:
-      print("Added %d items to metadata file `%s'" % (counter, LOCATION))
+  save_index(index, tmp_keyframes)
+  if args.checksums: save_manifest(manifest, tmp_checksums)
+
+  os.rename(tmp_location, LOCATION)
+  os.rename(tmp_keyframes, KEYFRAMES)
+  if args.checksums: os.rename(tmp_checksums, CHECKSUMS)
+
+  if args.verbose:
+    print("Added %d items to metadata file `%s'" % (counter, LOCATION))
+    print("Saved keyframe index to `%s'" % KEYFRAMES)
+    if args.checksums:
+      print("Saved %d checksums to manifest `%s'" % (len(manifest), CHECKSUMS))
 
   return 0
 
@@ -81,6 +242,13 @@ def add_command(subparsers):
 
   parser.add_argument('-R', '--recreate', action='store_true', default=False,
       help="If set, I'll first erase the current database")
+  parser.add_argument('-I', '--incremental', action='store_true',
+      default=False, help="If set, re-use entries of the current database for sessions whose files did not change (judged by their size and modification time) and only probe new or changed sessions")
+  parser.add_argument('-C', '--checksums', action='store_true',
+      default=False, help="If set, also compute the SHA-256 checksums of all BDF and video files and save them to a manifest, which can be used later by `checkfiles --verify'. With --incremental, checksums of unchanged files are re-used")
+  parser.add_argument('-j', '--jobs', action='store', type=int, default=8,
+      metavar='N',
+      help="Number of threads used to probe session directories (defaults to %(default)s)")
   parser.add_argument('-v', '--verbose', action='count', default=0,
       help="Do operations in a verbose way")
   parser.add_argument('-D', '--basedir', action='store',
@@ -46,13 +46,6 @@ def dumplist(args):
 def create_meta(args):
   """Runs the face detection, heart-rate estimation, save outputs at package"""
 
-  if not args.force:
-    raise RuntimeError("This method will re-write the internal HDF5 files, " \
-        "which contain vital metadata used for generating results." \
-        " Make sure this is what you want to do reading the API for this " \
-        "package first (special attention to the method " \
-        ":py:meth:`File.run_face_detector`).")
-
   from . import Database
   db = Database()
 
@@ -67,7 +60,7 @@ def create_meta(args):
     sys.exit(0)
 
   # if we are on a grid environment, just find what I have to process.
-  if os.environ.has_key('SGE_TASK_ID'):
+  if 'SGE_TASK_ID' in os.environ:
     pos = int(os.environ['SGE_TASK_ID']) - 1
     if pos >= len(objects):
       raise RuntimeError("Grid request for job %d on a setup with %d jobs" % \
@@ -79,33 +72,45 @@ def create_meta(args):
   else:
     basedir = pkg_resources.resource_filename(__name__, 'data')
 
+  cache = None
+  if args.cache_directory:
+    from .cache import ResultCache
+    cache = ResultCache(args.cache_directory, args.cache_size * 2**20)
+
+  from . import pipeline
+  stages = list(pipeline.STAGES)
+  parameters = {
+      'heart_rate_method': 'psd' if args.heart_rate_method == 'psd' else 'qrs',
+      'physiology_window': args.physiology_window,
+      }
+  if args.heart_rate_method in ('qrs', 'both'):
+    stages.extend(pipeline.QRS_STAGES)
+  if args.heart_rate_method == 'both':
+    stages.append(pipeline.HEARTRATE_PSD)
+  if args.physiology:
+    stages.append(pipeline.PHYSIOLOGY)
+
+  from . import instrument
+  if args.profile: instrument.enable()
+
+  compared = []
   for obj in objects:
     output = obj.make_path(basedir, '.hdf5')
-    if os.path.exists(output) and not args.force:
-      print("Skipping `%s' (meta file exists)" % obj.make_path())
-      continue
     try:
-      print("Creating meta data for `%s'..." % obj.make_path())
-      bb = obj.run_face_detector(args.directory, max_frames=1)[0]
-      hr = obj.estimate_heartrate_in_bpm(args.directory)
-      if bb and hr:
-        outdir = os.path.dirname(output)
-        if not os.path.exists(outdir): os.makedirs(outdir)
-        h5 = bob.io.base.HDF5File(output, 'a')
-        h5.create_group('face_detector')
-        h5.cd('face_detector')
-        h5.set('topleft_x', bb.topleft[1])
-        h5.set('topleft_y', bb.topleft[0])
-        h5.set('width', bb.size[1])
-        h5.set('height', bb.size[0])
-        h5.cd('..')
-        h5.set('heartrate', hr)
-        h5.set_attribute('units', 'beats-per-minute', 'heartrate')
+      print("%s meta data for `%s'..." % \
+          ('Checking' if args.dry_run else 'Updating', obj.make_path()))
+      with instrument.session(obj.stem):
+        status = pipeline.run(obj, args.directory, output, stages,
+            parameters, force=args.force, cache=cache, dry_run=args.dry_run)
+      for name, value in status.items():
+        if value != 'fresh': print(" -> %s: %s" % (name, value))
+
+      if args.heart_rate_method == 'both' and os.path.exists(output):
+        h5 = bob.io.base.HDF5File(output)
+        if h5.has_key('heartrate') and h5.has_key('heartrate_psd'):
+          compared.append((h5.get('heartrate'), h5.get('heartrate_psd')))
+          print(" -> Heart-rate (QRS/PSD): %.1f/%.1f bpm" % compared[-1])
         h5.close()
-      else:
-        print("Skipping `%s': Missing Bounding box and/or Heart-rate" % (obj.stem,))
-        print(" -> Bounding box: %s" % bb)
-        print(" -> Heart-rate  : %s" % hr)
 
     except IOError as e:
       print("Skipping `%s': %s" % (obj.stem, str(e)))
@@ -117,9 +122,58 @@ def create_meta(args):
           import shutil
           shutil.rmtree(basedir)
 
+  if compared:
+    reference, estimates = zip(*compared)
+    agreement = 3. #bpm
+    summary = utils.estimator_agreement(reference, estimates, agreement)
+    print("QRS/PSD heart-rate agreement on %d sessions: %.1f%% within %g " \
+        "bpm, mean absolute difference of %.2f bpm" % (summary['count'],
+          100*summary['agreement_rate'], agreement,
+          summary['mean_absolute_difference']))
+
+  if args.profile:
+    instrument.save(instrument.disable().report(), args.profile)
+    print("Saved profile to `%s'" % args.profile)
+
   return 0
 
 
+def _debug_one(obj, directory, output_directory, profile=False):
+  """Creates the debug data for a single object
+
+  The video is decoded once: each frame goes through the face detector and is
+  annotated and written right away. All ECG channels are read in one pass.
+
+  If ``profile`` is set, profiling is turned on for this call and its report
+  is returned (so it can be collected from worker processes).
+  """
+
+  from . import instrument
+  if profile: instrument.enable()
+
+  print("Creating debug data for `%s'..." % obj.make_path())
+  try:
+
+    with instrument.session(obj.stem):
+
+      # save annotated video file
+      output = obj.make_path(output_directory, '.avi')
+      print("Annotating video `%s'" % output)
+      with instrument.stage('annotate_video'):
+        utils.annotate_video(obj.load_video(directory), utils.detect_face,
+            output)
+
+      output = obj.make_path(output_directory, '.pdf')
+      print("Annotating heart-rate `%s'" % output)
+      with instrument.stage('explain_heartrate'):
+        utils.explain_heartrate(obj, directory, output)
+
+  except IOError as e:
+    print("Skipping `%s': %s" % (obj.stem, str(e)))
+
+  if profile: return instrument.disable().report()
+
+
 def debug(args):
   """Debugs the face detection and heart-rate estimation"""
 
@@ -138,40 +192,64 @@ def debug(args):
     sys.exit(0)
 
   # if we are on a grid environment, just find what I have to process.
-  if os.environ.has_key('SGE_TASK_ID'):
+  if 'SGE_TASK_ID' in os.environ:
     pos = int(os.environ['SGE_TASK_ID']) - 1
     if pos >= len(objects):
       raise RuntimeError("Grid request for job %d on a setup with %d jobs" % \
           (pos, len(objects)))
     objects = [objects[pos]]
 
-  basedir = 'debug'
+  try:
+
+    profile = bool(args.profile)
+    if args.jobs > 1:
+      import multiprocessing
+      pool = multiprocessing.Pool(args.jobs)
+      try:
+        reports = pool.starmap(_debug_one, [(obj, args.directory,
+          args.output_directory, profile) for obj in objects], chunksize=1)
+      finally:
+        pool.close()
+        pool.join()
+
+    else:
+      reports = [_debug_one(obj, args.directory, args.output_directory,
+        profile) for obj in objects]
+
+    if profile:
+      from .instrument import Profiler, save
+      profiler = Profiler()
+      for report in reports: profiler.merge(report)
+      save(profiler.report(), args.profile)
+      print("Saved profile to `%s'" % args.profile)
+
+  finally:
+    if args.selftest:
+      if os.path.exists(args.output_directory):
+        import shutil
+        shutil.rmtree(args.output_directory)
 
-  for obj in objects:
-    print("Creating debug data for `%s'..." % obj.make_path())
-    try:
+  return 0
 
-      detections = obj.run_face_detector(args.directory)
-      # save annotated video file
-      output = obj.make_path(args.output_directory, '.avi')
-      print("Annotating video `%s'" % output)
-      utils.annotate_video(obj.load_video(args.directory), detections, output)
 
-      print("Annotating heart-rate `%s'" % output)
-      output = obj.make_path(args.output_directory, '.pdf')
-      utils.explain_heartrate(obj, args.directory, output)
+def _list_session(directory):
+  """Lists the names of the entries of a session directory, once"""
 
-    except IOError as e:
-      print("Skipping `%s': %s" % (obj.stem, str(e)))
-      continue
+  try:
+    return set(k.name for k in os.scandir(directory))
+  except OSError:
+    return set()
 
-    finally:
-      if args.selftest:
-        if os.path.exists(args.output_directory):
-          import shutil
-          shutil.rmtree(args.output_directory)
 
-  return 0
+def _verify(path, digest):
+  """Checks if the contents of ``path`` match the SHA-256 ``digest``"""
+
+  from .manifest import checksum
+
+  try:
+    return checksum(path) == digest
+  except (IOError, OSError):
+    return False
 
 
 def checkfiles(args):
@@ -182,11 +260,20 @@ def checkfiles(args):
 
   objects = db.objects()
 
+  # list each session directory once, concurrently, and check the files on
+  # the listings
+  from concurrent.futures import ThreadPoolExecutor
+  basedirs = sorted(set(obj.basedir for obj in objects))
+  with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    listings = dict(zip(basedirs, executor.map(_list_session,
+      [os.path.join(args.directory, k) for k in basedirs])))
+
   # go through all files, check if they are available on the filesystem
   good = []
   bad = []
   for obj in objects:
-    if os.path.exists(obj.make_path(directory=args.directory, extension=args.extension)): good.append(obj)
+    name = os.path.basename(obj.make_path(extension=args.extension))
+    if name in listings[obj.basedir]: good.append(obj)
     else: bad.append(obj)
 
   # report
@@ -201,6 +288,243 @@ def checkfiles(args):
     output.write('%d files (out of %d) were not found at "%s"\n' % \
         (len(bad), len(objects), args.directory))
 
+  if not args.verify: return 0
+
+  # verifies the contents of the raw files against the checksum manifest
+  from . import CHECKSUMS
+  from .manifest import load_manifest
+  manifest = load_manifest(CHECKSUMS)
+  if not manifest:
+    raise RuntimeError("Checksum manifest `%s' is not available - run `bob_dbmanage.py hci_tagging create --checksums' first" % CHECKSUMS)
+
+  names = [os.path.join(obj.basedir, k) for obj in good \
+      for k in (obj.stem + '.bdf', obj.video_stem + '.avi')]
+  names = [k for k in names if k in manifest]
+  with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    results = executor.map(_verify,
+        [os.path.join(args.directory, k) for k in names],
+        [manifest[k] for k in names])
+    corrupted = [k for k, ok in zip(names, results) if not ok]
+
+  for name in corrupted:
+    output.write('Checksum mismatch for file "%s"\n' % \
+        (os.path.join(args.directory, name),))
+  output.write('%d files (out of %d) failed verification at "%s"\n' % \
+      (len(corrupted), len(names), args.directory))
+
+  return 1 if corrupted else 0
+
+
+def _crop_face(frames, boxes, first):
+  """Crops frames around the face bounding box of the first frame of a window
+
+  Uses the box of the closest annotated frame at or before ``first`` (or the
+  first available one), so all frames of a window have the same size.
+  """
+
+  if not boxes: return frames
+  previous = [k for k in boxes if k <= first]
+  bb = boxes[max(previous)] if previous else boxes[min(boxes)]
+  y, x = [max(int(round(k)), 0) for k in bb.topleft]
+  h, w = [int(round(k)) for k in bb.size]
+  return frames[:, :, y:y+h, x:x+w]
+
+
+class _Exporter(object):
+  """Loads a window of a session as a record for a shard"""
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def __call__(self, window):
+    obj = window.file
+    try:
+      boxes = obj.load_face_detection()
+      heart_rate = float(obj.load_heart_rate_in_bpm())
+      frames = window.load_video(self.directory)
+      signals, freq = window.load_signals(self.directory)
+    except IOError as e:
+      print("Skipping `%s': %s" % (obj.stem, str(e)))
+      return None
+    frame_rate = obj.frame_rate or \
+        float(len(frames)) / (window.end - window.start)
+    frames = _crop_face(frames, boxes, int(round(window.start * frame_rate)))
+    arrays = {'frames': frames, 'signals': signals.astype('float32')}
+    metadata = dict(session=obj.stem, start=window.start, end=window.end,
+        heart_rate=heart_rate, frame_rate=float(frame_rate),
+        sampling_frequency=float(freq))
+    return arrays, metadata
+
+
+def export(args):
+  """Exports samples into sequential shard files, for fast streaming"""
+
+  from . import Database
+  from .shards import ShardWriter
+  from .loader import prefetch
+  db = Database()
+
+  objects = db.objects(args.protocol, args.subset)
+  if args.selftest:
+    objects = objects[:2]
+  if args.limit:
+    objects = objects[:args.limit]
+
+  from .windows import WindowIndex
+  windows = WindowIndex(objects, args.window_length, args.window_step)
+
+  try:
+
+    with ShardWriter(args.output_directory, ('frames', 'signals'),
+        args.shard_size * 2**20) as writer:
+      for k, record in enumerate(prefetch(_Exporter(args.directory),
+          windows, args.jobs, 2*args.jobs)):
+        if record is None: continue
+        arrays, metadata = record
+        writer.append(arrays, **metadata)
+        if args.verbose:
+          print("[%d/%d] `%s' %g-%gs" % (k+1, len(windows),
+            metadata['session'], metadata['start'], metadata['end']))
+
+    print("Exported %d samples into %d shard(s) at `%s'" % \
+        (len(writer.records), len(writer.shards), args.output_directory))
+
+  finally:
+    if args.selftest:
+      if os.path.exists(args.output_directory):
+        import shutil
+        shutil.rmtree(args.output_directory)
+
+  return 0
+
+
+def tabulate(args):
+  """Exports metadata, protocols and labels of all sessions as a columnar table"""
+
+  from . import Database
+  from . import table
+
+  db = Database(shared=args.shared or None)
+
+  columns = table.columns(db, labels=not args.no_labels)
+  data = table.to_arrow(columns)
+  if args.selftest: return 0
+
+  table.write(data, args.output)
+  print("Saved %d sessions (%d columns) to `%s'" % (data.num_rows,
+    data.num_columns, args.output))
+
+  return 0
+
+
+def _load_predictions(path):
+  """Loads predictions from a JSON dictionary or a two-column CSV file"""
+
+  if path.endswith('.json'):
+    import json
+    with open(path, 'rt') as f: return dict((k, float(v)) for k, v in \
+        json.load(f).items())
+
+  import csv
+  retval = {}
+  with open(path, 'rt') as f:
+    for k, row in enumerate(csv.reader(f)):
+      if len(row) < 2 or row[0].startswith('#'): continue
+      try:
+        retval[row[0]] = float(row[1])
+      except ValueError:
+        if k == 0: continue #header
+        raise
+  return retval
+
+
+def evaluate(args):
+  """Evaluates heart-rate predictions against the stored ground truth"""
+
+  from . import Database
+  from . import evaluation
+
+  db = Database(shared=args.shared or None)
+  predictions = _load_predictions(args.predictions)
+  if args.selftest: args.rounds = min(args.rounds, 100)
+
+  groups = [('all', 'train'), ('all', 'dev'), ('all', 'test'),
+      ('cvpr14', None)]
+  if args.protocol: groups = [k for k in groups if k[0] == args.protocol]
+
+  results = evaluation.evaluate(db, predictions, groups, args.rounds,
+      args.confidence, args.seed)
+
+  report = {}
+  for (protocol, subset), value in results.items():
+    name = protocol if subset is None else '%s/%s' % (protocol, subset)
+    report[name] = value
+    print("%s: %d session(s), %d missing" % (name, value['count'],
+      value['missing']))
+    for metric in evaluation.METRICS:
+      low, high = value['intervals'][metric]
+      print("  %-8s %8.3f [%.3f, %.3f]" % (metric, value['metrics'][metric],
+        low, high))
+
+  if args.output:
+    import json
+    import math
+    def _null(value): #NaN is not valid JSON
+      if isinstance(value, dict):
+        return dict((k, _null(v)) for k, v in value.items())
+      if isinstance(value, (list, tuple)): return [_null(k) for k in value]
+      if isinstance(value, float) and math.isnan(value): return None
+      return value
+    with open(args.output, 'wt') as f:
+      json.dump(_null(report), f, indent=2, sort_keys=True)
+    print("Saved results to `%s'" % args.output)
+
+  return 0
+
+
+def benchmark(args):
+  """Benchmarks the database access API on a synthetic database"""
+
+  import json
+  import tempfile
+  from . import synthetic
+  from .benchmark import run, environment
+
+  if args.selftest:
+    args.sessions, args.duration, args.repeat = 2, 4., 1
+
+  directory = args.directory or tempfile.mkdtemp(prefix='hci_tagging-')
+  paths = synthetic.layout(directory)
+
+  try:
+
+    if os.path.exists(paths['location']):
+      print("Re-using synthetic database at `%s'" % directory)
+    else:
+      print("Generating %d synthetic sessions at `%s'..." % (args.sessions,
+        directory))
+      synthetic.generate(directory, sessions=args.sessions,
+          duration=args.duration, seed=args.seed, jobs=args.jobs)
+
+    parameters = dict(sessions=args.sessions, duration=args.duration,
+        repeat=args.repeat, seed=args.seed, jobs=args.jobs)
+    results = run(paths, args.repeat, args.jobs)
+    for name, value in sorted(results.items()):
+      if 'error' in value: print("%-35s error: %s" % (name, value['error']))
+      else: print("%-35s %.4fs (best of %d)" % (name, value['best'],
+        len(value['times'])))
+
+    report = {'environment': environment(), 'parameters': parameters,
+        'results': results}
+    if not args.selftest:
+      with open(args.output, 'wt') as f: json.dump(report, f, indent=2)
+      print("Saved results to `%s'" % args.output)
+
+  finally:
+    if not args.directory:
+      import shutil
+      shutil.rmtree(directory)
+
   return 0
 
 
@@ -252,6 +576,8 @@ class Interface(BaseInterface):
     check_parser = subparsers.add_parser('checkfiles', help=check_message)
     check_parser.add_argument('-d', '--directory', dest="directory", default=DATABASE_LOCATION, help="if given, this path will be prepended to every entry returned (defaults to '%(default)s')")
     check_parser.add_argument('-e', '--extension', dest="extension", default='', help="if given, this extension will be appended to every entry returned (defaults to '%(default)s')")
+    check_parser.add_argument('-j', '--jobs', dest="jobs", default=8, type=int, help="Number of threads used to list directories and verify file contents (defaults to '%(default)s')")
+    check_parser.add_argument('--verify', dest="verify", default=False, action='store_true', help="If set, also verify the contents of the BDF and video files of existing sessions against the checksum manifest created with `create --checksums'. Exits with a non-zero status if any file does not match")
     check_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
     check_parser.set_defaults(func=checkfiles) #action
 
@@ -260,8 +586,15 @@ class Interface(BaseInterface):
     meta_parser = subparsers.add_parser('mkmeta', help=create_meta.__doc__)
     meta_parser.add_argument('-d', '--directory', dest="directory", default=DATABASE_LOCATION, help="This path points to the location where the database raw files are installed (defaults to '%(default)s')")
     meta_parser.add_argument('--grid-count', dest="grid_count", default=False, action='store_true', help=SUPPRESS)
-    meta_parser.add_argument('--force', dest="force", default=False, action='store_true', help='If set, will overwrite existing meta files if they exist. Otherwise, just run on unexisting data')
+    meta_parser.add_argument('--force', dest="force", default=False, action='store_true', help='If set, recomputes and overwrites all outputs on existing meta files. Otherwise, only outputs that are missing or stale (whose raw files, parameters or code changed since they were computed) are recomputed, so interrupted runs resume where they stopped')
+    meta_parser.add_argument('--dry-run', dest="dry_run", default=False, action='store_true', help='If set, only reports which outputs are missing or stale, without computing anything')
     meta_parser.add_argument('--limit', dest="limit", default=0, type=int, help="Limits the number of objects to treat (defaults to '%(default)')")
+    meta_parser.add_argument('--cache-directory', dest="cache_directory", default='', help="If set, results of face detection and heart-rate estimation are cached on this directory, keyed by the raw files they were computed from and the parameters used, so re-runs skip them (defaults to '%(default)s')")
+    meta_parser.add_argument('--cache-size', dest="cache_size", default=1024, type=int, help="Maximum size of the cache, in megabytes. Least recently used results are evicted first (defaults to '%(default)s')")
+    meta_parser.add_argument('--heart-rate-method', dest="heart_rate_method", default='qrs', choices=('qrs', 'psd', 'both'), help="Heart-rate estimator to use: `qrs' detects QRS complexes on each ECG channel, `psd' picks the dominant cardiac frequency on their power spectra (faster, for screening) and `both' stores the QRS-based estimate as well as the PSD-based one, and reports their agreement (defaults to '%(default)s')")
+    meta_parser.add_argument('--physiology', dest="physiology", default=False, action='store_true', help="If set, also stores the breathing rate, skin conductance level and responses and skin temperature slope, per window, computed from the `Resp', `GSR1' and `Temp' channels")
+    meta_parser.add_argument('--physiology-window', dest="physiology_window", default=30., type=float, help="The length of windows physiological features are computed on, in seconds (defaults to '%(default)s')")
+    meta_parser.add_argument('--profile', dest="profile", default='', metavar='REPORT', help="If set, measures the wall time, bytes read and peak memory of each processing stage (BDF reading, QRS detection, video decoding, face detection and HDF5 writing), per session, and saves the aggregate to this JSON file")
     meta_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
     meta_parser.set_defaults(func=create_meta) #action
 
@@ -272,5 +605,54 @@ class Interface(BaseInterface):
     debug_parser.add_argument('-o', '--output-directory', dest="output_directory", default='debug', help="This path points to the location where the debugging results will be stored (defaults to '%(default)s')")
     debug_parser.add_argument('--grid-count', dest="grid_count", default=False, action='store_true', help=SUPPRESS)
     debug_parser.add_argument('--limit', dest="limit", default=0, type=int, help="Limits the number of objects to treat (defaults to '%(default)')")
+    debug_parser.add_argument('-j', '--jobs', dest="jobs", default=1, type=int, help="Number of sessions to process concurrently, each on its own process (defaults to '%(default)s')")
+    debug_parser.add_argument('--profile', dest="profile", default='', metavar='REPORT', help="If set, measures the wall time, bytes read and peak memory of each processing stage, per session, and saves the aggregate to this JSON file")
     debug_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
     debug_parser.set_defaults(func=debug) #action
+
+    # export
+    export_parser = subparsers.add_parser('export', help=export.__doc__)
+    export_parser.add_argument('-d', '--directory', dest="directory", default=DATABASE_LOCATION, help="This path points to the location where the database raw files are installed (defaults to '%(default)s')")
+    export_parser.add_argument('-o', '--output-directory', dest="output_directory", default='shards', help="This path points to the location where the shard files and their index will be stored (defaults to '%(default)s')")
+    export_parser.add_argument('-p', '--protocol', dest="protocol", default='all', choices=('all', 'cvpr14'), help="The protocol of the samples to export (defaults to '%(default)s')")
+    export_parser.add_argument('-s', '--subset', dest="subset", default=None, action='append', choices=('train', 'dev', 'test'), help="The subset(s) of the samples to export. May be given multiple times. If not set, all subsets of the protocol are exported")
+    export_parser.add_argument('-l', '--window-length', dest="window_length", default=10., type=float, help="Each session is split into windows of this length, in seconds. Each window is one sample (defaults to '%(default)s')")
+    export_parser.add_argument('--window-step', dest="window_step", default=None, type=float, help="The time between the start of two consecutive windows of a session, in seconds. If not set, windows do not overlap")
+    export_parser.add_argument('--shard-size', dest="shard_size", default=1024, type=int, help="Approximate size of each shard, in megabytes (defaults to '%(default)s')")
+    export_parser.add_argument('-j', '--jobs', dest="jobs", default=4, type=int, help="Number of threads loading samples while others are written (defaults to '%(default)s')")
+    export_parser.add_argument('--limit', dest="limit", default=0, type=int, help="Limits the number of objects to treat (defaults to '%(default)')")
+    export_parser.add_argument('-v', '--verbose', dest="verbose", default=False, action='store_true', help="If set, prints each exported sample")
+    export_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
+    export_parser.set_defaults(func=export) #action
+
+    # table
+    table_parser = subparsers.add_parser('table', help=tabulate.__doc__)
+    table_parser.add_argument('-o', '--output', dest="output", default='hci_tagging.arrow', help="The file where the table is saved. Files ending in `.parquet' are written in Parquet format, others as uncompressed Arrow IPC files, which can be memory-mapped (defaults to '%(default)s')")
+    table_parser.add_argument('--shared', dest="shared", default='', help="If set, the metadata and protocols are read from (and, if needed, compiled into) the memory-mapped index on this directory")
+    table_parser.add_argument('--no-labels', dest="no_labels", default=False, action='store_true', help="If set, only the descriptor columns and protocol membership are exported, without reading the metadata file of each session")
+    table_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
+    table_parser.set_defaults(func=tabulate) #action
+
+    # evaluate
+    eval_parser = subparsers.add_parser('evaluate', help=evaluate.__doc__)
+    eval_parser.add_argument('predictions', help="The file with the predicted heart-rate of each session, in beats-per-minute: a JSON dictionary, or a CSV file with two columns, keyed by the stem of the BDF file of each session or its base directory (e.g. `Sessions/3884')")
+    eval_parser.add_argument('-p', '--protocol', dest="protocol", default=None, choices=('all', 'cvpr14'), help="If set, only evaluates on this protocol. Otherwise, results are reported for all protocols and subsets")
+    eval_parser.add_argument('-r', '--rounds', dest="rounds", default=2000, type=int, help="Number of bootstrap resamples used to compute confidence intervals (defaults to '%(default)s')")
+    eval_parser.add_argument('-c', '--confidence', dest="confidence", default=0.95, type=float, help="Confidence level of the intervals (defaults to '%(default)s')")
+    eval_parser.add_argument('--seed', dest="seed", default=0, type=int, help="Seed for the bootstrap resampling (defaults to '%(default)s')")
+    eval_parser.add_argument('-o', '--output', dest="output", default='', help="If set, results are also saved to this file, in JSON format")
+    eval_parser.add_argument('--shared', dest="shared", default='', help="If set, the metadata and ground truth are read from (and, if needed, compiled into) the memory-mapped index on this directory")
+    eval_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
+    eval_parser.set_defaults(func=evaluate) #action
+
+    # benchmark
+    bench_parser = subparsers.add_parser('benchmark', help=benchmark.__doc__)
+    bench_parser.add_argument('-o', '--output', dest="output", default='benchmark.json', help="The file where results are saved, in JSON format, for comparison across versions (defaults to '%(default)s')")
+    bench_parser.add_argument('-d', '--directory', dest="directory", default='', help="The directory holding the synthetic database. It is generated if it does not contain one already, and kept after the run. If not set, a temporary one is generated and removed at the end")
+    bench_parser.add_argument('-n', '--sessions', dest="sessions", default=10, type=int, help="Number of synthetic sessions to generate (defaults to '%(default)s')")
+    bench_parser.add_argument('--duration', dest="duration", default=10., type=float, help="Duration of each synthetic session, in seconds (defaults to '%(default)s')")
+    bench_parser.add_argument('-r', '--repeat', dest="repeat", default=3, type=int, help="Number of times each benchmark is run (defaults to '%(default)s')")
+    bench_parser.add_argument('--seed', dest="seed", default=0, type=int, help="Seed for the generation of the synthetic database (defaults to '%(default)s')")
+    bench_parser.add_argument('-j', '--jobs', dest="jobs", default=4, type=int, help="Number of threads used to scan the raw files (defaults to '%(default)s')")
+    bench_parser.add_argument('--self-test', dest="selftest", default=False, action='store_true', help=SUPPRESS)
+    bench_parser.set_defaults(func=benchmark) #action
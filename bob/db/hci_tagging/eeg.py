@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Band-power features of the EEG signals, per channel and window
+
+All 32 electrodes of the EEG cap are read from the BDF file of a session in a
+single pass (see :py:func:`bob.db.hci_tagging.utils.bdf_load_signals`). The
+signals are then cut into (possibly overlapping) windows, without copies, and
+the power spectral density of every window of every channel is estimated at
+once with Welch's method. Band powers are obtained by integrating these
+spectra over each band, with a single matrix product. Features of a session
+are returned as a compact 3D array of 32-bit floats in
+(window,channel,band) notation.
+'''
+
+import numpy
+
+
+CHANNELS = (
+    'Fp1', 'AF3', 'F3', 'F7', 'FC5', 'FC1', 'C3', 'T7',
+    'CP5', 'CP1', 'P3', 'P7', 'PO3', 'O1', 'Oz', 'Pz',
+    'Fp2', 'AF4', 'Fz', 'F4', 'F8', 'FC6', 'FC2', 'Cz',
+    'C4', 'T8', 'CP6', 'CP2', 'P4', 'P8', 'PO4', 'O2',
+    )
+"""The 32 electrodes of the EEG cap, in the order of the BDF files"""
+
+
+BANDS = (
+    ('delta', (1., 4.)),
+    ('theta', (4., 8.)),
+    ('alpha', (8., 13.)),
+    ('beta', (13., 30.)),
+    ('gamma', (30., 45.)),
+    )
+"""The default frequency bands, as ``(name, (low, high))`` tuples, in Hz"""
+
+
+def _bands(frequencies, bands):
+  '''Returns a matrix integrating spectra over each band
+
+  Multiplying a spectrum (frequencies along its last axis) by this matrix
+  yields the power on each band: each column is 1 for the frequencies on a
+  band (lower limit included, upper limit excluded), times the frequency
+  resolution.
+  '''
+
+  resolution = frequencies[1] - frequencies[0]
+  retval = numpy.zeros((len(frequencies), len(bands)))
+  for k, (name, (low, high)) in enumerate(bands):
+    retval[(frequencies >= low) & (frequencies < high), k] = resolution
+  return retval
+
+
+def band_powers(signals, sampling_frequency, length=2., step=None,
+    segment=1., bands=BANDS, chunk=256):
+  '''Computes the power of each signal on each band, in windows
+
+  Parameters:
+
+    signals (numpy.ndarray): A 2D array in (channel,sample) notation, as
+      returned by :py:func:`bob.db.hci_tagging.utils.bdf_load_signals`
+
+    sampling_frequency (float): The sampling frequency of the signals, in Hz
+
+    length (float): The length of each window, in seconds
+
+    step (float, optional): The time between the start of consecutive
+      windows, in seconds. If not set, windows do not overlap.
+
+    segment (float): The length of segments for Welch's method, in seconds.
+      It is reduced to ``length`` if longer.
+
+    bands (tuple): The frequency bands, see :py:data:`BANDS`
+
+    chunk (int): The number of windows whose spectra are estimated at once,
+      which bounds the memory used for long recordings
+
+
+  Returns:
+
+    numpy.ndarray: A 3D array of 32-bit floats in (window,channel,band)
+    notation, with the power of each band (in squared units of the signals).
+    Window ``k`` starts at ``k*step`` seconds. Signals shorter than one window
+    yield no windows.
+
+  '''
+
+  import scipy.signal
+
+  signals = numpy.atleast_2d(numpy.asarray(signals, dtype='float64'))
+  fs = float(sampling_frequency)
+  size = int(round(length*fs))
+  stride = int(round((step or length)*fs))
+  if size < 1 or stride < 1:
+    raise ValueError("windows of %g seconds with steps of %g seconds are empty at %g Hz" % (length, step or length, fs))
+
+  nperseg = min(int(round(segment*fs)), size)
+  frequencies = numpy.fft.rfftfreq(nperseg, 1./fs)
+  integrate = _bands(frequencies, bands)
+
+  if signals.shape[1] < size:
+    return numpy.zeros((0, len(signals), len(bands)), dtype='float32')
+
+  # a (window,channel,sample) view of the signals, without copies
+  windows = numpy.lib.stride_tricks.sliding_window_view(signals, size,
+      axis=1)[:, ::stride].transpose(1, 0, 2)
+
+  retval = numpy.empty(windows.shape[:2] + (len(bands),), dtype='float32')
+  for start in range(0, len(windows), chunk):
+    block = windows[start:start+chunk]
+    _, power = scipy.signal.welch(block, fs, nperseg=nperseg,
+        detrend='constant', axis=-1)
+    retval[start:start+chunk] = numpy.dot(power, integrate)
+  return retval
+
+
+def session_band_powers(obj, directory, channels=CHANNELS, length=2.,
+    step=None, segment=1., bands=BANDS, cache=None):
+  '''Computes the EEG band powers of a session
+
+  Parameters:
+
+    obj (bob.db.hci_tagging.File): The session to process
+
+    directory (str): The path to the root of the database installation
+
+    channels (tuple): The names of the EEG channels to use, see
+      :py:data:`CHANNELS`
+
+    length, step, segment, bands: See :py:func:`band_powers`
+
+    cache (bob.db.hci_tagging.cache.ResultCache, optional): If set, the band
+      powers are looked up on (and, if missing, stored in) this cache, keyed
+      by the identity of the BDF file, its synchronization markers and all
+      other parameters
+
+
+  Returns:
+
+    numpy.ndarray: A 3D array of 32-bit floats in (window,channel,band)
+    notation, see :py:func:`band_powers`
+
+  '''
+
+  channels = tuple(channels)
+  bands = tuple((k, tuple(v)) for k, v in bands)
+
+  def _band_powers():
+    signals, freq = obj.load_signals(directory, channels)
+    return band_powers(signals, freq, length, step, segment, bands)
+
+  if cache is None: return _band_powers()
+  return cache.memoize(_band_powers, [obj.make_path(directory)],
+      'eeg_band_powers', channels=channels, length=length, step=step,
+      segment=segment, bands=bands, sync=obj.sync, version=1)
+
+
+def features(objects, directory, channels=CHANNELS, length=2., step=None,
+    segment=1., bands=BANDS, cache=None, workers=4):
+  '''Computes the EEG band powers of many sessions
+
+  Sessions are processed in background threads (reading the BDF files and
+  the spectral estimation release the interpreter lock).
+
+
+  Parameters:
+
+    objects (list): A list of :py:class:`bob.db.hci_tagging.File` objects
+
+    directory (str): The path to the root of the database installation
+
+    channels, length, step, segment, bands, cache: See
+      :py:func:`session_band_powers`
+
+    workers (int): The number of sessions processed at once
+
+
+  Returns:
+
+    list: One 3D array of 32-bit floats in (window,channel,band) notation
+    per object, see :py:func:`band_powers`
+
+  '''
+
+  from .loader import prefetch
+
+  def _session(obj):
+    return session_band_powers(obj, directory, channels, length, step,
+        segment, bands, cache)
+
+  return list(prefetch(_session, objects, workers=max(workers, 1)))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Evaluation of heart-rate estimates against the stored ground truth
+
+Predictions of a remote heart-rate (rPPG) method, one per session, are
+compared with the average heart-rate stored on the metadata of each session
+(see :py:meth:`bob.db.hci_tagging.File.load_heart_rate_in_bpm`). All
+statistics are computed along the last axis of their inputs, so the ones of
+thousands of bootstrap resamples are obtained with a few array operations on
+a (resample,session) matrix, instead of a loop over resamples.
+'''
+
+import numpy
+
+
+METRICS = ('mae', 'rmse', 'pearson', 'bias', 'sd', 'loa_low', 'loa_high')
+"""The names of the statistics returned by :py:func:`metrics`"""
+
+
+def ground_truth(db, objects):
+  '''Loads the average heart-rate of many sessions
+
+  If the database uses a shared index (see :py:mod:`bob.db.hci_tagging.shared`)
+  heart-rates are gathered from it, without opening any file. Otherwise, the
+  metadata file of each session is read.
+
+
+  Parameters:
+
+    db (bob.db.hci_tagging.Database): The database
+
+    objects (list): The :py:class:`bob.db.hci_tagging.File` objects to load
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the heart-rate of each object, in
+    beats-per-minute (NaN where not available)
+
+  '''
+
+  if db.shared is not None and all(k.shared for k in objects):
+    return numpy.array(db.shared.heart_rates[[k.shared[1] for k in objects]],
+        dtype='float64')
+
+  retval = numpy.full(len(objects), numpy.nan)
+  for k, obj in enumerate(objects):
+    try:
+      retval[k] = obj.load_heart_rate_in_bpm()
+    except IOError:
+      pass
+  return retval
+
+
+def match(predictions, objects):
+  '''Orders predictions as a list of objects
+
+  Parameters:
+
+    predictions (dict): The predicted heart-rate (in beats-per-minute) of
+      each session, keyed by the stem of its BDF file (:py:attr:`File.stem`)
+      or its base directory (e.g. ``Sessions/3884``)
+
+    objects (list): The :py:class:`bob.db.hci_tagging.File` objects
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the prediction for each object (NaN where
+    missing)
+
+  '''
+
+  return numpy.array([predictions.get(k.stem, predictions.get(k.basedir,
+    numpy.nan)) for k in objects], dtype='float64')
+
+
+def metrics(predictions, truth):
+  '''Computes error and agreement statistics along the last axis
+
+  Parameters:
+
+    predictions (numpy.ndarray): The predicted heart-rates, in
+      beats-per-minute, with sessions along the last axis
+
+    truth (numpy.ndarray): The ground-truth heart-rates, with the same shape
+
+
+  Returns:
+
+    dict: A dictionary where each value has the shape of the inputs without
+    their last axis and keys are:
+
+      * ``mae``: The mean absolute error, in beats-per-minute
+      * ``rmse``: The root mean square error, in beats-per-minute
+      * ``pearson``: The Pearson correlation coefficient (NaN if either input
+        is constant)
+      * ``bias``: The mean difference (predictions minus truth), in
+        beats-per-minute, as on Bland-Altman plots
+      * ``sd``: The standard deviation of differences, in beats-per-minute
+      * ``loa_low`` and ``loa_high``: The Bland-Altman limits of agreement
+        (``bias`` minus and plus 1.96 ``sd``), in beats-per-minute
+
+  '''
+
+  predictions = numpy.asarray(predictions, dtype='float64')
+  truth = numpy.asarray(truth, dtype='float64')
+
+  error = predictions - truth
+  bias = error.mean(axis=-1)
+  sd = error.std(axis=-1, ddof=1) if error.shape[-1] > 1 else \
+      numpy.full(bias.shape, numpy.nan)
+
+  p = predictions - predictions.mean(axis=-1, keepdims=True)
+  t = truth - truth.mean(axis=-1, keepdims=True)
+  with numpy.errstate(invalid='ignore', divide='ignore'):
+    pearson = (p * t).sum(axis=-1) / \
+        numpy.sqrt((p**2).sum(axis=-1) * (t**2).sum(axis=-1))
+
+  return {
+      'mae': numpy.abs(error).mean(axis=-1),
+      'rmse': numpy.sqrt((error**2).mean(axis=-1)),
+      'pearson': pearson,
+      'bias': bias,
+      'sd': sd,
+      'loa_low': bias - 1.96 * sd,
+      'loa_high': bias + 1.96 * sd,
+      }
+
+
+def bootstrap(predictions, truth, rounds=2000, confidence=0.95, seed=0,
+    chunk=1000):
+  '''Computes percentile bootstrap confidence intervals of all statistics
+
+  Sessions are resampled with replacement ``rounds`` times. The statistics
+  of (up to) ``chunk`` resamples are computed at once, on a
+  (resample,session) matrix.
+
+
+  Parameters:
+
+    predictions (numpy.ndarray): A 1D array with the predicted heart-rates
+
+    truth (numpy.ndarray): A 1D array with the ground-truth heart-rates
+
+    rounds (int): The number of resamples
+
+    confidence (float): The confidence level of intervals
+
+    seed (int): The seed of the random number generator
+
+    chunk (int): The maximum number of resamples evaluated at once
+
+
+  Returns:
+
+    dict: A dictionary with the same keys as :py:func:`metrics`, where each
+    value is a tuple with the lower and upper limits of the interval (NaN if
+    there are no sessions)
+
+  '''
+
+  predictions = numpy.asarray(predictions, dtype='float64')
+  truth = numpy.asarray(truth, dtype='float64')
+  tail = 100. * (1. - confidence) / 2.
+
+  if not len(predictions) or not rounds:
+    return dict((k, (numpy.nan, numpy.nan)) for k in METRICS)
+
+  random = numpy.random.RandomState(seed)
+  samples = {}
+  for start in range(0, rounds, chunk):
+    size = min(chunk, rounds - start)
+    index = random.randint(0, len(predictions), (size, len(predictions)))
+    for name, value in metrics(predictions[index], truth[index]).items():
+      samples.setdefault(name, []).append(value)
+
+  retval = {}
+  for name, value in samples.items():
+    low, high = numpy.nanpercentile(numpy.concatenate(value),
+        [tail, 100. - tail])
+    retval[name] = (float(low), float(high))
+  return retval
+
+
+def evaluate(db, predictions, groups=(('all', 'train'), ('all', 'dev'),
+    ('all', 'test'), ('cvpr14', None)), rounds=2000, confidence=0.95,
+    seed=0):
+  '''Evaluates predictions on each protocol and subset
+
+
+  Parameters:
+
+    db (bob.db.hci_tagging.Database): The database
+
+    predictions (dict): The predicted heart-rate of each session, see
+      :py:func:`match`
+
+    groups (list): The ``(protocol, subset)`` pairs to evaluate on, with the
+      same meaning as on :py:meth:`bob.db.hci_tagging.Database.objects`
+
+    rounds, confidence, seed: See :py:func:`bootstrap`
+
+
+  Returns:
+
+    dict: The results on each ``(protocol, subset)`` pair. Each result is a
+    dictionary with the number of evaluated sessions (``count``), the number
+    of sessions without a prediction or ground truth (``missing``), the
+    statistics (``metrics``, see :py:func:`metrics`) and their confidence
+    intervals (``intervals``, see :py:func:`bootstrap`)
+
+  '''
+
+  retval = {}
+  for protocol, subset in groups:
+    objects = db.objects(protocol, subset)
+    estimated = match(predictions, objects)
+    truth = ground_truth(db, objects)
+    valid = ~(numpy.isnan(estimated) | numpy.isnan(truth))
+
+    if valid.any():
+      values = dict((k, float(v)) for k, v in \
+          metrics(estimated[valid], truth[valid]).items())
+    else:
+      values = dict((k, numpy.nan) for k in METRICS)
+
+    retval[(protocol, subset)] = {
+        'count': int(valid.sum()),
+        'missing': int((~valid).sum()),
+        'metrics': values,
+        'intervals': bootstrap(estimated[valid], truth[valid], rounds,
+          confidence, seed),
+        }
+
+  return retval
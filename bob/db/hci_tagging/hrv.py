@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Heart-rate variability (HRV) features computed from stored R-peaks
+
+All features are computed for many sessions at once: RR interval series of
+different lengths are packed into a NaN-padded matrix with one row per
+session, so statistics reduce along the last axis of this matrix. The R-peaks
+are loaded from the metadata files of each session (see
+:py:meth:`bob.db.hci_tagging.File.load_peaks`), so the BDF files are not read.
+'''
+
+import numpy
+
+
+def rr_intervals(peaks, sampling_frequency, low=30., high=240.):
+  '''Computes the RR intervals from the sample indexes of R-peaks
+
+  Intervals corresponding to instantaneous rates lower than ``low`` or higher
+  than ``high`` beats-per-minute are considered artifacts and removed, as it
+  is done for the average heart-rate estimation (see
+  :py:func:`bob.db.hci_tagging.utils.estimate_average_heartrate`).
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array of 64-bit floats with the RR intervals, in
+    seconds
+
+  '''
+
+  rr = numpy.diff(numpy.asarray(peaks, dtype='float64')) / sampling_frequency
+  return rr[(rr > 60./high) & (rr < 60./low)]
+
+
+def _pack(series):
+  '''Packs a list of 1D arrays into a NaN-padded 2D array'''
+
+  size = max([len(k) for k in series] + [0])
+  retval = numpy.full((len(series), size), numpy.nan)
+  for row, k in zip(retval, series): row[:len(k)] = k
+  return retval
+
+
+def time_domain(rr):
+  '''Computes time-domain HRV features for many sessions at once
+
+
+  Parameters:
+
+    rr (list): A list with one 1D array of RR intervals, in seconds, per
+      session, as returned by :py:func:`rr_intervals`
+
+
+  Returns:
+
+    dict: A dictionary where each value is a 1D array with one entry per
+    session (NaN if the session has too few intervals) and keys are:
+
+      * ``mean_rr``: Mean RR interval, in milliseconds
+      * ``mean_hr``: Mean heart-rate, in beats-per-minute
+      * ``sdnn``: Standard deviation of RR intervals, in milliseconds
+      * ``rmssd``: Root mean square of successive RR differences, in
+        milliseconds
+      * ``pnn50``: Percentage of successive RR differences larger than 50
+        milliseconds
+
+  '''
+
+  packed = 1000. * _pack(rr) #in milliseconds
+  valid = ~numpy.isnan(packed)
+  count = valid.sum(axis=1)
+
+  successive = numpy.diff(packed, axis=1)
+  valid_successive = ~numpy.isnan(successive)
+  count_successive = valid_successive.sum(axis=1)
+
+  with numpy.errstate(invalid='ignore', divide='ignore'):
+    total = numpy.where(valid, packed, 0.).sum(axis=1)
+    mean_rr = total / count
+    deviations = numpy.where(valid, packed - mean_rr[:,None], 0.)
+    sdnn = numpy.sqrt((deviations**2).sum(axis=1) / (count - 1))
+    squares = numpy.where(valid_successive, successive**2, 0.).sum(axis=1)
+    rmssd = numpy.sqrt(squares / count_successive)
+    large = (numpy.abs(numpy.where(valid_successive, successive, 0.)) > 50.)
+    pnn50 = 100. * large.sum(axis=1) / count_successive
+
+  sdnn[count < 2] = numpy.nan
+
+  return {
+      'mean_rr': mean_rr,
+      'mean_hr': 60000. / mean_rr,
+      'sdnn': sdnn,
+      'rmssd': rmssd,
+      'pnn50': pnn50,
+      }
+
+
+def frequency_domain(rr, resampling_frequency=4., lf=(0.04, 0.15),
+    hf=(0.15, 0.4)):
+  '''Computes frequency-domain HRV features for many sessions at once
+
+  Each RR series is interpolated on a regular grid at
+  ``resampling_frequency``, detrended and windowed (Hann). The power spectra
+  of all sessions are then computed with a single FFT over the zero-padded
+  matrix of resampled series, and integrated over the low-frequency (LF) and
+  high-frequency (HF) bands.
+
+
+  Parameters:
+
+    rr (list): A list with one 1D array of RR intervals, in seconds, per
+      session, as returned by :py:func:`rr_intervals`
+
+    resampling_frequency (float): The frequency of the regular grid RR series
+      are interpolated on, in Hz
+
+    lf (tuple): The limits of the low-frequency band, in Hz
+
+    hf (tuple): The limits of the high-frequency band, in Hz
+
+
+  Returns:
+
+    dict: A dictionary where each value is a 1D array with one entry per
+    session (NaN if the session is too short) and keys are:
+
+      * ``lf``: The power on the LF band, in squared milliseconds
+      * ``hf``: The power on the HF band, in squared milliseconds
+      * ``lf_hf``: The ratio between LF and HF powers
+
+  '''
+
+  series = []
+  for k in rr:
+    k = 1000. * numpy.asarray(k, dtype='float64') #in milliseconds
+    if len(k) < 4:
+      series.append(numpy.zeros((0,)))
+      continue
+    times = numpy.cumsum(k) / 1000.
+    grid = numpy.arange(times[0], times[-1], 1./resampling_frequency)
+    resampled = numpy.interp(grid, times, k)
+    # removes the linear trend, then applies the window
+    resampled -= numpy.polyval(numpy.polyfit(grid, resampled, 1), grid)
+    series.append(resampled * numpy.hanning(len(resampled)))
+
+  lengths = numpy.array([len(k) for k in series])
+  packed = numpy.nan_to_num(_pack(series))
+  size = 2**int(numpy.ceil(numpy.log2(max(packed.shape[1], 2))))
+
+  # one-sided power spectral density, normalized by each session's window
+  power = numpy.abs(numpy.fft.rfft(packed, n=size, axis=1))**2
+  with numpy.errstate(invalid='ignore', divide='ignore'):
+    norm = numpy.array([(numpy.hanning(k)**2).sum() for k in lengths])
+    power *= 2. / (resampling_frequency * norm[:,None])
+  frequencies = numpy.fft.rfftfreq(size, 1./resampling_frequency)
+  resolution = frequencies[1]
+
+  def band(limits):
+    selector = (frequencies >= limits[0]) & (frequencies < limits[1])
+    return power[:,selector].sum(axis=1) * resolution
+
+  retval = {'lf': band(lf), 'hf': band(hf)}
+  too_short = lengths * (1./resampling_frequency) < 1./lf[0]
+  retval['lf'][too_short] = numpy.nan
+  retval['hf'][lengths == 0] = numpy.nan
+  with numpy.errstate(invalid='ignore', divide='ignore'):
+    retval['lf_hf'] = retval['lf'] / retval['hf']
+  return retval
+
+
+def features(objects, channel='EXG3'):
+  '''Computes all HRV features for the given sessions, from stored R-peaks
+
+
+  Parameters:
+
+    objects (list): A list of :py:class:`bob.db.hci_tagging.File` objects
+
+    channel (str): The ECG channel whose R-peaks are used. Defaults to
+      ``EXG3``, the cleanest of the three ECG sensors.
+
+
+  Returns:
+
+    dict: A dictionary where each value is a 1D array with one entry per
+    object and keys are the ones returned by :py:func:`time_domain` and
+    :py:func:`frequency_domain`
+
+  '''
+
+  rr = []
+  for obj in objects:
+    peaks, freq = obj.load_peaks()
+    rr.append(rr_intervals(peaks[channel], freq))
+
+  retval = time_domain(rr)
+  retval.update(frequency_domain(rr))
+  return retval
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Per-stage profiling of the metadata generation and debugging steps
+
+Slow operations of this package (BDF reading, QRS detection, video decoding,
+face detection and HDF5 writing) are wrapped in :py:func:`stage` blocks.
+When profiling is turned on with :py:func:`enable`, each block records its
+wall time, the bytes read by the process meanwhile and the peak resident set
+size of the process at its end, aggregated per stage and per session (see
+:py:func:`session`). When profiling is off (the default), :py:func:`stage`
+returns a shared no-op context, so instrumented code runs at full speed.
+
+Stages may be nested (e.g. ``bdf_read`` happens within the computation of
+the ``heartrate`` output): the time of inner stages is included in the time
+of outer ones. Bytes read and memory are measured for the whole process, so
+they are only exact when sessions are processed one at a time.
+'''
+
+import sys
+import time
+import json
+import threading
+
+
+class _Null(object):
+  """A context that does nothing"""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+_NULL = _Null()
+_profiler = None
+
+
+def _bytes_read():
+  """Returns the number of bytes read by this process so far, if known"""
+
+  try:
+    with open('/proc/self/io', 'rt') as f:
+      for line in f:
+        if line.startswith('rchar:'): return int(line.split()[1])
+  except (IOError, OSError):
+    pass
+  return 0
+
+
+def _peak_rss():
+  """Returns the peak resident set size of this process, in bytes"""
+
+  try:
+    import resource
+  except ImportError:
+    return 0
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak if sys.platform == 'darwin' else peak * 1024 #KiB on Linux
+
+
+class _Stage(object):
+  """Measures one execution of a stage"""
+
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.bytes = _bytes_read()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    wall = time.perf_counter() - self.start
+    self.profiler.record(self.name, wall, _bytes_read() - self.bytes,
+        _peak_rss())
+    return False
+
+
+class Profiler(object):
+  """Aggregates measurements of stages, per stage and per session"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self.stages = {}
+    self.sessions = {}
+
+
+  @staticmethod
+  def _update(entries, name, wall, nbytes, peak):
+    entry = entries.setdefault(name,
+        {'calls': 0, 'wall': 0., 'bytes': 0, 'peak_rss': 0})
+    entry['calls'] += 1
+    entry['wall'] += wall
+    entry['bytes'] += nbytes
+    entry['peak_rss'] = max(entry['peak_rss'], peak)
+
+
+  def record(self, name, wall, nbytes, peak):
+    """Records one execution of stage ``name``"""
+
+    current = getattr(self._local, 'session', None)
+    with self._lock:
+      self._update(self.stages, name, wall, nbytes, peak)
+      if current is not None:
+        self._update(self.sessions.setdefault(current, {}), name, wall,
+            nbytes, peak)
+
+
+  def merge(self, report):
+    """Adds the measurements of a report (e.g. from another process)"""
+
+    with self._lock:
+      for entries, other in [(self.stages, report['stages'])] + \
+          [(self.sessions.setdefault(k, {}), v) for k, v in \
+          report['sessions'].items()]:
+        for name, value in other.items():
+          entry = entries.setdefault(name,
+              {'calls': 0, 'wall': 0., 'bytes': 0, 'peak_rss': 0})
+          for key in ('calls', 'wall', 'bytes'): entry[key] += value[key]
+          entry['peak_rss'] = max(entry['peak_rss'], value['peak_rss'])
+
+
+  def report(self):
+    """Returns the aggregated measurements
+
+    Returns:
+
+      dict: Measurements per stage (``stages``) and per session and stage
+      (``sessions``). Each entry contains the number of ``calls``, the total
+      ``wall`` time in seconds, the total ``bytes`` read and the maximum
+      ``peak_rss`` in bytes. The peak resident set size of the process is
+      also reported (``peak_rss``).
+
+    """
+
+    with self._lock:
+      return json.loads(json.dumps({'stages': self.stages,
+        'sessions': self.sessions, 'peak_rss': _peak_rss()}))
+
+
+def enable():
+  """Turns profiling on, with a new profiler, which is returned"""
+
+  global _profiler
+  _profiler = Profiler()
+  return _profiler
+
+
+def disable():
+  """Turns profiling off, returning the profiler used until now, if any"""
+
+  global _profiler
+  retval, _profiler = _profiler, None
+  return retval
+
+
+def stage(name):
+  """Returns a context measuring a stage, if profiling is on
+
+  Example::
+
+    with instrument.stage('bdf_read'):
+      ...
+
+  """
+
+  if _profiler is None: return _NULL
+  return _Stage(_profiler, name)
+
+
+def _iterate(name, iterator):
+  while True:
+    measure = stage(name).__enter__()
+    try:
+      item = next(iterator)
+    except StopIteration:
+      return #the end of the iteration is not recorded
+    measure.__exit__(None, None, None)
+    yield item
+
+
+def iterate(name, iterable):
+  """Iterates over ``iterable``, measuring the production of each item as a
+  stage (e.g. the decoding of each frame of a video), if profiling is on"""
+
+  if _profiler is None: return iter(iterable)
+  return _iterate(name, iter(iterable))
+
+
+class session(object):
+  """A context attributing the stages run in it (by this thread) to a session
+
+  Parameters:
+
+    name (str): The name of the session (e.g. the stem of the BDF file)
+
+  """
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    if _profiler is not None:
+      self.previous = getattr(_profiler._local, 'session', None)
+      _profiler._local.session = self.name
+    return self
+
+  def __exit__(self, *exc):
+    if _profiler is not None:
+      _profiler._local.session = getattr(self, 'previous', None)
+    return False
+
+
+def current_session():
+  """Returns the session stages run by this thread are attributed to, if any
+
+  Use it to attribute stages run on other threads to the same session (see
+  :py:class:`session`).
+  """
+
+  if _profiler is None: return None
+  return getattr(_profiler._local, 'session', None)
+
+
+def save(report, path):
+  """Saves a report (see :py:meth:`Profiler.report`) as JSON"""
+
+  with open(path, 'wt') as f:
+    json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Background loading of database samples
+
+Samples are loaded by a pool of worker threads (or processes) while the
+consumer processes previous ones, so I/O overlaps with computation. A bounded
+number of samples is loaded ahead of the consumer, which limits memory usage.
+'''
+
+import random
+
+
+def load_sample(obj, directory):
+  """Loads a training sample for a :py:class:`bob.db.hci_tagging.File`
+
+
+  Parameters:
+
+    obj (bob.db.hci_tagging.File): The session to load
+
+    directory (str): The path to the root of the database installation
+
+
+  Returns:
+
+    numpy.ndarray: The video frames, in (frame,channel,y,x) notation
+
+    dict: The face bounding boxes, indexed by frame number, as returned by
+    :py:meth:`bob.db.hci_tagging.File.load_face_detection`
+
+    float: The average heart-rate, in beats-per-minute
+
+  """
+
+  return obj.load(directory), obj.load_face_detection(), \
+      obj.load_heart_rate_in_bpm()
+
+
+def prefetch(function, items, workers=4, size=8, processes=False):
+  """Applies ``function`` to each item in background, yielding results in order
+
+  At most ``size`` results are loaded ahead of the consumer. When the
+  generator is closed (or garbage collected) before it is exhausted, pending
+  work is cancelled and the workers are shut down.
+
+
+  Parameters:
+
+    function (callable): The function to apply to each item. If
+      ``processes`` is set, it must be picklable (i.e. defined at module
+      level)
+
+    items (list): The items to process, in order
+
+    workers (int): The number of worker threads (or processes)
+
+    size (int): The maximum number of results loaded ahead of the consumer
+
+    processes (bool): If set, workers are processes instead of threads. Use
+      this if ``function`` holds the interpreter lock for most of its time.
+
+
+  Yields:
+
+    The result of ``function`` for each item, in the order of ``items``.
+    Exceptions raised by ``function`` are re-raised here.
+
+  """
+
+  import collections
+  from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+  Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+  executor = Executor(max_workers=workers)
+  pending = collections.deque()
+  items = iter(items)
+
+  try:
+    for item in items:
+      pending.append(executor.submit(function, item))
+      if len(pending) >= size: break
+
+    while pending:
+      result = pending.popleft().result()
+      for item in items: #refills the queue with (at most) one item
+        pending.append(executor.submit(function, item))
+        break
+      yield result
+
+  finally:
+    for future in pending: future.cancel()
+    executor.shutdown(wait=True)
+
+
+class _Loader(object):
+  """A picklable callable that binds a database installation directory"""
+
+  def __init__(self, function, directory):
+    self.function = function
+    self.directory = directory
+
+  def __call__(self, obj):
+    return self.function(obj, self.directory)
+
+
+def samples(objects, directory, workers=4, prefetch_size=8, processes=False,
+    shuffle=False, seed=None, function=load_sample):
+  """Iterates over samples of the given objects, loaded in background
+
+  See :py:meth:`bob.db.hci_tagging.Database.samples` for a description of
+  the parameters.
+  """
+
+  objects = list(objects)
+  if shuffle: random.Random(seed).shuffle(objects)
+  return prefetch(_Loader(function, directory), objects, workers,
+      prefetch_size, processes)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Content checksums of the raw database files
+
+The manifest is a text file in the format used by ``sha256sum``: each line
+contains the hexadecimal SHA-256 digest of a file followed by two spaces and
+the path of the file, relative to the root of the database installation.
+'''
+
+import os
+import hashlib
+
+
+def checksum(path, chunk_size=2**20):
+  """Computes the SHA-256 digest of the contents of a file
+
+  The file is read in chunks of ``chunk_size`` bytes, so memory usage is
+  bounded. The hashing of large chunks releases the interpreter lock, so many
+  files can be processed concurrently using threads.
+
+
+  Returns:
+
+    str: The hexadecimal digest of the file contents
+
+  """
+
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+def save_manifest(manifest, path):
+  """Saves a manifest, given as a dictionary mapping paths to digests"""
+
+  with open(path, 'wt') as f:
+    for name in sorted(manifest):
+      f.write('%s  %s\n' % (manifest[name], name))
+
+
+def load_manifest(path):
+  """Loads a manifest saved with :py:func:`save_manifest`
+
+
+  Returns:
+
+    dict: A dictionary mapping paths, relative to the root of the database
+    installation, to their hexadecimal SHA-256 digests. If ``path`` does not
+    exist, an empty dictionary is returned.
+
+  """
+
+  retval = {}
+  if not os.path.exists(path): return retval
+
+  with open(path, 'rt') as f:
+    for row in f:
+      row = row.rstrip('\n')
+      if not row.strip(): continue
+      digest, name = row.split('  ', 1)
+      retval[name] = digest
+  return retval
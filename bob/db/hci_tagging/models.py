@@ -3,12 +3,14 @@
 
 import os
 import pkg_resources
+import numpy
 
 import bob.db.base
 import bob.io.base
 import bob.ip.facedetect
 
 from . import utils
+from . import instrument
 
 
 class File(bob.db.base.File):
@@ -27,21 +29,95 @@ class File(bob.db.base.File):
     duration (int): The time in seconds that corresponds to the estimated
       duration of the data (video and physiological signals).
 
+    frames (int, optional): The number of frames in the video file
+
+    frame_rate (float, optional): The frame rate of the video file, in Hz
+
+    channels (str, optional): The names of all channels in the BDF file,
+      separated by spaces
+
+    sample_rates (str, optional): The sampling frequency, in Hz, of each
+      channel in the BDF file, separated by spaces
+
+    sync_start (int, optional): The first sample of the video period on the
+      BDF file, as marked on its ``Status`` channel
+
+    sync_end (int, optional): The last sample of the video period on the BDF
+      file, as marked on its ``Status`` channel
+
+    Optional parameters are extracted from the raw data files by the
+    ``create`` command and stored on the CSV descriptor, so that planning work
+    does not require raw file access. If they are missing from the descriptor,
+    the corresponding attributes are set to ``None``. Channel names and rates
+    are exposed as the tuple ``channels`` and the dictionary ``sample_rates``,
+    while synchronization markers are exposed as the tuple ``sync``, which can
+    be passed directly to :py:func:`bob.db.hci_tagging.utils.bdf_load_signal`.
+    Further keyword arguments correspond to book-keeping columns of the CSV
+    descriptor (such as the size and modification time of the raw files) and
+    are ignored.
+
+    If the attribute ``memory_cache`` is set to a
+    :py:class:`bob.db.hci_tagging.cache.MemoryCache` (see
+    :py:class:`bob.db.hci_tagging.Database`), data returned by :py:meth:`load`,
+    :py:meth:`load_video_segment`, :py:meth:`load_signals` and
+    :py:meth:`load_face_detection` is kept in memory and returned from there on
+    subsequent calls with the same arguments. Arrays returned from the cache
+    are read-only.
+
+    Face bounding-boxes and metadata files are loaded from the directory set
+    on the attribute ``annotations``, or from the package data directory if it
+    is not set. If the attribute ``shared`` is set (to a tuple with a
+    :py:class:`bob.db.hci_tagging.shared.SharedIndex` and the position of
+    this file on it), the average heart-rate and face bounding-boxes are taken
+    from the index instead, when available.
+
   """
 
-  def __init__(self, basedir, bdf, video, duration):
+  memory_cache = None
+  annotations = None
+  shared = None
+
+  def __init__(self, basedir, bdf, video, duration, frames=None,
+      frame_rate=None, channels=None, sample_rates=None, sync_start=None,
+      sync_end=None, **kwargs):
 
     self.basedir = basedir
     self.stem = bdf
     self.path = os.path.join(self.basedir, self.stem)
     self.video_stem = video
     self.duration = int(duration)
+    self.keyframes = None
+
+    missing = lambda k: k is None or k == ''
+    self.frames = None if missing(frames) else int(frames)
+    self.frame_rate = None if missing(frame_rate) else float(frame_rate)
+    self.channels = None if missing(channels) else tuple(channels.split())
+    self.sample_rates = None if (self.channels is None or \
+        missing(sample_rates)) else dict(zip(self.channels,
+          [float(k) for k in sample_rates.split()]))
+    self.sync = None if (missing(sync_start) or missing(sync_end)) else \
+        (int(sync_start), int(sync_end))
 
 
   def __repr__(self):
     return "File('%s')" % self.stem
 
 
+  def _annotation_path(self, extension, subdirectory=''):
+    """Returns the path to an annotation file of this object"""
+
+    data_dir = self.annotations or \
+        pkg_resources.resource_filename(__name__, 'data')
+    return self.make_path(os.path.join(data_dir, subdirectory), extension)
+
+
+  def _memoize(self, loader, function, *args):
+    """Calls ``function``, or returns its result from the memory cache"""
+
+    if self.memory_cache is None: return function()
+    return self.memory_cache.get((self.path, loader) + args, function)
+
+
   def default_extension(self):
       return '.bdf'
 
@@ -92,7 +168,7 @@ class File(bob.db.base.File):
     if not os.path.exists(path):
       raise IOError("Video file `%s' is not available - have you downloaded the database raw files from the original site?" % (path,))
 
-    return bob.io.base.load(path)
+    return self._memoize('load', lambda: bob.io.base.load(path), path)
 
 
   def load_video(self, directory):
@@ -118,7 +194,79 @@ class File(bob.db.base.File):
     return bob.io.video.reader(path)
 
 
-  def run_face_detector(self, directory, max_frames=0):
+  def load_video_segment(self, directory, start=None, end=None):
+    """Loads a segment of the colored video file associated to this object
+
+    If the keyframe index of this file is available (see
+    :py:mod:`bob.db.hci_tagging.video`), decoding starts at the last keyframe
+    preceding ``start``, so the cost of loading a segment is proportional to
+    its length and not to its position in the video.
+
+
+    Parameters:
+
+      directory (str): A directory name that will be prefixed to the returned
+        result.
+
+      start (float, optional): Start time in seconds. If not set, read from
+        the start of the video.
+
+      end (float, optional): End time in seconds. If not set, read until the
+        end of the video.
+
+
+    Returns:
+
+      numpy.ndarray: A 4D array of 8-bit unsigned integers corresponding to
+      the selected frames in (frame,channel,y,x) notation (Bob-style).
+
+    """
+
+    from .video import load_segment
+
+    path = os.path.join(directory, self.basedir, self.video_stem + '.avi')
+    return self._memoize('load_video_segment',
+        lambda: load_segment(path, self.keyframes, start, end),
+        path, start, end)
+
+
+  def load_signals(self, directory, channels=('EXG1', 'EXG2', 'EXG3'),
+      start=None, end=None):
+    """Loads physiological signals associated to this object
+
+    The signals are synchronized with the video: time zero corresponds to the
+    start of the video. If the synchronization markers are available on the
+    metadata, the ``Status`` channel of the BDF file is not read.
+
+
+    Parameters:
+
+      directory (str): A directory name that leads to the location the
+        database is installed on the local disk
+
+      channels (tuple): The names of the channels to read (see
+        :py:func:`bob.db.hci_tagging.utils.bdf_load_signal`)
+
+      start (float, optional): Start time in seconds
+
+      end (float, optional): End time in seconds
+
+
+    Returns:
+
+      numpy.ndarray: A 2D array of 64-bit floats in (channel,sample) notation
+
+      float: The sampling frequency of the signals, in Hz
+
+    """
+
+    path = self.make_path(directory)
+    return self._memoize('load_signals',
+        lambda: utils.bdf_load_signals(path, channels, start, end,
+          sync=self.sync), path, tuple(channels), start, end)
+
+
+  def run_face_detector(self, directory, max_frames=0, cache=None):
     """Runs bob.ip.facedetect stock detector on the selected frames.
 
     .. warning::
@@ -139,6 +287,10 @@ class File(bob.db.base.File):
         from the associated video file. A value of zero (default), makes the
         detector run for all frames.
 
+      cache (bob.db.hci_tagging.cache.ResultCache, optional): If set, results
+        are looked up on (and, if missing, stored in) this cache, keyed by the
+        identity of the video file and ``max_frames``
+
 
     Returns:
 
@@ -147,13 +299,28 @@ class File(bob.db.base.File):
 
     """
 
-    detections = {}
-    data = self.load_video(directory)
-    if max_frames: data = data[:max_frames]
-    for k, frame in enumerate(data):
-      bb, quality = bob.ip.facedetect.detect_single_face(frame)
-      detections[k] = bb
-    return detections
+    def _detect():
+      detections = {}
+      with instrument.stage('video_decode'):
+        data = self.load_video(directory)
+        if max_frames: data = data[:max_frames]
+      for k, frame in enumerate(instrument.iterate('video_decode', data)):
+        with instrument.stage('face_detection'):
+          bb = utils.detect_face(frame)
+        # stores plain tuples, so results can be cached
+        detections[k] = (tuple(bb.topleft), tuple(bb.size)) \
+            if bb is not None else None
+      return detections
+
+    if cache is None:
+      detections = _detect()
+    else:
+      path = os.path.join(directory, self.basedir, self.video_stem + '.avi')
+      detections = cache.memoize(_detect, [path], 'run_face_detector',
+          max_frames=max_frames, version=1)
+
+    return dict((k, bob.ip.facedetect.BoundingBox(*v) if v is not None \
+        else None) for k, v in detections.items())
 
 
   def load_face_detection(self):
@@ -173,25 +340,33 @@ class File(bob.db.base.File):
 
     """
 
-    basedir = os.path.join('data', 'bbox')
-    data_dir = pkg_resources.resource_filename(__name__, basedir)
-    path = self.make_path(data_dir, '.face')
+    if self.shared is not None:
+      boxes = self.shared[0].face_boxes(self.shared[1])
+      if len(boxes):
+        return dict((int(p[0]), bob.ip.facedetect.BoundingBox((float(p[2]), float(p[1])), (float(p[4]), float(p[3])))) for p in boxes)
+
+    path = self._annotation_path('.face', 'bbox')
 
     if not os.path.exists(path):
       raise IOError("Face bounding-box file `%s' is not available - have you run the metadata generation step or `bob_dbmanage.py hci_tagging download'?" % (path,))
 
-    retval = {}
-    with open(path, 'rt') as f:
-      for row in f:
-        if not row.strip(): continue
-        p = row.split()
-        # .face file: <frame> <x> <y> <width> <height>
-        # BoundingBox ctor: top left (y, x), size (height, width)
-        retval[int(p[0])] = bob.ip.facedetect.BoundingBox((float(p[2]), float(p[1])), (float(p[4]), float(p[3])))
-    return retval
+    def _load():
+      retval = {}
+      with open(path, 'rt') as f:
+        for row in f:
+          if not row.strip(): continue
+          p = row.split()
+          # .face file: <frame> <x> <y> <width> <height>
+          # BoundingBox ctor: top left (y, x), size (height, width)
+          retval[int(p[0])] = bob.ip.facedetect.BoundingBox((float(p[2]), float(p[1])), (float(p[4]), float(p[3])))
+      return retval
 
+    # a shallow copy, so callers may modify the returned dictionary
+    return dict(self._memoize('load_face_detection', _load))
 
-  def estimate_heartrate_in_bpm(self, directory):
+
+  def estimate_heartrate_in_bpm(self, directory, return_peaks=False,
+      method='qrs', cache=None):
     """Estimates the person's heart rate using the ECG sensor data
 
     Parameters:
@@ -199,24 +374,96 @@ class File(bob.db.base.File):
       directory (str): A directory name that leads to the location the database
         is installed on the local disk
 
+      return_peaks (bool): If set, also return the R-peaks detected on each
+        ECG channel and the sampling frequency of the signals. Only available
+        for the ``qrs`` method.
+
+      method (str): The estimator to apply on each ECG channel. ``qrs``
+        (default) detects QRS complexes with
+        :py:func:`bob.db.hci_tagging.utils.estimate_average_heartrate`, while
+        ``psd`` picks the dominant cardiac frequency of the signal spectra,
+        with :py:func:`bob.db.hci_tagging.utils.estimate_average_heartrate_psd`.
+        The latter is faster, but less precise.
+
+      cache (bob.db.hci_tagging.cache.ResultCache, optional): If set, the
+        per-channel estimates (and R-peaks) are looked up on (and, if missing,
+        stored in) this cache, keyed by the identity of the BDF file, the
+        video synchronization markers (``sync``) and the estimation
+        method. The final choice among channels is always recomputed.
+
+
+    Returns:
+
+      float: The estimated heart-rate in beats-per-minute
+
+      dict: Only returned if ``return_peaks`` is set. A dictionary where keys
+      are ECG channel names (``EXG1``, ``EXG2`` and ``EXG3``) and values, 1D
+      arrays of 32-bit integers with the sample indexes of R-peaks detected
+      on each channel
+
+      float: Only returned if ``return_peaks`` is set. The sampling frequency
+      of the ECG signals, in Hz
+
     """
 
-    from .utils import estimate_average_heartrate, chooser
+    from .utils import chooser
+
+    if method not in ('qrs', 'psd'):
+      raise ValueError("unknown heart-rate estimation method `%s'" % method)
+    if method == 'psd' and return_peaks:
+      raise ValueError("R-peaks are only available for the `qrs' method")
+
+    channels = ('EXG1', 'EXG2', 'EXG3')
 
+    def _estimate():
+      return self._estimate_channel_heartrates(directory, channels, method)
+
+    if cache is None:
+      estimates, peaks, freq = _estimate()
+    else:
+      estimates, peaks, freq = cache.memoize(_estimate,
+          [self.make_path(directory)], 'estimate_heartrate_in_bpm',
+          channels=channels, method=method, sync=self.sync, version=1)
+
+    if return_peaks:
+      return chooser(estimates), peaks, freq
+
+    return chooser(estimates)
+
+
+  def _estimate_channel_heartrates(self, directory, channels, method):
+    """Estimates the heart-rate on each ECG channel, see
+    :py:meth:`estimate_heartrate_in_bpm`"""
+
+    from .utils import estimate_average_heartrate, \
+        estimate_average_heartrate_psd
+
+    signals, freq = self.load_signals(directory, channels)
+
+    if method == 'psd':
+      with instrument.stage('psd_estimation'):
+        estimates = list(estimate_average_heartrate_psd(signals, freq))
+      return estimates, None, freq
 
     estimates = []
-    for channel in ('EXG1', 'EXG2', 'EXG3'):
-      signal, freq = utils.bdf_load_signal(self.make_path(directory), channel)
-      avg_hr, peaks = estimate_average_heartrate(signal, freq)
+    peaks = {}
+    for channel, signal in zip(channels, signals):
+      with instrument.stage('qrs_detection'):
+        avg_hr, channel_peaks = estimate_average_heartrate(signal, freq)
       estimates.append(avg_hr)
-    return chooser(estimates)
+      peaks[channel] = numpy.asarray(channel_peaks, dtype='int32')
+
+    return estimates, peaks, freq
 
 
   def load_heart_rate_in_bpm(self):
     """Loads heart-rate from locally stored files, raises if it isn't there"""
 
-    data_dir = pkg_resources.resource_filename(__name__, 'data')
-    path = self.make_path(data_dir, '.hdf5')
+    if self.shared is not None:
+      retval = self.shared[0].heart_rate(self.shared[1])
+      if retval is not None: return retval
+
+    path = self._annotation_path('.hdf5')
 
     if not os.path.exists(path):
       raise IOError("Metadata file `%s' is not available - have you run the metadata generation step or `bob_dbmanage.py hci_tagging download'?" % (path,))
@@ -225,6 +472,68 @@ class File(bob.db.base.File):
     return f.get('heartrate')
 
 
+  def load_peaks(self):
+    """Loads the R-peaks detected on each ECG channel from locally stored
+    files, raises if they aren't there
+
+    The peaks are stored by the metadata generation step (``mkmeta``), so
+    features depending on beat positions (see :py:mod:`bob.db.hci_tagging.hrv`)
+    can be computed without reading the BDF files again.
+
+
+    Returns:
+
+      dict: A dictionary where keys are ECG channel names (``EXG1``, ``EXG2``
+      and ``EXG3``) and values, 1D arrays of 32-bit integers with the sample
+      indexes of R-peaks detected on each channel, counting from the start of
+      the video period
+
+      float: The sampling frequency of the ECG signals, in Hz
+
+    """
+
+    path = self._annotation_path('.hdf5')
+
+    if not os.path.exists(path):
+      raise IOError("Metadata file `%s' is not available - have you run the metadata generation step or `bob_dbmanage.py hci_tagging download'?" % (path,))
+
+    f = bob.io.base.HDF5File(path)
+    if not f.has_group('peaks'):
+      raise IOError("Metadata file `%s' does not contain R-peaks - have you run the metadata generation step?" % (path,))
+
+    f.cd('peaks')
+    retval = dict((k, f.get(k).astype('int32')) for k in f.keys(relative=True))
+    return retval, float(f.get_attribute('sampling_frequency'))
+
+
+  def load_physiology(self):
+    """Loads the respiration, skin conductance and skin temperature features
+    from locally stored files, raises if they aren't there
+
+    The features are stored by the metadata generation step (``mkmeta``), with
+    the ``--physiology`` option.
+
+
+    Returns:
+
+      dict: A dictionary where each value is a 1D array with one entry per
+      window, see :py:func:`bob.db.hci_tagging.physio.features`
+
+    """
+
+    path = self._annotation_path('.hdf5')
+
+    if not os.path.exists(path):
+      raise IOError("Metadata file `%s' is not available - have you run the metadata generation step or `bob_dbmanage.py hci_tagging download'?" % (path,))
+
+    f = bob.io.base.HDF5File(path)
+    if not f.has_group('physiology'):
+      raise IOError("Metadata file `%s' does not contain physiological features - have you run the metadata generation step with `--physiology'?" % (path,))
+
+    f.cd('physiology')
+    return dict((k, f.get(k)) for k in f.keys(relative=True))
+
+
   def load_drmf_keypoints(self):
     """Loads the 66-keypoints coming from the Discriminative Response Map
     Fitting (DRMF) landmark detector. Raises if metadata file isn't there.
@@ -241,8 +550,7 @@ class File(bob.db.base.File):
     The points are in the form (y, x), as it is standard on Bob-based packages.
     """
 
-    data_dir = pkg_resources.resource_filename(__name__, 'data')
-    path = self.make_path(data_dir, '.hdf5')
+    path = self._annotation_path('.hdf5')
 
     if not os.path.exists(path):
       raise IOError("Metadata file `%s' is not available - have you run the metadata generation step or `bob_dbmanage.py hci_tagging download'?" % (path,))
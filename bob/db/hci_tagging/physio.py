@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Respiration, skin conductance and skin temperature features, per window
+
+The respiration belt (``Resp``), galvanic skin response (``GSR1``) and skin
+temperature (``Temp``) channels are acquired at the same rate as the EEG and
+ECG signals (256 Hz on the original database), although their content is
+slower than a few Hertz. They are read in a single pass, synchronized with
+the video (see :py:meth:`bob.db.hci_tagging.File.load_signals`), and
+immediately downsampled by averaging blocks of samples, so all further
+processing works on a few samples per second. Features are then computed for
+all windows at once, on strided views of the downsampled signals or from
+cumulative sums, without loops over windows.
+'''
+
+import numpy
+
+
+CHANNELS = ('Resp', 'GSR1', 'Temp')
+"""The channels used, in the order they are loaded"""
+
+
+def downsample(signals, sampling_frequency, target=16.):
+  '''Downsamples signals by averaging blocks of consecutive samples
+
+  Block averaging is a (crude) low-pass filter, which is enough for these
+  slow signals. Trailing samples not filling a block are dropped.
+
+
+  Parameters:
+
+    signals (numpy.ndarray): A 2D array in (channel,sample) notation
+
+    sampling_frequency (float): The sampling frequency of the signals, in Hz
+
+    target (float): The minimum sampling frequency of the result, in Hz
+
+
+  Returns:
+
+    numpy.ndarray: A 2D array of 64-bit floats in (channel,sample) notation
+
+    float: The sampling frequency of the result, in Hz
+
+  '''
+
+  signals = numpy.atleast_2d(numpy.asarray(signals, dtype='float64'))
+  factor = max(int(sampling_frequency // target), 1)
+  size = signals.shape[1] // factor
+  blocks = signals[:, :size*factor].reshape(len(signals), size, factor)
+  return blocks.mean(axis=2), sampling_frequency / factor
+
+
+def _windows(signal, size, stride):
+  '''Returns a (window,sample) view of a 1D signal, without copies'''
+
+  return numpy.lib.stride_tricks.sliding_window_view(signal, size)[::stride]
+
+
+def breathing_rate(resp, sampling_frequency, size, stride, low=0.1,
+    high=0.7):
+  '''Estimates the breathing rate on each window of a respiration signal
+
+  The rate is the dominant frequency of the (detrended, Hann-windowed)
+  spectrum of each window, between ``low`` and ``high`` Hz. Spectra are zero
+  padded to a resolution of at least 0.1 breaths-per-minute.
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the breathing rate on each window, in
+    breaths-per-minute
+
+  '''
+
+  windows = _windows(resp, size, stride)
+  windows = windows - windows.mean(axis=1, keepdims=True)
+  windows *= numpy.hanning(size)
+
+  n = max(2**int(numpy.ceil(numpy.log2(600. * sampling_frequency))), size)
+  power = numpy.abs(numpy.fft.rfft(windows, n=n, axis=1))**2
+  frequencies = numpy.fft.rfftfreq(n, 1./sampling_frequency)
+  band = numpy.flatnonzero((frequencies >= low) & (frequencies <= high))
+  return 60. * frequencies[band[power[:, band].argmax(axis=1)]]
+
+
+def skin_conductance(gsr, sampling_frequency, size, stride, tonic=8.,
+    threshold=0.05):
+  '''Computes the skin conductance level and counts phasic responses on each
+  window of a galvanic skin response signal
+
+  The resistance (in Ohm) is converted to conductance (in micro-Siemens).
+  Its tonic component is estimated with a moving average over ``tonic``
+  seconds, and each upwards crossing of ``threshold`` by the remaining
+  (phasic) component counts as one response.
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the mean skin conductance on each window,
+    in micro-Siemens
+
+    numpy.ndarray: A 1D array with the number of phasic responses on each
+    window
+
+  '''
+
+  with numpy.errstate(divide='ignore'):
+    conductance = numpy.where(gsr > 0, 1e6 / gsr, 0.)
+
+  count = (len(conductance) - size) // stride + 1
+  starts = numpy.arange(count) * stride
+
+  total = numpy.concatenate(([0.], numpy.cumsum(conductance)))
+  level = (total[starts + size] - total[starts]) / size
+
+  width = min(max(int(round(tonic * sampling_frequency)), 1),
+      len(conductance))
+  kernel = numpy.ones(width)
+  # the average near the edges only includes samples within the signal
+  tonic_level = numpy.convolve(conductance, kernel, mode='same') / \
+      numpy.convolve(numpy.ones(len(conductance)), kernel, mode='same')
+  phasic = conductance - tonic_level
+  onsets = (phasic[:-1] < threshold) & (phasic[1:] >= threshold)
+  # onsets[k] is the crossing between samples k and k+1
+  onsets = numpy.concatenate(([0], numpy.cumsum(onsets)))
+  responses = onsets[starts + size - 1] - onsets[starts]
+
+  return level, responses.astype('int32')
+
+
+def temperature_slope(temp, sampling_frequency, size, stride):
+  '''Computes the least-squares slope of the skin temperature on each window
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the temperature slope on each window, in
+    degrees Celsius per minute
+
+  '''
+
+  windows = _windows(temp, size, stride)
+  time = (numpy.arange(size) - (size - 1) / 2.) / sampling_frequency
+  return 60. * windows.dot(time) / (time**2).sum()
+
+
+def features(signals, sampling_frequency, length=30., step=None, target=16.):
+  '''Computes all features on windows of the peripheral signals of a session
+
+
+  Parameters:
+
+    signals (numpy.ndarray): A 2D array in (channel,sample) notation, with the
+      channels in :py:data:`CHANNELS`, as returned by
+      :py:meth:`bob.db.hci_tagging.File.load_signals`
+
+    sampling_frequency (float): The sampling frequency of the signals, in Hz
+
+    length (float): The length of each window, in seconds. Windows should
+      span a few breaths.
+
+    step (float, optional): The time between the start of consecutive
+      windows, in seconds. If not set, windows do not overlap.
+
+    target (float): The minimum sampling frequency signals are downsampled
+      to, in Hz (see :py:func:`downsample`)
+
+
+  Returns:
+
+    dict: A dictionary where each value is a 1D array with one entry per
+    window (empty if the signals are shorter than one window) and keys are:
+
+      * ``start``: The start of each window, in seconds from the start of the
+        video period
+      * ``breathing_rate``: The breathing rate, in breaths-per-minute
+      * ``gsr_level``: The mean skin conductance, in micro-Siemens
+      * ``gsr_responses``: The number of phasic skin conductance responses
+      * ``temperature_slope``: The skin temperature slope, in degrees Celsius
+        per minute
+
+  '''
+
+  signals, fs = downsample(signals, sampling_frequency, target)
+  resp, gsr, temp = signals
+
+  size = int(round(length * fs))
+  stride = int(round((step or length) * fs))
+  if size < 1 or stride < 1:
+    raise ValueError("windows of %g seconds with steps of %g seconds are empty at %g Hz" % (length, step or length, fs))
+
+  if len(resp) < size:
+    empty = numpy.zeros((0,))
+    return {
+        'start': empty,
+        'breathing_rate': empty,
+        'gsr_level': empty,
+        'gsr_responses': numpy.zeros((0,), dtype='int32'),
+        'temperature_slope': empty,
+        }
+
+  level, responses = skin_conductance(gsr, fs, size, stride)
+  return {
+      'start': numpy.arange(len(level)) * (stride / fs),
+      'breathing_rate': breathing_rate(resp, fs, size, stride),
+      'gsr_level': level,
+      'gsr_responses': responses,
+      'temperature_slope': temperature_slope(temp, fs, size, stride),
+      }
+
+
+def session_features(obj, directory, length=30., step=None, target=16.,
+    cache=None):
+  '''Computes all features on windows of the peripheral signals of a session
+
+  Parameters:
+
+    obj (bob.db.hci_tagging.File): The session to process
+
+    directory (str): The path to the root of the database installation
+
+    length, step, target: See :py:func:`features`
+
+    cache (bob.db.hci_tagging.cache.ResultCache, optional): If set, the
+      features are looked up on (and, if missing, stored in) this cache, keyed
+      by the identity of the BDF file, its synchronization markers and all
+      other parameters
+
+
+  Returns:
+
+    dict: The features of each window, see :py:func:`features`
+
+  '''
+
+  def _features():
+    signals, freq = obj.load_signals(directory, CHANNELS)
+    return features(signals, freq, length, step, target)
+
+  if cache is None: return _features()
+  return cache.memoize(_features, [obj.make_path(directory)],
+      'physiology', length=length, step=step, target=target, sync=obj.sync,
+      version=1)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Incremental generation of per-session metadata files
+
+Each output of the metadata generation step (``mkmeta``) is produced by a
+:py:class:`Stage`. When an output is written to the metadata (HDF5) file of a
+session, it is tagged with a ``provenance`` attribute containing a fingerprint
+of everything it was computed from: the identity (size and modification time)
+of the raw files it reads, the parameters of its algorithm, the version of
+the stage code and the fingerprints of the outputs it depends on. An output
+is stale if its stored fingerprint differs from the current one, and only
+stale or missing outputs are recomputed. Before an output is (re-)written, a
+``pending_<name>`` attribute is set on the root of the file, and it is only
+removed once the output is completely written and tagged: outputs marked as
+pending are considered missing, so interrupted runs resume where they
+stopped.
+
+Outputs present on metadata files but without a ``provenance`` attribute nor
+a pending mark (e.g. those distributed with this package) are considered
+up-to-date, unless recomputation is forced.
+'''
+
+import os
+import json
+import hashlib
+
+import numpy
+import bob.io.base
+
+from . import instrument
+
+
+class Stage(object):
+  """An output of the metadata generation step
+
+
+  Parameters:
+
+    name (str): The name of the output on the HDF5 file (dataset or group)
+
+    version (int): The version of the code producing the output. Increase it
+      whenever this code changes, to invalidate outputs produced by previous
+      versions.
+
+    inputs (tuple): The raw files the output is computed from: any of
+      ``bdf`` and ``video``
+
+    depends (tuple): The names of the stages whose outputs this one depends on
+
+    parameters (tuple): The names of the run parameters (see
+      :py:func:`run`) that affect this output
+
+    compute (callable): A callable that takes a :py:class:`Context` and
+      returns the value to write, or ``None`` if it cannot be computed. If not
+      set, the output is external (it cannot be recomputed by this package)
+      and is only checked for presence.
+
+    write (callable): A callable that takes an opened
+      :py:class:`bob.io.base.HDF5File` and the computed value and writes the
+      output
+
+  """
+
+  def __init__(self, name, version, inputs=(), depends=(), parameters=(),
+      compute=None, write=None):
+    self.name = name
+    self.version = version
+    self.inputs = inputs
+    self.depends = depends
+    self.parameters = parameters
+    self.compute = compute
+    self.write = write
+
+
+  def __repr__(self):
+    return "Stage('%s')" % self.name
+
+
+class Context(object):
+  """Per-session state shared by all stages during a run
+
+  Intermediate results needed by more than one stage (such as the ECG
+  analysis, which produces both the heart-rate and the R-peaks) are computed
+  only once per session.
+
+
+  Parameters:
+
+    obj (bob.db.hci_tagging.File): The session being processed
+
+    directory (str): The path to the root of the database installation
+
+    parameters (dict): The run parameters
+
+    cache (bob.db.hci_tagging.cache.ResultCache, optional): A cache for
+      expensive results
+
+  """
+
+  def __init__(self, obj, directory, parameters, cache=None):
+    self.obj = obj
+    self.directory = directory
+    self.parameters = parameters
+    self.cache = cache
+    self.h5 = None
+    self._qrs = None
+
+
+  def path(self, kind):
+    """Returns the path to the raw file of a given kind (``bdf`` or ``video``)"""
+
+    if kind == 'bdf': return self.obj.make_path(self.directory, '.bdf')
+    return os.path.join(self.directory, self.obj.basedir,
+        self.obj.video_stem + '.avi')
+
+
+  def qrs(self):
+    """Returns the QRS-based heart-rate, R-peaks and sampling frequency"""
+
+    if self._qrs is None:
+      self._qrs = self.obj.estimate_heartrate_in_bpm(self.directory,
+          return_peaks=True, cache=self.cache)
+    return self._qrs
+
+
+  def peaks(self):
+    """Returns the R-peaks and sampling frequency
+
+    Peaks detected during this run are returned as such. Otherwise, those
+    stored on the metadata file of the session are read, so QRS detection is
+    not repeated for outputs depending on up-to-date peaks.
+    """
+
+    if self._qrs is None and self.h5 is not None and \
+        self.h5.has_group('peaks'):
+      self.h5.cd('peaks')
+      try:
+        peaks = dict((k, self.h5.get(k).astype('int64')) for k in \
+            self.h5.keys(relative=True))
+        return peaks, float(self.h5.get_attribute('sampling_frequency'))
+      finally:
+        self.h5.cd('..')
+
+    hr, peaks, freq = self.qrs()
+    return peaks, freq
+
+
+def _identify(path):
+  """Returns the identity of a raw file: its size and modification time"""
+
+  if not os.path.exists(path):
+    raise IOError("file `%s' does not exist" % path)
+  st = os.stat(path)
+  return [st.st_size, int(st.st_mtime)]
+
+
+def fingerprint(stage, context, upstream):
+  """Computes the fingerprint of an output for a session
+
+
+  Parameters:
+
+    stage (Stage): The stage producing the output
+
+    context (Context): The session being processed
+
+    upstream (dict): The fingerprints of the outputs ``stage`` depends on
+
+
+  Returns:
+
+    str: A JSON-encoded description of the provenance of the output,
+    including a ``fingerprint`` entry, which is a digest of all the others
+
+  """
+
+  description = {
+      'version': stage.version,
+      'inputs': dict((k, _identify(context.path(k))) for k in stage.inputs),
+      'parameters': dict((k, context.parameters[k]) for k in stage.parameters),
+      'depends': dict((k, upstream[k]) for k in stage.depends),
+      }
+  encoded = json.dumps(description, sort_keys=True).encode('utf-8')
+  description['fingerprint'] = hashlib.sha256(encoded).hexdigest()
+  return json.dumps(description, sort_keys=True)
+
+
+def _exists(h5, name):
+  return h5.has_group(name) or h5.has_key(name)
+
+
+def _pending(stage):
+  """The name of the root attribute marking an output being written"""
+
+  return 'pending_' + stage.name
+
+
+def stored_fingerprint(h5, stage):
+  """Returns the fingerprint stored for an output
+
+  Returns:
+
+    str: The stored fingerprint, ``''`` if the output exists but has no
+    recorded provenance, or ``None`` if the output does not exist or its
+    writing was interrupted
+
+  """
+
+  if h5 is None or not _exists(h5, stage.name): return None
+  if h5.has_attribute(_pending(stage), '/'): return None
+  if not h5.has_attribute('provenance', stage.name): return ''
+  return json.loads(h5.get_attribute('provenance', stage.name))['fingerprint']
+
+
+def run(obj, directory, output, stages, parameters, force=False, cache=None,
+    dry_run=False):
+  """Brings the outputs of the given stages up-to-date for a session
+
+
+  Parameters:
+
+    obj (bob.db.hci_tagging.File): The session to process
+
+    directory (str): The path to the root of the database installation
+
+    output (str): The path to the metadata (HDF5) file of the session
+
+    stages (list): The stages to run, in dependency order (see
+      :py:data:`STAGES`)
+
+    parameters (dict): The run parameters, such as the heart-rate estimation
+      method (``heart_rate_method``)
+
+    force (bool): If set, recomputes all outputs, even if they are up-to-date
+
+    cache (bob.db.hci_tagging.cache.ResultCache, optional): A cache for
+      expensive results
+
+    dry_run (bool): If set, only reports the status of each output, without
+      computing anything
+
+
+  Returns:
+
+    dict: A dictionary mapping each stage name to the status of its output,
+    one of ``fresh`` (up-to-date, not recomputed), ``computed``, ``stale``
+    or ``missing`` (when ``dry_run`` is set), ``failed`` (when it could not
+    be computed) or ``external`` (when it is missing, but cannot be computed
+    by this package)
+
+  """
+
+  context = Context(obj, directory, parameters, cache)
+  h5 = bob.io.base.HDF5File(output, 'r') if os.path.exists(output) else None
+  context.h5 = h5
+
+  status = {}
+  upstream = {}
+  try:
+    for stage in stages:
+
+      if any(status.get(k) in ('failed', 'external') for k in stage.depends):
+        status[stage.name] = 'failed'
+        continue
+
+      current = json.loads(fingerprint(stage, context, upstream))['fingerprint']
+      stored = stored_fingerprint(h5, stage)
+
+      if stage.compute is None: #external output, cannot be recomputed
+        status[stage.name] = 'fresh' if stored is not None else 'external'
+        upstream[stage.name] = stored or current
+        continue
+
+      if not force and (stored == current or (stored == '' and \
+          not any(status.get(k) == 'computed' for k in stage.depends))):
+        status[stage.name] = 'fresh'
+        upstream[stage.name] = stored or current
+        continue
+
+      if dry_run:
+        status[stage.name] = 'stale' if stored is not None else 'missing'
+        upstream[stage.name] = current
+        continue
+
+      with instrument.stage(stage.name):
+        value = stage.compute(context)
+      if value is None:
+        status[stage.name] = 'failed'
+        continue
+
+      # (re-)writes the output and only then records its provenance
+      if h5 is not None: h5.close()
+      context.h5 = None
+      outdir = os.path.dirname(output)
+      if not os.path.exists(outdir): os.makedirs(outdir)
+      with instrument.stage('hdf5_write'):
+        h5 = bob.io.base.HDF5File(output, 'a')
+        context.h5 = h5
+        h5.set_attribute(_pending(stage), 1, '/')
+        h5.flush()
+        if _exists(h5, stage.name): h5.unlink(stage.name)
+        stage.write(h5, value)
+        h5.set_attribute('provenance', fingerprint(stage, context, upstream),
+            stage.name)
+        h5.del_attribute(_pending(stage), '/')
+        h5.flush()
+      status[stage.name] = 'computed'
+      upstream[stage.name] = current
+
+  finally:
+    if h5 is not None: h5.close()
+
+  return status
+
+
+# Stages
+# ======
+
+def _compute_face_detector(context):
+  bb = context.obj.run_face_detector(context.directory, max_frames=1,
+      cache=context.cache)[0]
+  return bb or None
+
+
+def _write_face_detector(h5, bb):
+  h5.create_group('face_detector')
+  h5.cd('face_detector')
+  h5.set('topleft_x', bb.topleft[1])
+  h5.set('topleft_y', bb.topleft[0])
+  h5.set('width', bb.size[1])
+  h5.set('height', bb.size[0])
+  h5.cd('..')
+
+
+def _compute_heartrate(context):
+  if context.parameters['heart_rate_method'] == 'psd':
+    hr = context.obj.estimate_heartrate_in_bpm(context.directory,
+        method='psd', cache=context.cache)
+  else:
+    hr = context.qrs()[0]
+  return hr or None
+
+
+def _write_heartrate(h5, hr):
+  h5.set('heartrate', hr)
+  h5.set_attribute('units', 'beats-per-minute', 'heartrate')
+
+
+def _compute_peaks(context):
+  hr, peaks, freq = context.qrs()
+  return peaks, freq
+
+
+def _write_peaks(h5, value):
+  peaks, freq = value
+  h5.create_group('peaks')
+  h5.cd('peaks')
+  for channel, value in peaks.items(): h5.set(channel, value)
+  h5.set_attribute('sampling_frequency', freq)
+  h5.cd('..')
+
+
+def _compute_heartrate_psd(context):
+  hr = context.obj.estimate_heartrate_in_bpm(context.directory, method='psd',
+      cache=context.cache)
+  return hr or None
+
+
+def _write_heartrate_psd(h5, hr):
+  h5.set('heartrate_psd', hr)
+  h5.set_attribute('units', 'beats-per-minute', 'heartrate_psd')
+
+
+def _compute_heartrate_trace(context):
+  peaks, freq = context.peaks()
+  retval = {}
+  for channel, value in peaks.items():
+    if len(value) < 2: continue
+    times = value[1:] / float(freq)
+    rates = (freq * 60.) / numpy.diff(value)
+    retval[channel] = numpy.vstack((times, rates))
+  return retval or None
+
+
+def _write_heartrate_trace(h5, trace):
+  h5.create_group('heartrate_trace')
+  h5.cd('heartrate_trace')
+  for channel, value in trace.items(): h5.set(channel, value)
+  h5.set_attribute('units', 'seconds, beats-per-minute')
+  h5.cd('..')
+
+
+def _compute_physiology(context):
+  from .utils import READERS
+  from .physio import CHANNELS, session_features
+  channels = context.obj.channels
+  if channels is None:
+    with READERS.reader(context.path('bdf')) as r: channels = r.labels
+  if not set(CHANNELS).issubset(channels): return None #not recorded
+  retval = session_features(context.obj, context.directory,
+      length=context.parameters['physiology_window'], cache=context.cache)
+  return retval if len(retval['start']) else None
+
+
+def _write_physiology(h5, features):
+  h5.create_group('physiology')
+  h5.cd('physiology')
+  for name, value in features.items(): h5.set(name, value)
+  h5.set_attribute('units', 'seconds, breaths-per-minute, micro-Siemens, '
+      'responses, degrees Celsius per minute')
+  h5.cd('..')
+
+
+STAGES = [
+    Stage('face_detector', version=1, inputs=('video',),
+      compute=_compute_face_detector, write=_write_face_detector),
+    Stage('heartrate', version=1, inputs=('bdf',),
+      parameters=('heart_rate_method',),
+      compute=_compute_heartrate, write=_write_heartrate),
+    Stage('drmf_landmarks66', version=0), #computed externally, with Matlab
+    ]
+"""Stages of the metadata generation step, in dependency order
+
+* ``face_detector``: The face bounding box on the first video frame
+* ``heartrate``: The average heart-rate, in beats-per-minute
+* ``drmf_landmarks66``: DRMF keypoints, which are computed externally and are
+  only checked for presence
+"""
+
+
+QRS_STAGES = [
+    Stage('peaks', version=1, inputs=('bdf',),
+      compute=_compute_peaks, write=_write_peaks),
+    Stage('heartrate_trace', version=1, depends=('peaks',),
+      compute=_compute_heartrate_trace, write=_write_heartrate_trace),
+    ]
+"""Stages depending on QRS detection, which is slow. Add them to
+:py:data:`STAGES` unless only the PSD-based heart-rate is needed.
+
+* ``peaks``: The R-peaks detected on each ECG channel
+* ``heartrate_trace``: The instantaneous heart-rate on each ECG channel, as a
+  2D array with the times of each beat (in seconds) and the rates
+"""
+
+
+HEARTRATE_PSD = Stage('heartrate_psd', version=1, inputs=('bdf',),
+    compute=_compute_heartrate_psd, write=_write_heartrate_psd)
+"""An optional stage, storing the heart-rate estimated from the ECG power
+spectra, for comparison with the QRS-based estimate"""
+
+
+PHYSIOLOGY = Stage('physiology', version=1, inputs=('bdf',),
+    parameters=('physiology_window',),
+    compute=_compute_physiology, write=_write_physiology)
+"""An optional stage, storing respiration, skin conductance and skin
+temperature features per window (see :py:mod:`bob.db.hci_tagging.physio`).
+It fails on sessions recorded without any of these channels."""
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Shared-memory transport of decoded frames and signals between processes
+
+Sending decoded video frames to worker processes through pipes pickles and
+copies them, which may cost more than the processing itself. A
+:py:class:`SharedRing` is a fixed number of equally-sized slots in a
+shared-memory segment. A producer (e.g. a single video decoder) writes each
+batch of frames (or window of signals) straight into a free slot and only
+sends the slot number, shape and data type of the batch to the consumers,
+which read it through a NumPy view of the slot, without any copy. Consumers
+return slots once done with them. When all slots are in use, the producer
+waits for one to be returned (backpressure), so memory usage is bounded and a
+fast decoder never runs ahead of slow consumers.
+
+Example::
+
+  ring = SharedRing(slots=8, slot_size=2**26)
+  workers = [multiprocessing.Process(target=work, args=(ring,)) \\
+      for k in range(4)]
+  for w in workers: w.start()
+  feed_video(ring, obj.load_video(directory), consumers=len(workers))
+  for w in workers: w.join()
+  ring.unlink()
+
+  def work(ring):
+    for batch in ring:
+      with batch:
+        process(batch.array) #a read-only view of the shared slot
+'''
+
+import multiprocessing
+
+import numpy
+
+
+class Batch(object):
+  """A batch received from a :py:class:`SharedRing`
+
+  The array is a view of the shared slot: it is only valid until the batch is
+  released (with :py:meth:`release` or at the end of a ``with`` block), after
+  which the producer may overwrite it. Copy it if it must be kept.
+
+
+  Attributes:
+
+    array (numpy.ndarray): A read-only view of the data on the slot
+
+    metadata (dict): The metadata sent by the producer with the batch
+
+  """
+
+  def __init__(self, ring, slot, array, metadata):
+    self.ring = ring
+    self.slot = slot
+    self.array = array
+    self.metadata = metadata
+
+
+  def release(self):
+    """Returns the slot to the producer"""
+
+    if self.slot is not None:
+      self.array = None
+      self.ring._free.put(self.slot)
+      self.slot = None
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *exc):
+    self.release()
+
+
+class SharedRing(object):
+  """A bounded, shared-memory transport of arrays from producers to consumers
+
+
+  Parameters:
+
+    slots (int): The number of slots. At most this number of batches are in
+      flight (written and not yet released) at any time.
+
+    slot_size (int): The size of each slot, in bytes. It must be large enough
+      for the largest batch.
+
+    context (multiprocessing.context.BaseContext, optional): The
+      multiprocessing context used to create the queues. It must match the
+      one used to start the consumer processes.
+
+  """
+
+  def __init__(self, slots=8, slot_size=2**26, context=None):
+    from multiprocessing import shared_memory
+
+    context = context or multiprocessing
+    self.slots = slots
+    self.slot_size = slot_size
+    self._memory = shared_memory.SharedMemory(create=True,
+        size=slots*slot_size)
+    self._owner = True
+    self._free = context.Queue()
+    self._ready = context.Queue()
+    for k in range(slots): self._free.put(k)
+
+
+  def __getstate__(self):
+    return {'slots': self.slots, 'slot_size': self.slot_size,
+        'name': self._memory.name, 'free': self._free, 'ready': self._ready}
+
+
+  def __setstate__(self, state):
+    from multiprocessing import shared_memory
+    self.slots = state['slots']
+    self.slot_size = state['slot_size']
+    self._free = state['free']
+    self._ready = state['ready']
+    self._owner = False
+    try: #the creator removes the segment, see unlink()
+      self._memory = shared_memory.SharedMemory(state['name'], track=False)
+    except TypeError: #python < 3.13: the tracker is shared with the creator
+      self._memory = shared_memory.SharedMemory(state['name'])
+
+
+  def _view(self, slot, shape, dtype):
+    return numpy.ndarray(shape, dtype=dtype, buffer=self._memory.buf,
+        offset=slot*self.slot_size)
+
+
+  def reserve(self, shape, dtype='uint8', timeout=None):
+    """Waits for a free slot and returns a writable view of it
+
+    Use this to write data directly into shared memory (e.g. to decode frames
+    into it), then call :py:meth:`commit`.
+
+
+    Returns:
+
+      int: The reserved slot
+
+      numpy.ndarray: A view of the slot with the given shape and data type
+
+    """
+
+    dtype = numpy.dtype(dtype)
+    nbytes = int(numpy.prod(shape)) * dtype.itemsize
+    if nbytes > self.slot_size:
+      raise ValueError("batch of %d bytes does not fit on slots of %d bytes" \
+          % (nbytes, self.slot_size))
+    slot = self._free.get(timeout=timeout)
+    return slot, self._view(slot, shape, dtype)
+
+
+  def commit(self, slot, array, **metadata):
+    """Sends a reserved slot, filled in with ``array``, to the consumers"""
+
+    self._ready.put((slot, array.shape, array.dtype.str, metadata))
+
+
+  def put(self, array, timeout=None, **metadata):
+    """Copies ``array`` into a free slot and sends it to the consumers
+
+    Waits for a slot to be released if all are in use.
+    """
+
+    array = numpy.asarray(array)
+    slot, view = self.reserve(array.shape, array.dtype, timeout)
+    view[...] = array
+    self.commit(slot, view, **metadata)
+
+
+  def get(self, timeout=None):
+    """Waits for the next batch
+
+    Returns:
+
+      Batch: The next batch, or ``None`` if the producer finished (see
+      :py:meth:`finish`)
+
+    """
+
+    message = self._ready.get(timeout=timeout)
+    if message is None: return None
+    slot, shape, dtype, metadata = message
+    array = self._view(slot, shape, dtype)
+    array.flags.writeable = False
+    return Batch(self, slot, array, metadata)
+
+
+  def __iter__(self):
+    """Yields batches until the producer finishes
+
+    Each batch is released when the next one is requested, if it was not
+    released before.
+    """
+
+    while True:
+      batch = self.get()
+      if batch is None: return
+      try:
+        yield batch
+      finally:
+        batch.release()
+
+
+  def finish(self, consumers=1):
+    """Signals the end of the stream to each of the ``consumers``"""
+
+    for k in range(consumers): self._ready.put(None)
+
+
+  def close(self):
+    """Detaches this process from the shared memory"""
+
+    self._memory.close()
+
+
+  def unlink(self):
+    """Detaches and removes the shared memory (call once, on the creator)"""
+
+    self._memory.close()
+    if self._owner: self._memory.unlink()
+
+
+def feed_video(ring, video, batch_size=16, consumers=1, timeout=None):
+  """Decodes ``video`` into the slots of ``ring``, in batches of frames
+
+  Each decoded frame is copied once, into its slot, and is never pickled.
+  Batches are sent with their first frame number (``start``) as metadata. At
+  the end, or if decoding fails, the end of the stream is signalled to each
+  consumer. The frames of a batch interrupted by a failure are not sent.
+
+
+  Parameters:
+
+    ring (SharedRing): The transport to the consumers
+
+    video (iterable): The video, as an iterable of frames in
+      (channel,y,x) notation, such as the reader returned by
+      :py:meth:`bob.db.hci_tagging.File.load_video`
+
+    batch_size (int): The number of frames on each batch
+
+    consumers (int): The number of consumers reading from ``ring``
+
+
+  Returns:
+
+    int: The number of frames sent
+
+  """
+
+  count = 0
+  slot = view = None
+  try:
+    for frame in video:
+      if view is None:
+        slot, view = ring.reserve((batch_size,) + frame.shape, frame.dtype,
+            timeout)
+        filled = 0
+      view[filled] = frame
+      filled += 1
+      if filled == batch_size:
+        ring.commit(slot, view, start=count)
+        count += filled
+        slot = view = None
+
+    if view is not None: #last, partial batch
+      ring.commit(slot, view[:filled], start=count)
+      count += filled
+      slot = view = None
+
+  finally:
+    if slot is not None: ring._free.put(slot) #interrupted batch
+    ring.finish(consumers)
+
+  return count
+
+
+def feed_signals(ring, windows, directory, channels=('EXG1', 'EXG2', 'EXG3'),
+    consumers=1, timeout=None):
+  """Loads the signals of each window and sends them through ``ring``
+
+  Batches are sent with the session, window boundaries and sampling frequency
+  as metadata. At the end, or if loading fails, the end of the stream is
+  signalled to each consumer.
+
+
+  Parameters:
+
+    ring (SharedRing): The transport to the consumers
+
+    windows (iterable): The windows to load, such as a
+      :py:class:`bob.db.hci_tagging.windows.WindowIndex`
+
+    directory (str): The path to the root of the database installation
+
+    channels (tuple): The names of the channels to load
+
+    consumers (int): The number of consumers reading from ``ring``
+
+  """
+
+  try:
+    for window in windows:
+      signals, freq = window.load_signals(directory, channels)
+      ring.put(signals, timeout, session=window.file.stem, start=window.start,
+          end=window.end, sampling_frequency=freq)
+  finally:
+    ring.finish(consumers)
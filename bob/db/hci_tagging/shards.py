@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Sequential shard files of preprocessed samples
+
+Samples are written, one after the other, into a few large shard files, so
+they can be read back front to back at full disk bandwidth instead of through
+many small random reads. Each sample (record) is a sequence of arrays in
+NumPy's ``.npy`` format. An index (``index.json``) lists every record with
+its shard, byte offset and metadata.
+'''
+
+import os
+import json
+import numpy
+
+
+INDEX = 'index.json'
+
+
+class ShardWriter(object):
+  """Writes records into sequential shard files
+
+
+  Parameters:
+
+    directory (str): The directory where shards and the index are written. It
+      is created if it does not exist.
+
+    arrays (tuple): The names of the arrays of each record, in order
+
+    shard_size (int): The size, in bytes, after which a new shard is started
+
+  """
+
+  def __init__(self, directory, arrays, shard_size=2**30):
+    self.directory = directory
+    self.arrays = tuple(arrays)
+    self.shard_size = shard_size
+    self.records = []
+    self.shards = []
+    self._file = None
+    if not os.path.exists(self.directory): os.makedirs(self.directory)
+
+
+  def _next_shard(self):
+    if self._file is not None: self._file.close()
+    name = 'shard-%05d.bin' % len(self.shards)
+    self.shards.append(name)
+    self._file = open(os.path.join(self.directory, name), 'wb')
+
+
+  def append(self, arrays, **metadata):
+    """Appends a record to the current shard
+
+    Parameters:
+
+      arrays (dict): The arrays of the record, indexed by name. All names
+        given at construction must be present.
+
+      metadata: Further (JSON-serializable) information stored on the index
+        for this record
+
+    """
+
+    if self._file is None or self._file.tell() >= self.shard_size:
+      self._next_shard()
+
+    offset = self._file.tell()
+    for name in self.arrays:
+      numpy.lib.format.write_array(self._file,
+          numpy.ascontiguousarray(arrays[name]), allow_pickle=False)
+
+    entry = dict(metadata)
+    entry.update(shard=self.shards[-1], offset=offset,
+        size=self._file.tell()-offset)
+    self.records.append(entry)
+
+
+  def close(self):
+    """Closes the current shard and writes the index"""
+
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+    with open(os.path.join(self.directory, INDEX), 'wt') as f:
+      json.dump({'arrays': self.arrays, 'shards': self.shards,
+        'records': self.records}, f)
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+class ShardReader(object):
+  """Streams records from shard files written by :py:class:`ShardWriter`
+
+  Parameters:
+
+    directory (str): The directory containing the shards and their index
+
+    buffer_size (int): The size of the read buffer of each shard, in bytes
+
+  """
+
+  def __init__(self, directory, buffer_size=2**24):
+    self.directory = directory
+    self.buffer_size = buffer_size
+    with open(os.path.join(directory, INDEX), 'rt') as f:
+      index = json.load(f)
+    self.arrays = tuple(index['arrays'])
+    self.shards = index['shards']
+    self.records = index['records']
+
+
+  def __len__(self):
+    return len(self.records)
+
+
+  def __iter__(self):
+    return self.iterate()
+
+
+  def iterate(self, shards=None):
+    """Reads records, shard by shard, each from front to back
+
+
+    Parameters:
+
+      shards (list, optional): The names of the shards to read (e.g. a
+        partition of :py:attr:`shards` for one of many workers). If not set,
+        all shards are read.
+
+
+    Yields:
+
+      dict: The arrays of each record, indexed by name, and its metadata
+
+    """
+
+    shards = self.shards if shards is None else shards
+    by_shard = {}
+    for record in self.records:
+      by_shard.setdefault(record['shard'], []).append(record)
+
+    for shard in shards:
+      path = os.path.join(self.directory, shard)
+      with open(path, 'rb', buffering=self.buffer_size) as f:
+        for record in by_shard.get(shard, []):
+          if f.tell() != record['offset']: f.seek(record['offset'])
+          retval = dict(record)
+          for name in self.arrays:
+            retval[name] = numpy.lib.format.read_array(f, allow_pickle=False)
+          yield retval
+
+
+  def __getitem__(self, index):
+    """Reads a single record, at random"""
+
+    record = self.records[index]
+    with open(os.path.join(self.directory, record['shard']), 'rb') as f:
+      f.seek(record['offset'])
+      retval = dict(record)
+      for name in self.arrays:
+        retval[name] = numpy.lib.format.read_array(f, allow_pickle=False)
+    return retval
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''A compiled, memory-mapped index of the database metadata
+
+Parsing ``metadata.csv`` gives each process its own list of dictionaries,
+and merely touching those objects in a forked worker updates their reference
+counts, which copies the memory pages holding them. This module compiles the
+descriptor, the protocol lists and bulk annotations (the average heart-rate
+and the face bounding-boxes of every session) once into a few flat NumPy
+arrays on disk. A :py:class:`SharedIndex` maps those files read-only: all
+processes using the same index share its pages through the operating system
+page cache, and attaching to it costs no parsing, whatever the number of
+sessions. Rows are only decoded into Python objects when accessed.
+
+The index records the identity (size and modification time) of the files it
+was compiled from: the descriptor, the protocol lists and the annotation
+files of each session. It is compiled again when any of them changes (e.g.
+after running the metadata generation step), so it never returns stale
+labels. Checking these identities costs one ``stat`` per file.
+
+The index is stored on a directory with the following files:
+
+* ``metadata.npy``: A structured array of fixed-width byte strings, one field
+  per column of the descriptor
+* ``protocols.npy``: The protocol and subset membership of each session, as
+  bit flags (see :py:data:`FLAGS`)
+* ``heart_rates.npy``: The average heart-rate of each session, in
+  beats-per-minute (``NaN`` if not available)
+* ``boxes.npy`` and ``box_offsets.npy``: The face bounding-boxes of all
+  sessions, as rows with the frame number, ``x``, ``y``, width and height
+  (as on ``.face`` files), and the position of the first box of each session
+  (``boxes[offsets[k]:offsets[k+1]]`` are those of session ``k``)
+* ``keyframes.npy`` and ``keyframe_offsets.npy``: The keyframe index of all
+  session videos, stored in the same way as the bounding-boxes
+* ``source.json``: The identity of the files it was compiled from
+'''
+
+import os
+import json
+import numpy
+
+
+FLAGS = {
+    ('all', 'train'): 1,
+    ('all', 'dev'): 2,
+    ('all', 'test'): 4,
+    ('cvpr14', None): 8,
+    }
+"""Bit flags of the protocol and subset membership of sessions"""
+
+_LISTS = {
+    ('all', 'train'): os.path.join('all', 'train.txt'),
+    ('all', 'dev'): os.path.join('all', 'dev.txt'),
+    ('all', 'test'): os.path.join('all', 'test.txt'),
+    ('cvpr14', None): os.path.join('cvpr14', 'li_samples_cvpr14.txt'),
+    }
+
+
+def _identity(path):
+  """Returns the size and mtime of a file, or ``None`` if it does not exist"""
+
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return [st.st_size, st.st_mtime_ns]
+
+
+def _source(location, sessions, keyframes, protocols, annotations):
+  """Returns the identity of all files an index is compiled from
+
+  Parameters:
+
+    location (str): The path to the CSV descriptor
+
+    sessions (list): The ``(basedir, bdf)`` pair of each session of the
+      descriptor
+
+    keyframes, protocols, annotations: See :py:func:`build`
+
+
+  Returns:
+
+    dict: The path and identity of the descriptor, the identity of the
+    keyframe index and of each protocol list, and a digest of the identities
+    of all annotation files
+
+  """
+
+  import hashlib
+
+  digest = hashlib.sha256()
+  for basedir, bdf in sessions:
+    for path in (os.path.join(annotations, basedir, bdf + '.hdf5'),
+        os.path.join(annotations, 'bbox', basedir, bdf + '.face')):
+      digest.update(json.dumps(_identity(path)).encode('utf-8'))
+
+  return {
+      'location': os.path.abspath(location),
+      'descriptor': _identity(location),
+      'keyframes': _identity(keyframes),
+      'protocols': dict((os.path.join(*k) if k[1] else k[0],
+        _identity(os.path.join(protocols, v))) for k, v in _LISTS.items()),
+      'annotations': os.path.abspath(annotations),
+      'labels': digest.hexdigest(),
+      }
+
+
+def _heart_rate(path):
+  """Reads the average heart-rate from a metadata file, if available"""
+
+  if not os.path.exists(path): return numpy.nan
+  import bob.io.base
+  f = bob.io.base.HDF5File(path)
+  return float(f.get('heartrate')) if f.has_key('heartrate') else numpy.nan
+
+
+def _boxes(path):
+  """Reads a ``.face`` file, if available"""
+
+  if not os.path.exists(path): return numpy.zeros((0, 5), dtype='float32')
+  return numpy.loadtxt(path, dtype='float32', ndmin=2).reshape(-1, 5)
+
+
+def _pack(arrays, dtype, shape=()):
+  """Concatenates arrays, returning the result and the offset of each one"""
+
+  offsets = numpy.cumsum([0] + [len(k) for k in arrays]).astype('int64')
+  if not arrays: return numpy.zeros((0,) + shape, dtype=dtype), offsets
+  return numpy.concatenate(arrays).astype(dtype), offsets
+
+
+def membership(basedirs, protocols):
+  """Returns the protocol and subset membership of sessions
+
+  Parameters:
+
+    basedirs (list): The base directory of each session (e.g.
+      ``Sessions/3884``)
+
+    protocols (str): The directory containing the protocol lists
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array of 8-bit unsigned integers with the bit flags
+    (see :py:data:`FLAGS`) of each session
+
+  """
+
+  position = dict((k, i) for i, k in enumerate(basedirs))
+  flags = numpy.zeros(len(basedirs), dtype='uint8')
+  for key, name in _LISTS.items():
+    filename = os.path.join(protocols, name)
+    if not os.path.exists(filename): continue
+    with open(filename, 'rt') as f:
+      for basedir in f.read().split():
+        if basedir in position: flags[position[basedir]] |= FLAGS[key]
+  return flags
+
+
+def build(path, location, keyframes, protocols, annotations):
+  """Compiles the index of a database at ``path``
+
+  The index is written to a temporary directory first, which is then renamed,
+  so processes never attach to a partial index.
+
+
+  Parameters:
+
+    path (str): The directory where the index is written
+
+    location (str): The path to the CSV descriptor of the database
+
+    keyframes (str): The path to the keyframe index built with the descriptor
+
+    protocols (str): The directory containing the protocol lists
+
+    annotations (str): The directory containing the face bounding-boxes and
+      metadata (HDF5) files of each session
+
+  """
+
+  import csv
+  import shutil
+  import tempfile
+
+  with open(location) as f:
+    rows = list(csv.DictReader(f))
+  columns = list(rows[0].keys()) if rows else ['basedir', 'bdf', 'video',
+      'duration']
+
+  # identifies the inputs before reading them, so changes made while
+  # compiling are detected on the next attach
+  source = _source(location, [(k['basedir'], k['bdf']) for k in rows],
+      keyframes, protocols, annotations)
+
+  encoded = dict((c, [k[c].encode('utf-8') for k in rows]) for c in columns)
+  dtype = [(c, 'S%d' % max([len(k) for k in encoded[c]] + [1])) \
+      for c in columns]
+  metadata = numpy.zeros(len(rows), dtype=dtype)
+  for c in columns: metadata[c] = encoded[c]
+
+  flags = membership([k['basedir'] for k in rows], protocols)
+
+  heart_rates = numpy.array([_heart_rate(os.path.join(annotations,
+    k['basedir'], k['bdf'] + '.hdf5')) for k in rows], dtype='float64')
+
+  boxes, box_offsets = _pack([_boxes(os.path.join(annotations, 'bbox',
+    k['basedir'], k['bdf'] + '.face')) for k in rows], 'float32', (5,))
+
+  from .video import load_index
+  index = load_index(keyframes)
+  frames, frame_offsets = _pack([index.get(k['basedir'], []) for k in rows],
+      'int64')
+
+  parent = os.path.dirname(os.path.abspath(path))
+  if not os.path.exists(parent): os.makedirs(parent)
+  tmp = tempfile.mkdtemp(dir=parent, prefix='.index-')
+  try:
+    numpy.save(os.path.join(tmp, 'metadata.npy'), metadata)
+    numpy.save(os.path.join(tmp, 'protocols.npy'), flags)
+    numpy.save(os.path.join(tmp, 'heart_rates.npy'), heart_rates)
+    numpy.save(os.path.join(tmp, 'boxes.npy'), boxes)
+    numpy.save(os.path.join(tmp, 'box_offsets.npy'), box_offsets)
+    numpy.save(os.path.join(tmp, 'keyframes.npy'), frames)
+    numpy.save(os.path.join(tmp, 'keyframe_offsets.npy'), frame_offsets)
+    with open(os.path.join(tmp, 'source.json'), 'wt') as f:
+      json.dump(source, f)
+    if os.path.exists(path): shutil.rmtree(path)
+    os.rename(tmp, path)
+  except:
+    shutil.rmtree(tmp, ignore_errors=True)
+    raise
+
+
+class SharedIndex(object):
+  """A read-only, memory-mapped view of a compiled index
+
+  It behaves like the list of rows of the descriptor (dictionaries mapping
+  column names to strings), which are decoded on access. When pickled (e.g.
+  sent to a worker process), only its path is transferred, and the worker
+  maps the same files.
+
+
+  Parameters:
+
+    path (str): The directory of the index (see :py:func:`build`)
+
+  """
+
+  def __init__(self, path):
+    self.path = path
+    load = lambda k: numpy.load(os.path.join(path, k + '.npy'), mmap_mode='r')
+    self.metadata = load('metadata')
+    self.protocols = load('protocols')
+    self.heart_rates = load('heart_rates')
+    self.boxes = load('boxes')
+    self.box_offsets = load('box_offsets')
+    self.keyframe_index = load('keyframes')
+    self.keyframe_offsets = load('keyframe_offsets')
+    self.columns = self.metadata.dtype.names
+
+
+  def __getstate__(self):
+    return {'path': self.path}
+
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+
+  def __len__(self):
+    return len(self.metadata)
+
+
+  def __getitem__(self, position):
+    row = self.metadata[position]
+    return dict((c, row[c].decode('utf-8')) for c in self.columns)
+
+
+  def __iter__(self):
+    for k in range(len(self)): yield self[k]
+
+
+  def select(self, protocol='all', subset=None):
+    """Returns the positions of the sessions of a protocol and subset
+
+    See :py:meth:`bob.db.hci_tagging.Database.objects` for a description of
+    the parameters. Positions are returned in the same order as the objects
+    of the database.
+    """
+
+    if protocol in ('cvpr14',):
+      return numpy.flatnonzero(self.protocols & FLAGS[('cvpr14', None)])
+
+    if not subset: return numpy.arange(len(self))
+
+    return numpy.concatenate([numpy.flatnonzero(self.protocols & \
+        FLAGS[('all', k)]) for k in ('train', 'dev', 'test') if k in subset] \
+        + [numpy.zeros(0, dtype=int)])
+
+
+  def heart_rate(self, position):
+    """Returns the average heart-rate of a session, or ``None``"""
+
+    value = float(self.heart_rates[position])
+    return None if numpy.isnan(value) else value
+
+
+  def face_boxes(self, position):
+    """Returns the face bounding-boxes of a session, as a read-only view
+
+    Returns:
+
+      numpy.ndarray: A 2D array with the frame number, ``x``, ``y``, width and
+      height of each box (possibly empty)
+
+    """
+
+    return self.boxes[self.box_offsets[position]:self.box_offsets[position+1]]
+
+
+  def keyframes(self, position):
+    """Returns the keyframes of a session video, as a read-only view, or
+    ``None`` if they are not indexed"""
+
+    start, end = self.keyframe_offsets[position:position+2]
+    return self.keyframe_index[start:end] if end > start else None
+
+
+def attach(path, location, keyframes, protocols, annotations):
+  """Maps the index at ``path``, compiling it first if needed
+
+  The index is (re-)compiled if it does not exist or if any of the files it
+  was compiled from (the descriptor, keyframe index, protocol lists or
+  annotation files) changed since. To avoid concurrent compilations, attach
+  to it once in the parent process before starting workers.
+
+
+  Parameters:
+
+    path, location, keyframes, protocols, annotations: See :py:func:`build`
+
+
+  Returns:
+
+    SharedIndex: The mapped index
+
+  """
+
+  source = os.path.join(path, 'source.json')
+  if os.path.exists(source):
+    with open(source, 'rt') as f: stored = json.load(f)
+    index = SharedIndex(path)
+    sessions = zip(index.metadata['basedir'], index.metadata['bdf'])
+    current = _source(location, [(b.decode('utf-8'), s.decode('utf-8')) \
+        for b, s in sessions], keyframes, protocols, annotations)
+    if current == stored: return index
+    del index
+
+  build(path, location, keyframes, protocols, annotations)
+  return SharedIndex(path)
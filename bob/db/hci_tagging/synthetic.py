@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Synthetic database with the layout of the HCI-Tagging database
+
+The raw files of the HCI-Tagging database are only available on a few
+systems. The functions in this module write a synthetic copy of its layout,
+at configurable scale: BDF files with EEG, ECG (``EXG1``-``EXG3``),
+peripheral and ``Status`` channels, short ``C1 trigger`` videos showing a
+skin patch whose colour pulses at the heart-rate, face bounding-boxes,
+metadata files with the heart-rate and the protocol lists. Benchmarks and
+tests can then run anywhere (see :py:mod:`bob.db.hci_tagging.benchmark`).
+
+The generated tree looks like this::
+
+  <directory>/
+    Sessions/<n>/Part_<p>_Trial<t>_synthetic.bdf
+    Sessions/<n>/P<p>-Rec1-synthetic_C1 trigger _C_Section_<t>.avi
+    metadata.csv
+    keyframes.txt
+    protocols/all/{train,dev,test}.txt
+    protocols/cvpr14/li_samples_cvpr14.txt
+    annotations/bbox/Sessions/<n>/<bdf stem>.face
+    annotations/Sessions/<n>/<bdf stem>.hdf5
+'''
+
+import os
+import numpy
+
+
+EEG = ('Fp1', 'AF3', 'F3', 'F7', 'FC5', 'FC1', 'C3', 'T7', 'CP5', 'CP1', 'P3',
+    'P7', 'PO3', 'O1', 'Oz', 'Pz', 'Fp2', 'AF4', 'Fz', 'F4', 'F8', 'FC6', 'FC2',
+    'Cz', 'C4', 'T8', 'CP6', 'CP2', 'P4', 'P8', 'PO4', 'O2')
+"""Names of the EEG channels, in the order of the original BDF files"""
+
+CHANNELS = EEG + ('EXG1', 'EXG2', 'EXG3', 'GSR1', 'Resp', 'Temp', 'Status')
+"""Names of all channels written on synthetic BDF files"""
+
+
+def ecg(heart_rate, duration, sampling_frequency, random):
+  """Generates ECG-like signals for the three ECG electrodes
+
+  Each beat is a sharp R wave followed by a T wave. Beat intervals vary
+  slightly around the one of ``heart_rate``, in beats-per-minute.
+
+
+  Returns:
+
+    numpy.ndarray: A 2D array with 3 rows (``EXG1``, ``EXG2`` and ``EXG3``)
+
+    numpy.ndarray: The times of the R-peaks, in seconds
+
+  """
+
+  time = numpy.arange(int(duration*sampling_frequency)) / sampling_frequency
+  intervals = (60. / heart_rate) * (1 + 0.03*random.randn(int(duration *
+    heart_rate / 50.) + 2))
+  beats = numpy.cumsum(intervals) - intervals[0] / 2
+  beats = beats[beats < duration]
+
+  wave = numpy.zeros_like(time)
+  for beat in beats:
+    around = slice(max(int((beat-0.5)*sampling_frequency), 0),
+        int((beat+0.8)*sampling_frequency))
+    t = time[around] - beat
+    wave[around] += numpy.exp(-(t/0.01)**2) - 0.2*numpy.exp(-((t-0.25)/0.05)**2)
+
+  gains = (600., -400., 1000.)
+  retval = numpy.array([k*wave + 30.*random.randn(len(time)) for k in gains])
+  return retval, beats
+
+
+def peripheral(duration, sampling_frequency, random):
+  """Generates respiration, skin conductance and temperature signals
+
+  Returns:
+
+    numpy.ndarray: A 2D array with 3 rows (``GSR1``, ``Resp`` and ``Temp``)
+
+  """
+
+  time = numpy.arange(int(duration*sampling_frequency)) / sampling_frequency
+  breathing = random.uniform(0.2, 0.35) #Hz
+  resp = 2000. * numpy.sin(2*numpy.pi*breathing*time) + \
+      50. * random.randn(len(time))
+  gsr = 2e5 + 5e3 * numpy.cumsum(random.randn(len(time))) / \
+      numpy.sqrt(sampling_frequency)
+  temp = 31. + 0.01 * time + 0.01 * random.randn(len(time))
+  return numpy.array([gsr, resp, temp])
+
+
+def write_bdf(path, signals, sampling_frequency):
+  """Writes signals on a BDF file, one channel per row, named after
+  :py:data:`CHANNELS`"""
+
+  import pyedflib
+
+  headers = []
+  for label, signal in zip(CHANNELS, signals):
+    low, high = float(signal.min()), float(signal.max())
+    margin = max(1., 0.01 * (high - low))
+    headers.append({
+      'label': label,
+      'dimension': 'Boolean' if label == 'Status' else 'uV',
+      'sample_rate': sampling_frequency,
+      'sample_frequency': sampling_frequency,
+      'physical_min': low - margin,
+      'physical_max': high + margin,
+      'digital_min': -2**23,
+      'digital_max': 2**23 - 1,
+      'transducer': '',
+      'prefilter': '',
+      })
+
+  writer = pyedflib.EdfWriter(path, len(headers),
+      file_type=pyedflib.FILETYPE_BDFPLUS)
+  try:
+    writer.setSignalHeaders(headers)
+    writer.writeSamples([numpy.ascontiguousarray(k) for k in signals])
+  finally:
+    writer.close()
+
+
+def write_video(path, heart_rate, duration, frame_rate, width, height,
+    random):
+  """Writes a video of a skin patch pulsing at ``heart_rate``
+
+  Returns:
+
+    numpy.ndarray: The face bounding-box on each frame, as rows with the
+    frame number, ``x``, ``y``, width and height (as on ``.face`` files)
+
+  """
+
+  import av
+
+  n = int(round(duration * frame_rate))
+  time = numpy.arange(n) / float(frame_rate)
+  pulse = 1 + 0.02 * numpy.sin(2 * numpy.pi * heart_rate / 60. * time)
+
+  # the patch moves slowly around the center of the frame
+  w, h = width // 3, height // 2
+  x = (width - w) // 2 + numpy.round(3 * numpy.sin(0.5 * time)).astype(int)
+  y = (height - h) // 2 + numpy.round(2 * numpy.cos(0.3 * time)).astype(int)
+
+  yy, xx = numpy.mgrid[:h, :w]
+  mask = ((yy - h/2.) / (h/2.))**2 + ((xx - w/2.) / (w/2.))**2 <= 1
+  skin = numpy.array([190., 140., 120.])
+  background = random.randint(30, 90, size=(height, width, 3)).astype('uint8')
+
+  with av.open(path, 'w') as container:
+    stream = container.add_stream('mpeg4', rate=int(round(frame_rate)))
+    stream.width = width
+    stream.height = height
+    stream.pix_fmt = 'yuv420p'
+    stream.codec_context.gop_size = int(round(frame_rate))
+    for k in range(n):
+      image = background.copy()
+      patch = image[y[k]:y[k]+h, x[k]:x[k]+w]
+      patch[mask] = numpy.clip(skin * pulse[k], 0, 255).astype('uint8')
+      frame = av.VideoFrame.from_ndarray(image, format='rgb24')
+      for packet in stream.encode(frame): container.mux(packet)
+    for packet in stream.encode(): container.mux(packet)
+
+  return numpy.column_stack((numpy.arange(n), x, y, numpy.full(n, w),
+    numpy.full(n, h)))
+
+
+def layout(directory):
+  """Returns the paths of a synthetic tree at ``directory``
+
+  See :py:func:`generate` for a description of the returned dictionary.
+  """
+
+  return {
+      'directory': directory,
+      'location': os.path.join(directory, 'metadata.csv'),
+      'keyframes': os.path.join(directory, 'keyframes.txt'),
+      'protocols': os.path.join(directory, 'protocols'),
+      'annotations': os.path.join(directory, 'annotations'),
+      }
+
+
+def generate(directory, sessions=10, duration=10., sampling_frequency=256.,
+    frame_rate=61., width=160, height=120, padding=2., seed=0, jobs=4):
+  """Writes a synthetic database tree
+
+
+  Parameters:
+
+    directory (str): The directory where the tree is written
+
+    sessions (int): The number of sessions
+
+    duration (float): The duration of each session video, in seconds
+
+    sampling_frequency (float): The sampling frequency of all channels of the
+      BDF files, in Hz
+
+    frame_rate (float): The frame rate of the videos, in Hz
+
+    width, height (int): The size of the video frames, in pixels
+
+    padding (float): The time, in seconds, recorded on BDF files before and
+      after the video period marked on the ``Status`` channel
+
+    seed (int): The seed for the random generator
+
+    jobs (int): The number of threads used to probe the generated files when
+      writing ``metadata.csv``
+
+
+  Returns:
+
+    dict: The paths to pass to :py:class:`bob.db.hci_tagging.Database` to use
+    the synthetic tree: ``location``, ``keyframes``, ``protocols`` and
+    ``annotations``, plus the ``directory`` to pass when loading raw files and
+    the ground-truth ``heart_rates`` of each session, indexed by base
+    directory
+
+  """
+
+  import argparse
+  import bob.io.base
+  from .create import COLUMNS, scan
+  from .video import save_index
+
+  random = numpy.random.RandomState(seed)
+  paths = layout(directory)
+  paths['heart_rates'] = {}
+
+  # BDF records last one second: pads the recording to full seconds
+  total = int(numpy.ceil(duration + 2*padding))
+  sync_start = int(padding * sampling_frequency)
+  sync_end = sync_start + int(duration * sampling_frequency) - 1
+
+  for k in range(sessions):
+    person, trial = k // 20 + 1, k % 20 + 1
+    basedir = os.path.join('Sessions', str(k + 1))
+    stem = 'Part_%d_Trial%d_synthetic' % (person, trial)
+    video_stem = 'P%d-Rec1-synthetic_C1 trigger _C_Section_%d' % \
+        (person, trial)
+    heart_rate = random.uniform(55., 100.)
+    paths['heart_rates'][basedir] = heart_rate
+
+    session_dir = os.path.join(directory, basedir)
+    if not os.path.exists(session_dir): os.makedirs(session_dir)
+
+    ecg_signals, beats = ecg(heart_rate, total, sampling_frequency, random)
+    eeg = 10. * random.randn(len(EEG), ecg_signals.shape[1])
+    status = numpy.zeros((1, ecg_signals.shape[1]))
+    status[0, sync_start:sync_end+1] = 1
+    signals = numpy.vstack((eeg, ecg_signals, peripheral(total,
+      sampling_frequency, random), status))
+    write_bdf(os.path.join(session_dir, stem + '.bdf'), signals,
+        sampling_frequency)
+
+    boxes = write_video(os.path.join(session_dir, video_stem + '.avi'),
+        heart_rate, duration, frame_rate, width, height, random)
+
+    bbox_dir = os.path.join(paths['annotations'], 'bbox', basedir)
+    if not os.path.exists(bbox_dir): os.makedirs(bbox_dir)
+    numpy.savetxt(os.path.join(bbox_dir, stem + '.face'), boxes, fmt='%d')
+
+    meta_dir = os.path.join(paths['annotations'], basedir)
+    if not os.path.exists(meta_dir): os.makedirs(meta_dir)
+    h5 = bob.io.base.HDF5File(os.path.join(meta_dir, stem + '.hdf5'), 'w')
+    h5.set('heartrate', heart_rate)
+    h5.set_attribute('units', 'beats-per-minute', 'heartrate')
+    h5.close()
+
+  # the descriptor is built just like the one of the real database
+  import csv
+  args = argparse.Namespace(basedir=directory, jobs=jobs, checksums=False,
+      verbose=0)
+  rows = sorted(scan(args), key=lambda k: int(k['basedir'].split(os.sep)[-1]))
+  index = {}
+  with open(paths['location'], 'w') as f:
+    writer = csv.DictWriter(f, COLUMNS, delimiter=',')
+    writer.writeheader()
+    for row in rows:
+      index[row['basedir']] = row.pop('keyframes')
+      writer.writerow(row)
+  save_index(index, paths['keyframes'])
+
+  # protocols: 60% of the sessions for training, 20% each for dev and test
+  basedirs = [k['basedir'] for k in rows]
+  train, dev = int(0.6 * len(basedirs)), int(0.8 * len(basedirs))
+  lists = {
+      ('all', 'train.txt'): basedirs[:train],
+      ('all', 'dev.txt'): basedirs[train:dev],
+      ('all', 'test.txt'): basedirs[dev:],
+      ('cvpr14', 'li_samples_cvpr14.txt'): basedirs[::2],
+      }
+  for (protocol, name), entries in lists.items():
+    protocol_dir = os.path.join(paths['protocols'], protocol)
+    if not os.path.exists(protocol_dir): os.makedirs(protocol_dir)
+    with open(os.path.join(protocol_dir, name), 'wt') as f:
+      f.write('\n'.join(entries) + '\n')
+
+  return paths
+
+
+def database(paths, **kwargs):
+  """Returns a :py:class:`bob.db.hci_tagging.Database` for a synthetic tree
+
+  Parameters:
+
+    paths (dict): As returned by :py:func:`generate` or :py:func:`layout`
+
+    kwargs: Further parameters for the database (e.g. ``cache_size``)
+
+  """
+
+  from . import Database
+  return Database(location=paths['location'], keyframes=paths['keyframes'],
+      protocols=paths['protocols'], annotations=paths['annotations'],
+      **kwargs)
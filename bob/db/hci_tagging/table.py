@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''A columnar table of all sessions, their protocols and labels
+
+The table has one row per session of the database and the following columns:
+
+* All columns of the descriptor (``metadata.csv``), with integer and
+  floating-point columns converted as such
+* ``all_train``, ``all_dev``, ``all_test`` and ``cvpr14``: Booleans with the
+  protocol and subset membership of each session
+* The labels found on the metadata (HDF5) file of each session, null where
+  not available:
+
+  * ``heartrate`` and ``heartrate_psd``: The average heart-rate estimates, in
+    beats-per-minute
+  * ``face_x``, ``face_y``, ``face_width`` and ``face_height``: The face
+    bounding box on the first video frame
+  * ``heartrate_trace_<channel>_time`` and ``heartrate_trace_<channel>_rate``:
+    Lists with the time (in seconds) and instantaneous heart-rate (in
+    beats-per-minute) of each beat detected on the ECG channels ``EXG1``,
+    ``EXG2`` and ``EXG3``
+  * ``hrv_*``: The heart-rate variability features computed from the stored
+    R-peaks of ``EXG3`` (see :py:mod:`bob.db.hci_tagging.hrv`)
+  * ``physiology_*``: Lists with the respiration, skin conductance and skin
+    temperature features of each window (see
+    :py:mod:`bob.db.hci_tagging.physio`)
+  * ``drmf_landmarks66``: A list with the 66 DRMF keypoints on the first
+    video frame, as consecutive ``(y, x)`` pairs
+
+The R-peaks themselves are not exported: the beat times of the heart-rate
+traces are derived from them. EEG band powers (see
+:py:mod:`bob.db.hci_tagging.eeg`) are not labels stored on the metadata
+files, but features computed from the raw files on demand, so they are not
+exported either.
+
+Tables are written with `pyarrow`_ (an optional dependency), either as
+Parquet files (compact, for archival and exchange), or as uncompressed Arrow
+IPC files, which :py:func:`load` memory-maps: columns are then read straight
+from the operating system page cache, without copies.
+
+.. _pyarrow: https://arrow.apache.org/docs/python/
+'''
+
+import os
+import collections
+
+import numpy
+
+
+PROTOCOLS = (
+    ('all_train', ('all', 'train')),
+    ('all_dev', ('all', 'dev')),
+    ('all_test', ('all', 'test')),
+    ('cvpr14', ('cvpr14', None)),
+    )
+"""The protocol membership columns, and their keys on
+:py:data:`bob.db.hci_tagging.shared.FLAGS`"""
+
+
+HRV = ('mean_rr', 'mean_hr', 'sdnn', 'rmssd', 'pnn50', 'lf', 'hf', 'lf_hf')
+"""The heart-rate variability features, see :py:mod:`bob.db.hci_tagging.hrv`"""
+
+
+ECG = ('EXG1', 'EXG2', 'EXG3')
+"""The ECG channels whose heart-rate traces are exported"""
+
+
+PHYSIOLOGY = ('start', 'breathing_rate', 'gsr_level', 'gsr_responses',
+    'temperature_slope')
+"""The physiological features, see :py:func:`bob.db.hci_tagging.physio.features`"""
+
+
+def _convert(values):
+  '''Converts a column of strings to integers or floats, if possible
+
+  Empty strings are converted to ``None`` (null).
+
+
+  Returns:
+
+    list: The converted values
+
+    str: The type of the column, one of ``int64``, ``float64`` or ``string``
+
+  '''
+
+  for kind, cast in (('int64', int), ('float64', float)):
+    try:
+      return [cast(k) if k != '' else None for k in values], kind
+    except ValueError:
+      pass
+  return [k if k != '' else None for k in values], 'string'
+
+
+def _scalar(value):
+  return None if value is None or numpy.isnan(value) else float(value)
+
+
+def _read_labels(path):
+  '''Reads the labels on a metadata file, opening it once'''
+
+  import bob.io.base
+
+  retval = {}
+  if not os.path.exists(path): return retval
+
+  f = bob.io.base.HDF5File(path)
+  try:
+    for name in ('heartrate', 'heartrate_psd'):
+      if f.has_key(name): retval[name] = float(f.get(name))
+
+    if f.has_group('face_detector'):
+      f.cd('face_detector')
+      for name in ('x', 'y', 'width', 'height'):
+        key = name if name in ('width', 'height') else 'topleft_' + name
+        retval['face_' + name] = float(f.get(key))
+      f.cd('..')
+
+    if f.has_group('peaks'):
+      f.cd('peaks')
+      if f.has_key('EXG3'):
+        retval['peaks'] = (f.get('EXG3'),
+            float(f.get_attribute('sampling_frequency')))
+      f.cd('..')
+
+    if f.has_group('heartrate_trace'):
+      f.cd('heartrate_trace')
+      retval['heartrate_trace'] = dict((k, f.get(k)) for k in \
+          f.keys(relative=True))
+      f.cd('..')
+
+    if f.has_key('drmf_landmarks66'):
+      retval['drmf_landmarks66'] = f.get('drmf_landmarks66')
+
+    if f.has_group('physiology'):
+      f.cd('physiology')
+      retval['physiology'] = dict((k, f.get(k)) for k in \
+          f.keys(relative=True))
+      f.cd('..')
+
+  finally:
+    f.close()
+
+  return retval
+
+
+def columns(db, labels=True):
+  '''Builds the columns of the table of a database
+
+
+  Parameters:
+
+    db (bob.db.hci_tagging.Database): The database
+
+    labels (bool): If set, the labels stored on the metadata file of each
+      session are included
+
+
+  Returns:
+
+    collections.OrderedDict: The columns, by name. Each value is a tuple with
+    the list of values (``None`` for nulls) and its type: ``int64``,
+    ``float64``, ``bool``, ``string``, or ``list<float64>`` and
+    ``list<int32>`` for per-window features.
+
+  '''
+
+  from .shared import FLAGS, membership
+
+  rows = list(db.metadata)
+  names = list(rows[0].keys()) if rows else ['basedir', 'bdf', 'video',
+      'duration']
+
+  retval = collections.OrderedDict()
+  for name in names:
+    retval[name] = _convert([k[name] for k in rows])
+
+  if db.shared is not None:
+    flags = numpy.asarray(db.shared.protocols)
+  else:
+    flags = membership([k['basedir'] for k in rows], db.protocols)
+  for name, key in PROTOCOLS:
+    retval[name] = ([bool(k) for k in (flags & FLAGS[key])], 'bool')
+
+  if not labels: return retval
+
+  from .hrv import rr_intervals, time_domain, frequency_domain
+
+  objects = [db._make_file(row, k) for k, row in enumerate(rows)]
+  stored = [_read_labels(k._annotation_path('.hdf5')) for k in objects]
+
+  for name in ('heartrate', 'heartrate_psd', 'face_x', 'face_y',
+      'face_width', 'face_height'):
+    retval[name] = ([k.get(name) for k in stored], 'float64')
+
+  for channel in ECG:
+    for k, name in enumerate(('time', 'rate')):
+      retval['heartrate_trace_%s_%s' % (channel, name)] = \
+          ([t['heartrate_trace'][channel][k].tolist() \
+          if channel in t.get('heartrate_trace', {}) else None \
+          for t in stored], 'list<float64>')
+
+  # HRV features of all sessions at once, null where peaks are missing
+  rr = [rr_intervals(*k['peaks']) if 'peaks' in k else numpy.zeros((0,)) \
+      for k in stored]
+  features = time_domain(rr)
+  features.update(frequency_domain(rr))
+  for name in HRV:
+    retval['hrv_' + name] = ([_scalar(v) if 'peaks' in k else None \
+        for k, v in zip(stored, features[name])], 'float64')
+
+  for name in PHYSIOLOGY:
+    kind = 'list<int32>' if name == 'gsr_responses' else 'list<float64>'
+    retval['physiology_' + name] = ([k['physiology'][name].tolist() \
+        if name in k.get('physiology', {}) else None for k in stored], kind)
+
+  retval['drmf_landmarks66'] = ([numpy.asarray(k['drmf_landmarks66'],
+    dtype='float64').flatten().tolist() if 'drmf_landmarks66' in k else None \
+    for k in stored], 'list<float64>')
+
+  return retval
+
+
+def to_arrow(columns):
+  '''Converts columns (see :py:func:`columns`) to a :py:class:`pyarrow.Table`'''
+
+  import pyarrow
+
+  types = {
+      'int64': pyarrow.int64(),
+      'float64': pyarrow.float64(),
+      'bool': pyarrow.bool_(),
+      'string': pyarrow.string(),
+      'list<float64>': pyarrow.list_(pyarrow.float64()),
+      'list<int32>': pyarrow.list_(pyarrow.int32()),
+      }
+
+  return pyarrow.Table.from_arrays(
+      [pyarrow.array(v, type=types[t]) for v, t in columns.values()],
+      names=list(columns.keys()))
+
+
+def write(table, path):
+  '''Writes a table to a file
+
+  The format is chosen from the extension of ``path``: ``.parquet`` for
+  Parquet, otherwise (e.g. ``.arrow``) an uncompressed Arrow IPC file, which
+  can be memory-mapped (see :py:func:`load`).
+
+
+  Parameters:
+
+    table (pyarrow.Table): The table to write, see :py:func:`to_arrow`
+
+    path (str): The path of the file to write
+
+  '''
+
+  import pyarrow
+  import pyarrow.ipc
+
+  if path.endswith('.parquet'):
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(table, path)
+    return
+
+  with pyarrow.OSFile(path, 'wb') as sink:
+    with pyarrow.ipc.new_file(sink, table.schema) as writer:
+      writer.write_table(table)
+
+
+def load(path):
+  '''Loads a table written with :py:func:`write`
+
+  Arrow IPC files are memory-mapped: the returned table references the pages
+  of the file, without copying them.
+
+
+  Returns:
+
+    pyarrow.Table: The table
+
+  '''
+
+  import pyarrow
+  import pyarrow.ipc
+
+  if path.endswith('.parquet'):
+    import pyarrow.parquet
+    return pyarrow.parquet.read_table(path, memory_map=True)
+
+  return pyarrow.ipc.open_file(pyarrow.memory_map(path, 'r')).read_all()
@@ -62,6 +62,91 @@ class HCITaggingTest(unittest.TestCase):
     self.assertEqual(len(self.db.objects('cvpr14')), 527)
 
 
+  def test01c_windows(self):
+
+    objects = self.db.objects('cvpr14')
+    windows = self.db.windows(length=5., step=2.5, protocol='cvpr14')
+    self.assertTrue(len(windows) > len(objects))
+    self.assertEqual(len(windows), len(list(windows)))
+
+    for k in (0, len(windows)//2, -1):
+      window = windows[k]
+      self.assertEqual(window.end - window.start, 5.)
+      self.assertTrue(window.start >= 0)
+      self.assertTrue(window.end <= window.file.duration + 1)
+
+
+  def test01d_shared_index(self):
+
+    import shutil
+    import pickle
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      db = Database(shared=os.path.join(tmpdir, 'index'))
+      expected = self.db.objects()
+      objects = db.objects()
+      self.assertEqual([k.stem for k in objects], [k.stem for k in expected])
+      self.assertEqual(objects[0].sync, expected[0].sync)
+      self.assertEqual(len(db.objects('cvpr14')),
+          len(self.db.objects('cvpr14')))
+
+      # workers attach to the same files
+      obj = pickle.loads(pickle.dumps(objects[-1]))
+      self.assertEqual(obj.stem, expected[-1].stem)
+      self.assertEqual(obj.shared[0].path, db.shared.path)
+
+      # the index is compiled again when the protocol lists change
+      protocols = os.path.join(tmpdir, 'protocols')
+      index = os.path.join(tmpdir, 'index2')
+      self.assertEqual(len(Database(shared=index,
+        protocols=protocols).objects('cvpr14')), 0)
+      os.makedirs(os.path.join(protocols, 'cvpr14'))
+      with open(os.path.join(protocols, 'cvpr14', 'li_samples_cvpr14.txt'),
+          'wt') as f: f.write(expected[0].basedir + '\n')
+      self.assertEqual([k.stem for k in Database(shared=index,
+        protocols=protocols).objects('cvpr14')], [expected[0].stem])
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test01e_table_columns(self):
+
+    from .table import columns
+
+    data = columns(self.db)
+    objects = self.db.objects()
+    self.assertEqual(data['bdf'][0], [k.stem for k in objects])
+    self.assertEqual(data['duration'][1], 'int64')
+    self.assertEqual(sum(data['cvpr14'][0]), len(self.db.objects('cvpr14')))
+    self.assertEqual(sum(data['all_test'][0]),
+        len(self.db.objects(subset='test')))
+
+    position = [k.stem for k in objects].index(
+        self.db.objects('cvpr14')[0].stem)
+    self.assertAlmostEqual(data['heartrate'][0][position],
+        objects[position].load_heart_rate_in_bpm())
+
+
+  def test01f_file_optional_columns(self):
+
+    from .models import File
+
+    obj = File('Sessions/1', 'bdf', 'video', '11', frames='0',
+        frame_rate='61', channels='EXG1 EXG2', sample_rates='256 256',
+        sync_start='0', sync_end='2816')
+    self.assertEqual(obj.frames, 0)
+    self.assertEqual(obj.sync, (0, 2816))
+    self.assertEqual(obj.sample_rates, {'EXG1': 256., 'EXG2': 256.})
+
+    obj = File('Sessions/1', 'bdf', 'video', '11', frames='', sync_start='0',
+        sync_end='')
+    self.assertTrue(obj.frames is None)
+    self.assertTrue(obj.sync is None)
+    self.assertTrue(obj.sample_rates is None)
+
+
   @db_available
   def test02_can_read_bdf(self):
 
@@ -95,6 +180,31 @@ class HCITaggingTest(unittest.TestCase):
       assert video.number_of_frames
 
 
+  @db_available
+  def test02b_properties_match_raw_files(self):
+
+    from .utils import bdf_probe
+
+    obj = self.db.objects()[0]
+    if obj.sync is None: return #metadata created before properties were added
+
+    channels, rates, sync_start, sync_end = bdf_probe(obj.make_path(DATABASE_LOCATION, '.bdf'))
+    self.assertEqual(obj.channels, tuple(channels))
+    self.assertEqual(obj.sync, (sync_start, sync_end))
+    video = obj.load_video(DATABASE_LOCATION)
+    self.assertAlmostEqual(obj.frame_rate, video.frame_rate, places=2)
+
+
+  @db_available
+  def test03b_can_read_video_segment(self):
+
+    obj = self.db.objects()[0]
+    video = obj.load_video(DATABASE_LOCATION)
+    segment = obj.load_video_segment(DATABASE_LOCATION, start=2, end=4)
+    self.assertEqual(segment.shape[1:], (3, video.height, video.width))
+    self.assertAlmostEqual(len(segment), 2*video.frame_rate, delta=1)
+
+
   @meta_available
   def test04_can_read_meta(self):
 
@@ -129,6 +239,619 @@ class HCITaggingTest(unittest.TestCase):
       plt.show()
 
 
+def _ring_consumer(ring, results):
+  """Reads all batches of a ring on a worker process (see test09b)"""
+
+  received = []
+  for batch in ring:
+    with batch:
+      received.append((batch.metadata['start'],
+        batch.array[:, 0, 0, 0].tolist()))
+  ring.close()
+  results.put(received)
+
+
+class UtilsTest(unittest.TestCase):
+  """Tests utilities that do not require the raw database files."""
+
+  def test01_draw_boxes(self):
+
+    import numpy
+    import bob.ip.facedetect
+    from .utils import draw_boxes
+
+    frames = numpy.zeros((3, 3, 20, 30), dtype='uint8')
+    boxes = [
+        bob.ip.facedetect.BoundingBox((2, 4), (10, 12)),
+        None,
+        bob.ip.facedetect.BoundingBox((-5, 25), (10, 12)), #partly outside
+        ]
+    draw_boxes(frames, boxes, thickness=2, color=(255, 0, 0))
+
+    expected = numpy.zeros((20, 30), dtype=bool)
+    expected[2:12, 4:16] = True
+    expected[4:10, 6:14] = False
+    self.assertTrue((frames[0, 0] == 255*expected).all())
+    self.assertFalse(frames[0, 1:].any())
+    self.assertFalse(frames[1].any())
+
+    expected = numpy.zeros((20, 30), dtype=bool)
+    expected[0:5, 25:30] = True
+    expected[0:3, 27:30] = False
+    self.assertTrue((frames[2, 0] == 255*expected).all())
+
+
+  def test02_envelope_keeps_peaks(self):
+
+    import numpy
+    from .utils import envelope
+
+    signal = numpy.random.RandomState(0).randn(256*120)
+    signal[12345] = 50.
+    signal[777] = -40.
+
+    selected = envelope(signal, 4000)
+    self.assertTrue(len(selected) <= 4000)
+    self.assertTrue((numpy.diff(selected) > 0).all())
+    self.assertEqual(signal[selected].max(), 50.)
+    self.assertEqual(signal[selected].min(), -40.)
+    self.assertEqual(len(envelope(signal[:100], 4000)), 100)
+
+
+  def test03_chooser_batch_matches_chooser(self):
+
+    import numpy
+    from .utils import chooser, chooser_batch
+
+    random = numpy.random.RandomState(0)
+
+    for agreement in (1., 3., 10.):
+      # estimates around a common rate, so all agreement cases are exercised
+      rates = 60 + numpy.round(3 * random.randn(2000, 3), 1)
+      mask = random.rand(2000, 3)
+      rates[mask < 0.2] = 0. #no estimate
+      rates[(mask >= 0.2) & (mask < 0.25)] = 0.5 #truncates to zero
+
+      expected = [chooser(list(k), agreement) for k in rates]
+      numpy.testing.assert_allclose(chooser_batch(rates, agreement), expected)
+
+    self.assertEqual(chooser_batch(numpy.zeros((0, 3))).shape, (0,))
+
+
+  def test04_hrv_time_domain(self):
+
+    import numpy
+    from .hrv import rr_intervals, time_domain
+
+    random = numpy.random.RandomState(0)
+    rr = [0.8 + 0.05*random.randn(k) for k in (300, 120)]
+    rr.append(rr_intervals([0, 256], 256.)) #single interval
+    features = time_domain(rr)
+
+    for k, expected in enumerate(rr[:2]):
+      expected = 1000. * expected
+      self.assertAlmostEqual(features['mean_rr'][k], expected.mean())
+      self.assertAlmostEqual(features['sdnn'][k], expected.std(ddof=1))
+      self.assertAlmostEqual(features['rmssd'][k],
+          numpy.sqrt((numpy.diff(expected)**2).mean()))
+      self.assertAlmostEqual(features['pnn50'][k],
+          100. * (numpy.abs(numpy.diff(expected)) > 50.).mean())
+
+    self.assertAlmostEqual(features['mean_hr'][2], 60.)
+    self.assertTrue(numpy.isnan(features['sdnn'][2]))
+
+
+  def test04b_hrv_frequency_domain(self):
+
+    import numpy
+    from .hrv import frequency_domain
+
+    def _modulated(rate, count, amplitude=0.05):
+      # RR intervals modulated at ``rate`` Hz, with variance amplitude**2/2
+      retval = []
+      time = 0.
+      for k in range(count):
+        retval.append(0.8 + amplitude * numpy.sin(2 * numpy.pi * rate * time))
+        time += retval[-1]
+      return numpy.array(retval)
+
+    rr = [_modulated(0.1, 300), _modulated(0.25, 300), _modulated(0.25, 20),
+        numpy.full(3, 0.8)]
+    features = frequency_domain(rr)
+    variance = 1e6 * 0.05**2 / 2 #in squared milliseconds
+
+    # power on the band of the modulation, almost none on the other
+    numpy.testing.assert_allclose(features['lf'][0], variance, rtol=0.3)
+    numpy.testing.assert_allclose(features['hf'][1], variance, rtol=0.3)
+    self.assertTrue(features['lf_hf'][0] > 100.)
+    self.assertTrue(features['lf_hf'][1] < 0.01)
+
+    # 16 seconds are too short for the LF band, 3 beats for any band
+    self.assertTrue(numpy.isnan(features['lf'][2]))
+    numpy.testing.assert_allclose(features['hf'][2], variance, rtol=0.3)
+    for name in ('lf', 'hf', 'lf_hf'):
+      self.assertTrue(numpy.isnan(features[name][3]))
+
+
+  def test05_psd_heartrate(self):
+
+    import numpy
+    from .utils import estimate_average_heartrate_psd
+
+    # synthetic ECG-like signals: sharp R waves followed by T waves
+    random = numpy.random.RandomState(0)
+    freq = 256.
+    time = numpy.arange(int(60*freq)) / freq
+    signals = []
+    for rate in (50., 72., 110.):
+      signal = 50. * random.randn(len(time))
+      for beat in numpy.arange(0, 60, 60./rate):
+        signal += 1000. * numpy.exp(-((time-beat)/0.01)**2)
+        signal -= 200. * numpy.exp(-((time-beat-0.25)/0.05)**2)
+      signals.append(signal)
+
+    estimates = estimate_average_heartrate_psd(numpy.array(signals), freq)
+    numpy.testing.assert_allclose(estimates, [50., 72., 110.], atol=2.)
+
+
+  def test06_shards(self):
+
+    import numpy
+    import shutil
+    import tempfile
+    from .shards import ShardWriter, ShardReader
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      with ShardWriter(tmpdir, ('frames', 'signals'), shard_size=4096) as w:
+        for k in range(10):
+          w.append({'frames': numpy.full((2, 3, 8, 8), k, dtype='uint8'),
+            'signals': numpy.arange(k+1, dtype='float32')}, session=str(k))
+
+      reader = ShardReader(tmpdir)
+      self.assertEqual(len(reader), 10)
+      self.assertTrue(len(reader.shards) > 1)
+      for k, record in enumerate(reader):
+        self.assertEqual(record['session'], str(k))
+        self.assertTrue((record['frames'] == k).all())
+        self.assertEqual(len(record['signals']), k+1)
+      self.assertEqual(reader[7]['session'], '7')
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test07_memory_cache(self):
+
+    import numpy
+    from .cache import MemoryCache
+
+    cache = MemoryCache(max_bytes=2000)
+    a = cache.get(('s1', 'load'), lambda: numpy.zeros(100))
+    self.assertFalse(a.flags.writeable)
+    self.assertTrue(cache.get(('s1', 'load'), lambda: None) is a)
+    cache.get(('s2', 'load'), lambda: numpy.zeros(100))
+    cache.get(('s3', 'load'), lambda: numpy.zeros(100)) #evicts s1
+
+    stats = cache.stats()
+    self.assertEqual(stats['hits'], 1)
+    self.assertEqual(stats['misses'], 3)
+    self.assertEqual(stats['evictions'], 1)
+    self.assertEqual(stats['entries'], 2)
+    self.assertTrue(stats['bytes'] <= 2000)
+
+
+  def test08_instrument(self):
+
+    from . import instrument
+
+    self.assertTrue(instrument.stage('read') is instrument.stage('write'))
+
+    instrument.enable()
+    try:
+      with instrument.session('s1'):
+        self.assertEqual(instrument.current_session(), 's1')
+        with instrument.stage('read'): pass
+        self.assertEqual(list(instrument.iterate('decode', 'abc')),
+            ['a', 'b', 'c'])
+      with instrument.stage('read'): pass
+    finally:
+      report = instrument.disable().report()
+
+    self.assertEqual(report['stages']['read']['calls'], 2)
+    self.assertEqual(report['stages']['decode']['calls'], 3)
+    self.assertEqual(report['sessions']['s1']['read']['calls'], 1)
+    self.assertTrue(report['peak_rss'] >= 0)
+
+
+  def test09_shared_ring(self):
+
+    import numpy
+    import queue
+    from .ring import SharedRing, feed_video
+
+    ring = SharedRing(slots=2, slot_size=4*3*8*8)
+    try:
+      frames = [numpy.full((3, 8, 8), k, dtype='uint8') for k in range(6)]
+      self.assertEqual(feed_video(ring, frames[:5], batch_size=4), 5)
+
+      # both slots are in use: the producer cannot get a third one
+      self.assertRaises(queue.Empty, ring.reserve, (4, 3, 8, 8), 'uint8',
+          0.1)
+
+      received = []
+      for batch in ring:
+        self.assertFalse(batch.array.flags.writeable)
+        received.append((batch.metadata['start'], batch.array[:, 0, 0, 0].copy()))
+      self.assertEqual([k[0] for k in received], [0, 4])
+      numpy.testing.assert_array_equal(numpy.concatenate([k[1] for k in received]),
+          numpy.arange(5))
+
+      # released slots are available again
+      ring.put(numpy.zeros((2, 3, 8, 8), dtype='uint8'), timeout=1.)
+    finally:
+      ring.unlink()
+
+
+  def test09b_shared_ring_processes(self):
+
+    import numpy
+    import multiprocessing
+    from .ring import SharedRing, feed_video
+
+    def _frames(count, error=False):
+      for k in range(count): yield numpy.full((3, 8, 8), k, dtype='uint8')
+      if error: raise IOError("truncated video")
+
+    def _consume(context, ring, results, function, *args):
+      workers = [context.Process(target=_ring_consumer,
+        args=(ring, results)) for k in range(2)]
+      for w in workers: w.start()
+      try:
+        function(*args)
+      finally: #consumers always see the end of the stream
+        received = sum([results.get(timeout=60) for w in workers], [])
+        for w in workers: w.join(60)
+      self.assertEqual([w.exitcode for w in workers], [0, 0])
+      return sorted(received)
+
+    for method in ('fork', 'spawn'):
+      if method not in multiprocessing.get_all_start_methods(): continue
+      context = multiprocessing.get_context(method)
+      ring = SharedRing(slots=2, slot_size=4*3*8*8, context=context)
+      results = context.Queue()
+      try:
+        received = _consume(context, ring, results,
+            lambda: self.assertEqual(feed_video(ring, _frames(10),
+              batch_size=4, consumers=2), 10))
+        self.assertEqual([k[0] for k in received], [0, 4, 8])
+        numpy.testing.assert_array_equal(sum([k[1] for k in received], []),
+            numpy.arange(10))
+
+        # a failing decoder ends the stream and returns its reserved slot
+        received = _consume(context, ring, results, self.assertRaises,
+            IOError, feed_video, ring, _frames(6, True), 4, 2)
+        self.assertEqual(received, [(0, [0, 1, 2, 3])])
+        for k in range(ring.slots):
+          ring.reserve((4, 3, 8, 8), 'uint8', 1.)
+      finally:
+        ring.unlink()
+
+
+  def test10_eeg_band_powers(self):
+
+    import numpy
+    from .eeg import band_powers, BANDS
+
+    random = numpy.random.RandomState(0)
+    freq = 256.
+    time = numpy.arange(int(20*freq)) / freq
+    signals = random.randn(3, len(time))
+    for k, rate in enumerate((2.5, 10., 20.)): #delta, alpha and beta
+      signals[k] += 20. * numpy.sin(2 * numpy.pi * rate * time)
+
+    powers = band_powers(signals, freq, length=2., step=1.)
+    self.assertEqual(powers.shape, (19, 3, len(BANDS)))
+    self.assertEqual(powers.dtype, numpy.float32)
+    numpy.testing.assert_array_equal(powers.argmax(axis=2),
+        numpy.tile([0, 2, 3], (19, 1)))
+
+    # signals shorter than a window yield no windows
+    self.assertEqual(band_powers(signals[:, :100], freq).shape,
+        (0, 3, len(BANDS)))
+
+
+  def test11_physiology(self):
+
+    import numpy
+    from .physio import features
+
+    random = numpy.random.RandomState(0)
+    freq = 256.
+    time = numpy.arange(int(120*freq)) / freq
+    resp = 2000. * numpy.sin(2 * numpy.pi * 0.25 * time) #15 breaths/minute
+    gsr = numpy.full(len(time), 2e5) #5 micro-Siemens
+    for onset in (10., 50., 55.): #phasic responses
+      rise = numpy.clip((time - onset) / 1., 0., 1.) * \
+          numpy.exp(-numpy.clip(time - onset - 1., 0., None) / 3.)
+      gsr = 1e6 / (1e6 / gsr + 0.5 * rise)
+    temp = 31. + (0.5 / 60.) * time + 0.001 * random.randn(len(time))
+
+    result = features(numpy.array([resp, gsr, temp]), freq, length=30.)
+    numpy.testing.assert_allclose(result['start'], [0., 30., 60., 90.])
+    numpy.testing.assert_allclose(result['breathing_rate'], 15., atol=0.2)
+    numpy.testing.assert_allclose(result['gsr_level'], 5., atol=0.2)
+    numpy.testing.assert_array_equal(result['gsr_responses'], [1, 2, 0, 0])
+    numpy.testing.assert_allclose(result['temperature_slope'], 0.5,
+        atol=0.01)
+
+
+  def test12_evaluation(self):
+
+    import numpy
+    from .evaluation import metrics, bootstrap
+
+    random = numpy.random.RandomState(0)
+    truth = random.uniform(55., 100., 200)
+    predictions = truth + 1. + 3. * random.randn(len(truth))
+
+    values = metrics(predictions, truth)
+    error = predictions - truth
+    self.assertAlmostEqual(values['mae'], numpy.abs(error).mean())
+    self.assertAlmostEqual(values['rmse'], numpy.sqrt((error**2).mean()))
+    self.assertAlmostEqual(values['pearson'],
+        numpy.corrcoef(predictions, truth)[0, 1])
+    self.assertAlmostEqual(values['loa_high'] - values['loa_low'],
+        2 * 1.96 * error.std(ddof=1))
+
+    # statistics of many resamples at once
+    stacked = metrics(numpy.vstack([predictions, truth]),
+        numpy.vstack([truth, truth]))
+    self.assertAlmostEqual(stacked['mae'][0], values['mae'])
+    self.assertEqual(stacked['mae'][1], 0.)
+
+    intervals = bootstrap(predictions, truth, rounds=500)
+    for name, value in values.items():
+      self.assertTrue(intervals[name][0] <= value <= intervals[name][1])
+
+
+  def test13_pipeline_resumes_interrupted_writes(self):
+
+    import shutil
+    import tempfile
+    from .pipeline import Stage, run
+
+    def _write(h5, value):
+      h5.set('partial', value)
+      if value == 1: raise KeyboardInterrupt #interrupted while writing
+
+    stage = Stage('partial', version=1, compute=lambda c: calls.pop(0),
+        write=_write)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      output = os.path.join(tmpdir, 'meta.hdf5')
+      calls = [1, 2]
+      self.assertRaises(KeyboardInterrupt, run, None, tmpdir, output,
+          [stage], {})
+      self.assertEqual(run(None, tmpdir, output, [stage], {}),
+          {'partial': 'computed'})
+      self.assertEqual(run(None, tmpdir, output, [stage], {}),
+          {'partial': 'fresh'})
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test14_prefetch(self):
+
+    import time
+    import threading
+    from .loader import prefetch
+
+    started = []
+    lock = threading.Lock()
+
+    def _load(k):
+      with lock: started.append(k)
+      time.sleep(0.01 * ((7 * k) % 3)) #finishes out of order
+      if k == 5: raise ValueError(k)
+      return k * k
+
+    # results in order, with at most `size` items loaded ahead
+    results = []
+    for k, value in enumerate(prefetch(_load, range(5), workers=3, size=2)):
+      with lock: self.assertTrue(len(started) <= k + 1 + 2)
+      results.append(value)
+    self.assertEqual(results, [0, 1, 4, 9, 16])
+
+    # exceptions are re-raised on the item that failed
+    results = []
+    generator = prefetch(_load, range(10), workers=3, size=3)
+    self.assertRaises(ValueError, lambda: [results.append(k) for k in \
+        generator])
+    self.assertEqual(results, [0, 1, 4, 9, 16])
+
+    # closing the generator early cancels pending work
+    del started[:]
+    generator = prefetch(_load, range(100), workers=1, size=4)
+    self.assertEqual(next(generator), 0)
+    generator.close()
+    count = len(started)
+    time.sleep(0.1)
+    self.assertEqual(len(started), count)
+    self.assertTrue(count <= 5)
+
+
+  def test15_table_round_trip(self):
+
+    from nose.plugins.skip import SkipTest
+    try:
+      import pyarrow
+    except ImportError:
+      raise SkipTest("pyarrow is required to write tables")
+
+    import shutil
+    import tempfile
+    import collections
+    from .table import to_arrow, write, load
+
+    columns = collections.OrderedDict([
+      ('basedir', (['Sessions/1', 'Sessions/2'], 'string')),
+      ('duration', ([11, None], 'int64')),
+      ('cvpr14', ([True, False], 'bool')),
+      ('heartrate', ([72.5, None], 'float64')),
+      ('physiology_gsr_responses', ([[1, 0, 2], None], 'list<int32>')),
+      ('heartrate_trace_EXG3_rate', ([[], [61., 62.5]], 'list<float64>')),
+      ])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      for name in ('table.arrow', 'table.parquet'):
+        path = os.path.join(tmpdir, name)
+        write(to_arrow(columns), path)
+        table = load(path)
+        self.assertEqual(table.column_names, list(columns.keys()))
+        for key, (values, kind) in columns.items():
+          self.assertEqual(table.column(key).to_pylist(), values)
+        del table
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test16_pipeline_reuses_stored_peaks(self):
+
+    import numpy
+    import shutil
+    import tempfile
+    import bob.io.base
+    from .pipeline import Stage, QRS_STAGES, run, _write_peaks
+
+    peaks = {'EXG3': numpy.array([0, 256, 512, 704], dtype='int32')}
+    # the QRS detector (on a missing session) cannot run
+    stages = [Stage('peaks', version=1, compute=lambda c: (peaks, 256.),
+      write=_write_peaks), QRS_STAGES[1]]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      output = os.path.join(tmpdir, 'meta.hdf5')
+      self.assertEqual(run(None, tmpdir, output, stages, {}),
+          {'peaks': 'computed', 'heartrate_trace': 'computed'})
+
+      h5 = bob.io.base.HDF5File(output, 'a')
+      h5.unlink('heartrate_trace')
+      h5.close()
+
+      # fresh stored peaks are read, instead of detected again
+      self.assertEqual(run(None, tmpdir, output, stages, {}),
+          {'peaks': 'fresh', 'heartrate_trace': 'computed'})
+      h5 = bob.io.base.HDF5File(output, 'r')
+      numpy.testing.assert_allclose(h5.get('heartrate_trace/EXG3'),
+          [[1., 2., 2.75], [60., 60., 80.]])
+      h5.close()
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test17_physiology_stage_skips_missing_channels(self):
+
+    from .models import File
+    from .pipeline import Context, _compute_physiology
+
+    obj = File('Sessions/1', 'bdf', 'video', '11',
+        channels='EXG1 EXG2 EXG3 Status', sample_rates='256 256 256 256')
+    context = Context(obj, '/does/not/exist', {'physiology_window': 30.})
+    self.assertTrue(_compute_physiology(context) is None)
+
+
+  def test18_heartrate_cache_tracks_sync(self):
+
+    import shutil
+    import tempfile
+    from .cache import ResultCache
+    from .models import File
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      os.makedirs(os.path.join(tmpdir, 'Sessions', '1'))
+      with open(os.path.join(tmpdir, 'Sessions', '1', 'bdf.bdf'), 'wb') as f:
+        f.write(b'raw')
+      cache = ResultCache(os.path.join(tmpdir, 'cache'))
+
+      calls = []
+      def _estimate(directory, channels, method):
+        calls.append(method)
+        return [60., 60., 60.], {}, 256.
+
+      for sync in (('0', '2816'), ('0', '2816'), ('256', '3072')):
+        obj = File('Sessions/1', 'bdf', 'video', '11', sync_start=sync[0],
+            sync_end=sync[1])
+        obj._estimate_channel_heartrates = _estimate
+        self.assertEqual(obj.estimate_heartrate_in_bpm(tmpdir, cache=cache),
+            60.)
+      # new synchronization markers on the same BDF file are a new result
+      self.assertEqual(len(calls), 2)
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+def synthetic_available(test):
+  """Decorator for detecting if synthetic raw files can be written"""
+  from nose.plugins.skip import SkipTest
+  import functools
+
+  @functools.wraps(test)
+  def wrapper(*args, **kwargs):
+
+    try:
+      import av
+      import pyedflib
+    except ImportError:
+      raise SkipTest("PyAV and pyedflib are required to write raw files")
+    return test(*args, **kwargs)
+
+  return wrapper
+
+
+class SyntheticTest(unittest.TestCase):
+  """Tests the database access API on a synthetic database."""
+
+  @classmethod
+  def setUpClass(cls):
+    import tempfile
+    cls.tmpdir = tempfile.mkdtemp()
+
+
+  @classmethod
+  def tearDownClass(cls):
+    import shutil
+    shutil.rmtree(cls.tmpdir)
+
+
+  @synthetic_available
+  def test01_generate(self):
+
+    from . import synthetic
+
+    paths = synthetic.generate(self.tmpdir, sessions=5, duration=6.)
+    db = synthetic.database(paths)
+
+    objects = db.objects()
+    self.assertEqual(len(objects), 5)
+    self.assertEqual(len(db.objects(subset=('train',))), 3)
+    self.assertEqual(len(db.objects(subset=('dev', 'test'))), 2)
+
+    for obj in objects:
+      self.assertEqual(obj.frames, 366)
+      self.assertEqual(obj.sample_rates['EXG3'], 256.)
+      signals, freq = obj.load_signals(self.tmpdir)
+      self.assertEqual(len(signals), 3)
+      self.assertAlmostEqual(signals.shape[1], 6*freq, delta=1)
+      self.assertEqual(len(obj.load_face_detection()), obj.frames)
+      self.assertAlmostEqual(obj.load_heart_rate_in_bpm(),
+          paths['heart_rates'][obj.basedir])
+      self.assertTrue(abs(obj.estimate_heartrate_in_bpm(self.tmpdir) - \
+          paths['heart_rates'][obj.basedir]) < 5.)
+
+
 class CmdLineTest(unittest.TestCase):
   """Makes sure our command-line is working properly."""
 
@@ -173,3 +896,68 @@ class CmdLineTest(unittest.TestCase):
             ]
 
     self.assertEqual(main(args), 0)
+
+
+  @db_available
+  def test04_manage_debug(self):
+
+    import shutil
+    import tempfile
+    from bob.db.base.script.dbmanage import main
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      args = [
+              'hci_tagging',
+              'debug',
+              '--self-test',
+              '--limit=1',
+              '--directory=%s' % DATABASE_LOCATION,
+              '--output-directory=%s' % os.path.join(tmpdir, 'debug'),
+              '--profile=%s' % os.path.join(tmpdir, 'profile.json'),
+              ]
+
+      self.assertEqual(main(args), 0)
+      self.assertTrue(os.path.exists(os.path.join(tmpdir, 'profile.json')))
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+  def test05_manage_evaluate(self):
+
+    import json
+    import shutil
+    import tempfile
+    from bob.db.base.script.dbmanage import main
+
+    objects = Database().objects()[:3]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+      predictions = os.path.join(tmpdir, 'predictions.csv')
+      with open(predictions, 'wt') as f:
+        f.write('session,bpm\n')
+        f.write('# a comment\n')
+        f.write('%s,70.5\n' % objects[0].stem)
+        f.write('%s,82\n' % objects[1].basedir)
+        f.write('%s,64.25\n' % objects[2].stem)
+
+      output = os.path.join(tmpdir, 'results.json')
+      args = [
+              'hci_tagging',
+              'evaluate',
+              predictions,
+              '--self-test',
+              '--protocol=all',
+              '--output=%s' % output,
+              ]
+
+      self.assertEqual(main(args), 0)
+      with open(output, 'rt') as f: report = json.load(f)
+      self.assertEqual(sorted(report), ['all/dev', 'all/test', 'all/train'])
+      for value in report.values():
+        self.assertEqual(sorted(value['metrics']), sorted(value['intervals']))
+        if value['count'] == 0: #without ground truth, NaN is saved as null
+          self.assertTrue(value['metrics']['mae'] is None)
+    finally:
+      shutil.rmtree(tmpdir)
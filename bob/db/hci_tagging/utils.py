@@ -6,13 +6,195 @@
 import os
 import numpy
 import bob.io.video
-import bob.ip.draw
 import bob.ip.facedetect
 
 from mne.preprocessing.ecg import qrs_detector
 
+from . import instrument
 
-def bdf_load_signal(fn, name='EXG3', start=None, end=None):
+
+def _bdf_sync(e):
+  """Returns the first and last samples of the video period of a BDF file
+
+  The period is defined by the non-zero markers on the ``Status`` channel of
+  the opened :py:class:`pyedflib.EdfReader` ``e``.
+  """
+
+  status_index = e.getSignalLabels().index('Status')
+  status_size = e.samples_in_file(status_index)
+  status = numpy.zeros((status_size,), dtype='float64')
+  e.readsignal(status_index, 0, status_size, status)
+  status = status.round().astype('int')
+  nz_status = status.nonzero()[0]
+  return int(nz_status[0]), int(nz_status[-1])
+
+
+def bdf_probe(fn):
+  """Reads the header and video synchronization markers of a BDF file
+
+
+  Parameters:
+
+    fn (path): The full path to the file to read
+
+
+  Returns:
+
+    list: The names of all channels in the file
+
+    list: The sampling frequency of each channel, in Hz
+
+    int: The first sample of the video period, as marked on the ``Status``
+    channel
+
+    int: The last sample of the video period, as marked on the ``Status``
+    channel
+
+  """
+
+  import pyedflib
+
+  if not os.path.exists(fn): #or the EdfReader will crash the interpreter
+    raise IOError("file `%s' does not exist" % fn)
+
+  with pyedflib.EdfReader(fn) as e:
+    channels = e.getSignalLabels()
+    rates = [float(k) for k in e.getSampleFrequencies()]
+    sync_start, sync_end = _bdf_sync(e)
+
+  return channels, rates, sync_start, sync_end
+
+
+class _Reader(object):
+  """An opened BDF file, with its parsed header and synchronization markers"""
+
+  def __init__(self, fn):
+    import pyedflib
+    self.edf = pyedflib.EdfReader(fn)
+    self.labels = self.edf.getSignalLabels()
+    self.frequencies = [self.edf.samplefrequency(k) \
+        for k in range(len(self.labels))]
+    self._sync = None
+
+  def sync(self):
+    """Returns the synchronization markers, read once from ``Status``"""
+
+    if self._sync is None: self._sync = _bdf_sync(self.edf)
+    return self._sync
+
+  def close(self):
+    self.edf.close()
+
+
+class ReaderPool(object):
+  """A bounded pool of opened BDF files, shared by all loaders of a process
+
+  Opening a BDF file parses its header, and its synchronization markers are
+  read from the (long) ``Status`` channel. Readers returned to the pool keep
+  both, so subsequent (windowed) reads of the same file only cost the
+  sample read. Each reader is used by a single thread at a time: concurrent
+  loaders of the same file get distinct readers. When more than
+  ``max_open`` readers are open, idle ones are closed, least recently used
+  first. Readers of files modified since they were opened are not reused.
+
+
+  Parameters:
+
+    max_open (int): The maximum number of open readers kept by the pool
+
+  """
+
+  def __init__(self, max_open=16):
+    import threading
+    import collections
+    self.max_open = max_open
+    self._lock = threading.Lock()
+    self._idle = collections.OrderedDict() #(identity, serial) -> reader
+    self._busy = 0
+    self._serial = 0
+
+
+  @staticmethod
+  def _identify(fn):
+    if not os.path.exists(fn): #or the EdfReader will crash the interpreter
+      raise IOError("file `%s' does not exist" % fn)
+    st = os.stat(fn)
+    return (os.path.abspath(fn), st.st_size, st.st_mtime)
+
+
+  def _checkout(self, fn):
+    identity = self._identify(fn)
+    with self._lock:
+      for key in self._idle:
+        if key[0] == identity:
+          self._busy += 1
+          return key[0], self._idle.pop(key)
+      self._busy += 1
+    try:
+      return identity, _Reader(fn)
+    except:
+      with self._lock: self._busy -= 1
+      raise
+
+
+  def _checkin(self, identity, reader):
+    to_close = []
+    with self._lock:
+      self._busy -= 1
+      self._serial += 1
+      self._idle[(identity, self._serial)] = reader
+      # closes the least recently used readers, if there are too many
+      for key in list(self._idle):
+        if len(self._idle) + self._busy <= self.max_open: break
+        to_close.append(self._idle.pop(key))
+    for k in to_close: k.close()
+
+
+  def reader(self, fn):
+    """Checks out a reader for ``fn``, to use on a ``with`` statement
+
+    Raises :py:class:`IOError` if the file does not exist.
+    """
+
+    import contextlib
+
+    @contextlib.contextmanager
+    def _checkout():
+      identity, reader = self._checkout(fn)
+      try:
+        yield reader
+      finally:
+        self._checkin(identity, reader)
+
+    return _checkout()
+
+
+  def close(self):
+    """Closes all idle readers"""
+
+    with self._lock:
+      readers = list(self._idle.values())
+      self._idle.clear()
+    for k in readers: k.close()
+
+
+  def _after_fork(self):
+    # readers opened by the parent share file descriptors with it: a child
+    # process closes its copies and starts with an empty pool
+    import threading
+    self._lock = threading.Lock()
+    self._busy = 0
+    self.close()
+
+
+READERS = ReaderPool()
+"""The pool of BDF readers used by :py:func:`bdf_load_signals`"""
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=READERS._after_fork)
+
+
+def bdf_load_signal(fn, name='EXG3', start=None, end=None, sync=None):
   """Loads a signal named ``name`` from the BDF filenamed ``fn``
 
 
@@ -22,6 +204,9 @@ def bdf_load_signal(fn, name='EXG3', start=None, end=None):
     name (str): The name of the channel to read.
     start (int, option): Start time in seconds
     end (int, optional): End time in seconds
+    sync (tuple, optional): The first and last samples of the video period,
+      as returned by :py:func:`bdf_probe`. If not set, they are read from the
+      ``Status`` channel of the file.
 
 
   List of physiological channels used (there are more available, but contain no
@@ -79,30 +264,54 @@ def bdf_load_signal(fn, name='EXG3', start=None, end=None):
 
   """
 
-  import pyedflib
+  signals, sample_frequency = bdf_load_signals(fn, (name,), start, end, sync)
+  return signals[0], sample_frequency
 
-  if not os.path.exists(fn): #or the EdfReader will crash the interpreter
-    raise IOError("file `%s' does not exist" % fn)
 
-  with pyedflib.EdfReader(fn) as e:
+def bdf_load_signals(fn, names=('EXG1', 'EXG2', 'EXG3'), start=None, end=None,
+    sync=None):
+  """Loads signals named ``names`` from the BDF filenamed ``fn`` in one pass
 
-    # get the status information, so we how the video is synchronized
-    status_index = e.getSignalLabels().index('Status')
-    sample_frequency = e.samplefrequency(status_index)
-    status_size = e.samples_in_file(status_index)
-    status = numpy.zeros((status_size,), dtype='float64')
-    e.readsignal(status_index, 0, status_size, status)
-    status = status.round().astype('int')
-    nz_status = status.nonzero()[0]
+  The synchronization markers are read only once for all channels. The file
+  is opened through the reader pool :py:data:`READERS`, so its header and
+  synchronization markers are only parsed on the first read: windowed reads
+  of the same file only cost the sample read. See :py:func:`bdf_load_signal`
+  for a description of available channels.
+
+
+  Parameters:
+
+    fn (path): The full path to the file to read
+    names (list): The names of the channels to read. All channels must have
+      the same sampling frequency.
+    start (int, option): Start time in seconds
+    end (int, optional): End time in seconds
+    sync (tuple, optional): The first and last samples of the video period,
+      as returned by :py:func:`bdf_probe`. If not set, they are read from the
+      ``Status`` channel of the file.
+
+
+  Returns:
 
+    numpy.ndarray: A 2D array of 64-bit floats in (channel,sample) notation
+
+    float: The sampling frequency of the signals, in Hz
+
+  """
+
+  with instrument.stage('bdf_read'), READERS.reader(fn) as r:
+
+    # get the status information, so we how the video is synchronized
     # because we're interested in the video bits, make sure to get data
     # from that period only
-    video_start = nz_status[0]
-    video_end = nz_status[-1]
+    video_start, video_end = sync if sync is not None else r.sync()
 
     # retrieve information from this rather chaotic API
-    index = e.getSignalLabels().index(name)
-    sample_frequency = e.samplefrequency(index)
+    indexes = [r.labels.index(k) for k in names]
+    frequencies = set(r.frequencies[k] for k in indexes)
+    if len(frequencies) != 1:
+      raise ValueError("channels %s of file `%s' have different sampling frequencies (%s)" % (', '.join(names), fn, ', '.join('%g' % k for k in sorted(frequencies))))
+    sample_frequency = frequencies.pop()
 
     video_start_seconds = video_start/sample_frequency
 
@@ -123,8 +332,9 @@ def bdf_load_signal(fn, name='EXG3', start=None, end=None):
       end = video_end
 
     # now read the data into a numpy array (read everything)
-    container = numpy.zeros((end-start,), dtype='float64')
-    e.readsignal(index, start, end-start, container)
+    container = numpy.zeros((len(indexes), end-start), dtype='float64')
+    for k, index in enumerate(indexes):
+      r.edf.readsignal(index, start, end-start, container[k])
 
     return container, sample_frequency
 
@@ -151,13 +361,156 @@ def estimate_average_heartrate(s, sampling_frequency):
   return float(numpy.nan_to_num(instantaneous_rates[selector].mean())), peaks
 
 
-def plot_signal(s, sampling_frequency, channel_name):
+def estimate_average_heartrate_psd(signals, sampling_frequency, low=30.,
+    high=240., segment=16., harmonics=3):
+  '''Estimates the average heart rate of many ECG channels at once, from
+  their power spectra
+
+  This is a faster, less precise alternative to
+  :py:func:`estimate_average_heartrate`, suitable for screening. No QRS
+  complex is detected: the energy of each signal derivative is smoothed over
+  150 milliseconds (which emphasizes QRS complexes) and its power spectral
+  density is estimated with Welch's method, vectorized over all channels. The
+  chosen rate is the one, between ``low`` and ``high`` beats-per-minute, that
+  maximizes the summed power of its first ``harmonics`` harmonics, which
+  avoids picking a harmonic of the cardiac frequency.
+
+
+  Parameters:
+
+    signals (numpy.ndarray): A 2D array in (channel,sample) notation, as
+      returned by :py:func:`bdf_load_signals`
+
+    sampling_frequency (float): The sampling frequency of the signals, in Hz
+
+    low (float): The lowest acceptable heart-rate, in beats-per-minute
+
+    high (float): The highest acceptable heart-rate, in beats-per-minute
+
+    segment (float): The length of segments for Welch's method, in seconds
+
+    harmonics (int): The number of harmonics to consider for each candidate
+      rate
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array of 64-bit floats with the estimated average
+    heart-rate of each channel, in beats-per-minute
+
+  '''
+
+  import scipy.signal
+
+  signals = numpy.atleast_2d(numpy.asarray(signals, dtype='float64'))
+  fs = float(sampling_frequency)
+
+  energy = numpy.diff(signals, axis=1)**2
+  width = max(int(round(0.15*fs)), 1)
+  kernel = numpy.ones((1, width)) / width
+  energy = scipy.signal.fftconvolve(energy, kernel, mode='same', axes=1)
+
+  # zero-pads each segment, so the frequency grid has (at least) a 1/60 Hz
+  # (one beat per minute) resolution
+  nperseg = min(energy.shape[1], int(segment*fs))
+  nfft = max(2**int(numpy.ceil(numpy.log2(60.*fs))), nperseg)
+  frequencies, power = scipy.signal.welch(energy, fs, nperseg=nperseg,
+      nfft=nfft, detrend='constant', axis=1)
+
+  candidates = numpy.arange(numpy.searchsorted(frequencies, low/60.),
+      numpy.searchsorted(frequencies, high/60., side='right'))
+  score = numpy.zeros((len(signals), len(candidates)))
+  for h in range(1, harmonics+1):
+    selector = h*candidates < len(frequencies)
+    score[:, selector] += power[:, h*candidates[selector]]
+
+  return 60. * frequencies[candidates[score.argmax(axis=1)]]
+
+
+def estimator_agreement(reference, estimates, agreement=3.):
+  '''Summarizes the agreement between two heart-rate estimators
+
+  Parameters:
+
+    reference (numpy.ndarray): A 1D array with the heart-rates estimated with
+      the reference method (e.g. :py:func:`estimate_average_heartrate`), one
+      per session
+
+    estimates (numpy.ndarray): A 1D array with the heart-rates estimated with
+      the alternative method (e.g. :py:func:`estimate_average_heartrate_psd`),
+      for the same sessions
+
+    agreement (float): Two estimates agree if they differ by less than this
+      value, in bpm
+
+
+  Returns:
+
+    dict: A dictionary with the keys ``mean_absolute_difference`` (in bpm),
+    ``agreement_rate`` (the fraction of sessions on which both estimators
+    agree) and ``count`` (the number of compared sessions)
+
+  '''
+
+  difference = numpy.abs(numpy.asarray(reference, dtype='float64') - \
+      numpy.asarray(estimates, dtype='float64'))
+  if not difference.size:
+    return {'mean_absolute_difference': 0., 'agreement_rate': 0., 'count': 0}
+  return {
+      'mean_absolute_difference': float(difference.mean()),
+      'agreement_rate': float((difference < agreement).mean()),
+      'count': int(difference.size),
+      }
+
+
+def envelope(s, max_points=4000):
+  '''Selects samples of a signal for display, preserving its peaks
+
+  The signal is split into ``max_points/2`` buckets of consecutive samples and,
+  for each bucket, only the minimum and the maximum are kept (in their
+  original order). Plotting the selected samples produces the same envelope
+  as plotting the full signal at display resolution, so QRS peaks remain
+  visible, at a fraction of the rendering cost and output size.
+
+
+  Parameters:
+
+    s (numpy.ndarray): The 1D signal to downsample
+
+    max_points (int): The maximum number of samples to return
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array with the (sorted) indexes of the selected
+    samples. If the signal has no more than ``max_points`` samples, all
+    indexes are returned.
+
+  '''
+
+  if len(s) <= max_points: return numpy.arange(len(s))
+
+  buckets = max(max_points // 2, 1)
+  size = -(-len(s) // buckets) #ceiling
+  padded = numpy.pad(s, (0, buckets*size - len(s)), mode='edge')
+  padded = padded.reshape(buckets, size)
+
+  offsets = numpy.arange(buckets) * size
+  lows = numpy.minimum(padded.argmin(axis=1) + offsets, len(s)-1)
+  highs = numpy.minimum(padded.argmax(axis=1) + offsets, len(s)-1)
+  retval = numpy.column_stack((numpy.minimum(lows, highs),
+    numpy.maximum(lows, highs))).ravel()
+  return numpy.unique(retval)
+
+
+def plot_signal(s, sampling_frequency, channel_name, max_points=4000):
   '''Estimates the heart rate taking as base the input signal and its sampling
   frequency, plots QRS peaks discovered on the base signal.
 
   This method will use the Pam-Tompkins detector available the MNE package to
   clean-up and estimate the heart-beat frequency based on the ECG sensor
-  information provided.
+  information provided. The signal is downsampled for display using
+  :py:func:`envelope`, so at most ``max_points`` samples are plotted.
 
   Returns:
 
@@ -168,9 +521,9 @@ def plot_signal(s, sampling_frequency, channel_name):
 
   avg, peaks = estimate_average_heartrate(s, sampling_frequency)
 
+  selected = envelope(s, max_points)
   ax = plt.gca()
-  ax.plot(numpy.arange(0, len(s)/sampling_frequency, 1/sampling_frequency),
-          s, label='Raw signal');
+  ax.plot(selected / sampling_frequency, s[selected], label='Raw signal');
   xmin, xmax, ymin, ymax = plt.axis()
   ax.vlines(peaks / sampling_frequency, ymin, ymax, colors='r', label='P-T QRS detector')
   plt.xlim(0, len(s)/sampling_frequency)
@@ -183,11 +536,13 @@ def plot_signal(s, sampling_frequency, channel_name):
   return avg, peaks
 
 
-def chooser(average_rates):
+def chooser(average_rates, agreement=3.):
   '''Chooses the averate heart-rate from the estimates of 3 sensors. Avoid
-  rates from sensors which are far way from the other ones.'''
+  rates from sensors which are far way from the other ones.
 
-  agreement = 3. #bpm
+  Two estimates agree if they differ by less than ``agreement`` bpm. See
+  :py:func:`chooser_batch` for a version operating on many sessions at once.
+  '''
 
   non_zero = [k for k in average_rates if int(k)]
 
@@ -228,26 +583,269 @@ def chooser(average_rates):
       return sorted(average_rates)[1]
 
 
+def chooser_batch(average_rates, agreement=3.):
+  '''Chooses the average heart-rate of many sessions at once
+
+  This is the vectorized version of :py:func:`chooser`, with the same
+  semantics: estimates that truncate to zero are ignored, two remaining
+  estimates are averaged if they agree or the lowest is chosen otherwise,
+  three estimates are averaged over the largest agreeing subset, or the
+  median is chosen if none agree.
+
+
+  Parameters:
+
+    average_rates (numpy.ndarray): A 2D array with shape ``(N, 3)``, with the
+      estimates of the 3 sensors for each of ``N`` sessions
+
+    agreement (float): Two estimates agree if they differ by less than this
+      value, in bpm
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array of 64-bit floats with shape ``(N,)``, with the
+    chosen heart-rate for each session (zero if unknown)
+
+  '''
+
+  rates = numpy.asarray(average_rates, dtype='float64')
+  non_zero = numpy.trunc(rates) != 0
+  count = non_zero.sum(axis=1)
+  retval = numpy.zeros((len(rates),), dtype='float64')
+
+  # a single non-zero estimate is chosen as is
+  one = count == 1
+  retval[one] = numpy.where(non_zero[one], rates[one], 0.).sum(axis=1)
+
+  # two non-zero estimates are averaged if they agree, else the lowest is used
+  two = count == 2
+  masked = numpy.where(non_zero[two], rates[two], numpy.nan)
+  low = numpy.nanmin(masked, axis=1)
+  high = numpy.nanmax(masked, axis=1)
+  retval[two] = numpy.where(high - low < agreement, (low + high) / 2., low)
+
+  # three non-zero estimates are averaged over the agreeing ones
+  three = count == 3
+  r = rates[three]
+  r0_agrees_with_r1 = numpy.abs(r[:,0] - r[:,1]) < agreement
+  r1_agrees_with_r2 = numpy.abs(r[:,1] - r[:,2]) < agreement
+  retval[three] = numpy.select(
+      [
+        r0_agrees_with_r1 & r1_agrees_with_r2, #all 3 agree
+        r0_agrees_with_r1, #exclude r2
+        r1_agrees_with_r2, #exclude r0
+      ],
+      [
+        r.mean(axis=1),
+        r[:,:2].mean(axis=1),
+        r[:,1:].mean(axis=1),
+      ],
+      numpy.median(r, axis=1), #no agreement at all pick mid-way
+      )
+
+  return retval
+
+
+def detect_face(frame):
+  """Runs bob.ip.facedetect stock detector on a single frame
+
+  Returns:
+
+    bob.ip.facedetect.BoundingBox: The detected face bounding box or ``None``,
+    if no face was detected on the frame
+
+  """
+
+  detection = bob.ip.facedetect.detect_single_face(frame)
+  if detection is None: return None
+  return detection[0]
+
+
+def _span(start, stop, size):
+  """Clips the interval ``[start, stop)`` to ``[0, size)``, as a slice"""
+
+  return slice(min(max(start, 0), size), min(max(stop, 0), size))
+
+
+def draw_boxes(frames, boxes, thickness=3, color=(255, 0, 0)):
+  '''Draws bounding box outlines on a batch of frames, in place
+
+  Each of the four borders of a box is drawn with a single slice assignment
+  over all color planes. Borders grow towards the inside of the box, so the
+  outer size of the drawn box matches the bounding box size.
+
+
+  Parameters:
+
+    frames (numpy.ndarray): A 4D array of 8-bit unsigned integers, with a
+      batch of frames in (frame,channel,y,x) notation (Bob-style)
+
+    boxes (list): A list with one instance of
+      :py:class:`bob.ip.facedetect.BoundingBox` (or ``None``, if nothing is to
+      be drawn) per frame in ``frames``
+
+    thickness (int): The thickness of the drawn borders, in pixels
+
+    color (tuple): The color of the drawn boxes, in RGB
+
+  '''
+
+  color = numpy.asarray(color, dtype=frames.dtype).reshape(3, 1, 1)
+  height, width = frames.shape[2:]
+
+  for frame, bb in zip(frames, boxes):
+    if bb is None: continue
+    top, left = int(bb.topleft[0]), int(bb.topleft[1])
+    bottom, right = top + int(bb.size[0]), left + int(bb.size[1])
+    rows = _span(top, bottom, height)
+    cols = _span(left, right, width)
+    frame[:, _span(top, min(top+thickness, bottom), height), cols] = color
+    frame[:, _span(max(bottom-thickness, top), bottom, height), cols] = color
+    frame[:, rows, _span(left, min(left+thickness, right), width)] = color
+    frame[:, rows, _span(max(right-thickness, left), right, width)] = color
+
+
+def _put(q, item, stop):
+  """Puts an item on a bounded queue, unless the pipeline was stopped"""
+
+  import queue
+  while not stop.is_set():
+    try:
+      q.put(item, timeout=0.1)
+      return
+    except queue.Full:
+      pass
+
+
+def _get(q, stop):
+  """Gets an item from a queue, or ``None`` if the pipeline was stopped"""
+
+  import queue
+  while not stop.is_set():
+    try:
+      return q.get(timeout=0.1)
+    except queue.Empty:
+      pass
+  return None
+
+
 def annotate_video(video, annotations, output, thickness=3,
-        color=(255, 0, 0)):
-  '''Annotates the input video with the detected bounding boxes'''
+        color=(255, 0, 0), batch_size=16, queue_size=4):
+  '''Annotates the input video with the detected bounding boxes
+
+  Decoding, drawing (and detection, if required) and encoding run on three
+  different threads, connected by bounded queues of frame batches, so that
+  all stages progress concurrently.
+
+
+  Parameters:
+
+    video (bob.io.video.reader): The video to annotate
+
+    annotations (dict, callable): Either a dictionary where keys are frame
+      numbers and values instances of
+      :py:class:`bob.ip.facedetect.BoundingBox`, or a callable (such as
+      :py:func:`detect_face`) that takes a frame and returns the bounding box
+      to draw on it (or ``None``). In the latter case, each frame is decoded
+      only once for both detection and annotation.
+
+    output (str): The path of the annotated video file to create
+
+    thickness (int): The thickness of the drawn boxes, in pixels
+
+    color (tuple): The color of the drawn boxes, in RGB
+
+    batch_size (int): The number of frames passed at once between stages
+
+    queue_size (int): The maximum number of batches waiting between two
+      stages
+
+
+  Returns:
+
+    dict: A dictionary where the key is the frame number and the values are
+    the bounding boxes drawn on each frame
+
+  '''
+
+  import threading
+  import queue
 
   directory = os.path.dirname(output)
   if not os.path.exists(directory): os.makedirs(directory)
 
+  decoded = queue.Queue(queue_size)
+  drawn = queue.Queue(queue_size)
+  stop = threading.Event()
+  retval = {}
+
+  # decoding runs on its own thread: keeps attributing it to the session
+  session = instrument.current_session()
+
+  def decode():
+    try:
+      with instrument.session(session):
+        batch = []
+        for frame in instrument.iterate('video_decode', video):
+          if stop.is_set(): return
+          batch.append(frame)
+          if len(batch) == batch_size:
+            _put(decoded, numpy.array(batch), stop)
+            batch = []
+        if batch: _put(decoded, numpy.array(batch), stop)
+        _put(decoded, None, stop)
+    except Exception as e:
+      _put(decoded, e, stop)
+
+  def draw():
+    try:
+      position = 0
+      while True:
+        batch = _get(decoded, stop)
+        if batch is None or isinstance(batch, Exception):
+          _put(drawn, batch, stop)
+          return
+        if callable(annotations):
+          boxes = [annotations(frame) for frame in batch]
+        else:
+          boxes = [annotations.get(k) for k in \
+              range(position, position+len(batch))]
+        draw_boxes(batch, boxes, thickness, color)
+        retval.update((position+k, bb) for k, bb in enumerate(boxes) \
+            if bb is not None)
+        position += len(batch)
+        _put(drawn, batch, stop)
+    except Exception as e:
+      _put(drawn, e, stop)
+
   writer = bob.io.video.writer(output, height=video.height, width=video.width,
           framerate=video.frame_rate, codec=video.codec_name)
-  for k, frame in enumerate(video):
-    bb = annotations.get(k)
-    if bb is not None:
-      for t in range(thickness):
-        bob.ip.draw.box(frame, bb.topleft, bb.size, color)
-    writer.append(frame)
-  del writer
+
+  threads = [threading.Thread(target=decode), threading.Thread(target=draw)]
+  for t in threads:
+    t.daemon = True
+    t.start()
+
+  try:
+    while True:
+      batch = drawn.get()
+      if batch is None: break
+      if isinstance(batch, Exception): raise batch
+      for frame in batch: writer.append(frame)
+  finally:
+    stop.set()
+    for t in threads: t.join()
+    del writer
+
+  return retval
 
 
 def explain_heartrate(obj, dbdir, output):
-  '''Explains why the currently chosen heart-rate is what it is'''
+  '''Explains why the currently chosen heart-rate is what it is
+
+  All ECG channels are read from the BDF file in a single pass.
+  '''
 
   import matplotlib
   matplotlib.use('agg')
@@ -257,14 +855,20 @@ def explain_heartrate(obj, dbdir, output):
   directory = os.path.dirname(output)
   if not os.path.exists(directory): os.makedirs(directory)
 
+  channels = ('EXG1', 'EXG2', 'EXG3')
+  signals, freq = bdf_load_signals(obj.make_path(dbdir), channels,
+      sync=obj.sync)
+
   # plots
   estimates = []
   pp = PdfPages(output)
-  for k, channel in enumerate(('EXG1', 'EXG2', 'EXG3')):
-    plt.figure(figsize=(12,4))
-    signal, freq = bdf_load_signal(obj.make_path(dbdir), channel)
+  for channel, signal in zip(channels, signals):
+    fig = plt.figure(figsize=(12,4))
     avg_hr, peaks = plot_signal(signal, freq, channel)
     estimates.append(avg_hr)
-    pp.savefig()
+    pp.savefig(fig)
+    plt.close(fig)
   estimated = chooser(estimates)
   pp.close()
+
+  return estimated
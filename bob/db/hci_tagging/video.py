@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Random access into session videos through a keyframe index
+
+Decoding frame ``k`` of a session video through :py:class:`bob.io.video.reader`
+requires decoding all frames before it. The functions in this module build,
+once, a list of keyframe positions for each session video and use it to seek
+straight to the keyframe preceding the requested segment, so only the frames
+between that keyframe and the end of the segment are decoded.
+'''
+
+import os
+import bisect
+import numpy
+
+
+def _frame_number(timestamp, time_base, rate):
+  """Converts a stream timestamp into a (zero-based) frame number"""
+
+  return int(round(float(timestamp * time_base) * rate))
+
+
+def probe(path):
+  """Reads the properties and keyframes of the video file at ``path``
+
+  Only the container packets are read (demuxed), no frame is decoded, so this
+  operation is cheap even for long videos.
+
+
+  Parameters:
+
+    path (str): The full path to the video file to probe
+
+
+  Returns:
+
+    dict: A dictionary with the following keys:
+
+      * ``frames`` (int): The number of frames in the first video stream
+      * ``frame_rate`` (float): The average frame rate of the stream, in Hz
+      * ``keyframes`` (numpy.ndarray): A 1D array of 32-bit integers with the
+        (sorted, zero-based) frame numbers of every keyframe in the stream
+
+  """
+
+  import av
+
+  if not os.path.exists(path):
+    raise IOError("Video file `%s' is not available - have you downloaded the database raw files from the original site?" % (path,))
+
+  frames = 0
+  keyframes = []
+  with av.open(path) as container:
+    stream = container.streams.video[0]
+    rate = float(stream.average_rate)
+    for p in container.demux(stream):
+      if p.pts is None: continue #flushing packet
+      frames += 1
+      if p.is_keyframe:
+        keyframes.append(_frame_number(p.pts, p.time_base, rate))
+
+  return {
+      'frames': frames,
+      'frame_rate': rate,
+      'keyframes': numpy.unique(numpy.array(keyframes, dtype='int32')),
+      }
+
+
+def probe_keyframes(path):
+  """Lists the keyframes of the video file at ``path``
+
+  See :py:func:`probe` for details.
+
+
+  Returns:
+
+    numpy.ndarray: A 1D array of 32-bit integers with the (sorted, zero-based)
+    frame numbers of every keyframe in the first video stream of the file.
+
+  """
+
+  return probe(path)['keyframes']
+
+
+def load_segment(path, keyframes=None, start=None, end=None):
+  """Loads the frames of a video file between two instants in time
+
+  If ``keyframes`` is given, the video is first positioned at the last
+  keyframe preceding ``start`` and decoded from there on. Otherwise, decoding
+  starts at the beginning of the file and frames before ``start`` are
+  discarded.
+
+
+  Parameters:
+
+    path (str): The full path to the video file to read
+
+    keyframes (numpy.ndarray, optional): The frame numbers of all keyframes in
+      the video, as returned by :py:func:`probe_keyframes`
+
+    start (float, optional): Start time in seconds. If not set, read from the
+      start of the video.
+
+    end (float, optional): End time in seconds. If not set, read until the end
+      of the video.
+
+
+  Returns:
+
+    numpy.ndarray: A 4D array of 8-bit unsigned integers corresponding to the
+    selected frames in (frame,channel,y,x) notation (Bob-style).
+
+  """
+
+  import av
+
+  if not os.path.exists(path):
+    raise IOError("Video file `%s' is not available - have you downloaded the database raw files from the original site?" % (path,))
+
+  with av.open(path) as container:
+
+    stream = container.streams.video[0]
+    stream.thread_type = 'AUTO'
+    rate = float(stream.average_rate)
+    shape = (0, 3, stream.height, stream.width)
+
+    first = int(round(start * rate)) if start is not None else 0
+    last = int(round(end * rate)) if end is not None else None
+
+    position = 0
+    if keyframes is not None and len(keyframes) and first > 0:
+      position = int(keyframes[max(bisect.bisect_right(keyframes, first)-1, 0)])
+      if position > 0:
+        offset = int(round((position / rate) / stream.time_base))
+        container.seek(offset, stream=stream, backward=True, any_frame=False)
+
+    frames = []
+    for frame in container.decode(stream):
+      if frame.pts is not None:
+        position = _frame_number(frame.pts, frame.time_base, rate)
+      if last is not None and position >= last: break
+      if position >= first:
+        frames.append(frame.to_ndarray(format='rgb24').transpose(2, 0, 1))
+      position += 1
+
+  if not frames:
+    return numpy.zeros(shape, dtype='uint8')
+
+  return numpy.array(frames)
+
+
+def save_index(index, path):
+  """Saves a keyframe index to a text file
+
+  Each line of the output file contains the base directory of a session
+  followed by the frame numbers of all keyframes in its video, separated by
+  spaces.
+
+
+  Parameters:
+
+    index (dict): A dictionary where keys are session base directories and
+      values, 1D arrays of keyframe numbers as returned by
+      :py:func:`probe_keyframes`
+
+    path (str): The path to the file that will be (re-)written
+
+  """
+
+  with open(path, 'wt') as f:
+    for basedir in sorted(index):
+      f.write('%s %s\n' % (basedir, ' '.join('%d' % k for k in index[basedir])))
+
+
+def load_index(path):
+  """Loads a keyframe index saved with :py:func:`save_index`
+
+
+  Returns:
+
+    dict: A dictionary where keys are session base directories and values, 1D
+    arrays of 32-bit integers with the keyframe numbers of the session video.
+    If ``path`` does not exist, an empty dictionary is returned.
+
+  """
+
+  retval = {}
+  if not os.path.exists(path): return retval
+
+  with open(path, 'rt') as f:
+    for row in f:
+      p = row.split()
+      if not p: continue
+      retval[p[0]] = numpy.array([int(k) for k in p[1:]], dtype='int32')
+  return retval
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Fixed-length windows over database sessions
+
+Sessions of the database have different durations. A :py:class:`WindowIndex`
+expands each session into fixed-length windows using only the metadata
+shipped with this package, so no media file is opened to build it. Its length
+is known upfront and any window can be accessed directly, by position.
+'''
+
+import numpy
+
+
+class Window(object):
+  """A fixed-length time window of a session
+
+
+  Parameters:
+
+    file (bob.db.hci_tagging.File): The session this window belongs to
+
+    start (float): The start of the window, in seconds, counting from the
+      start of the session video
+
+    end (float): The end of the window, in seconds
+
+  """
+
+  def __init__(self, file, start, end):
+    self.file = file
+    self.start = start
+    self.end = end
+
+
+  def __repr__(self):
+    return "Window('%s', %g, %g)" % (self.file.stem, self.start, self.end)
+
+
+  def load_video(self, directory):
+    """Loads the video frames of this window
+
+    Decoding starts at the last keyframe preceding the window, if the
+    keyframe index is available (see
+    :py:meth:`bob.db.hci_tagging.File.load_video_segment`).
+
+
+    Returns:
+
+      numpy.ndarray: A 4D array of 8-bit unsigned integers corresponding to
+      the frames of this window in (frame,channel,y,x) notation (Bob-style).
+
+    """
+
+    return self.file.load_video_segment(directory, self.start, self.end)
+
+
+  def load_signals(self, directory, channels=('EXG1', 'EXG2', 'EXG3')):
+    """Loads the physiological signals of this window
+
+    Only the samples of this window are read from the BDF file. See
+    :py:meth:`bob.db.hci_tagging.File.load_signals`.
+
+
+    Returns:
+
+      numpy.ndarray: A 2D array of 64-bit floats in (channel,sample) notation
+
+      float: The sampling frequency of the signals, in Hz
+
+    """
+
+    return self.file.load_signals(directory, channels, self.start, self.end)
+
+
+class WindowIndex(object):
+  """A sequence of fixed-length windows over a list of sessions
+
+  Windows of ``length`` seconds start every ``step`` seconds within each
+  session. Trailing parts of sessions that do not fill a complete window, and
+  sessions shorter than ``length``, are not covered. Session durations are
+  taken from the metadata: the number of video frames and frame rate, if
+  available, or else the estimated duration in seconds.
+
+
+  Parameters:
+
+    objects (list): A list of :py:class:`bob.db.hci_tagging.File` objects
+
+    length (float): The length of each window, in seconds
+
+    step (float, optional): The time between the start of two consecutive
+      windows of a session, in seconds. If not set, it is equal to
+      ``length`` (windows do not overlap).
+
+  """
+
+  def __init__(self, objects, length=10., step=None):
+
+    if length <= 0:
+      raise ValueError("window length must be positive (not %g)" % length)
+    step = step or length
+    if step <= 0:
+      raise ValueError("window step must be positive (not %g)" % step)
+
+    self.objects = list(objects)
+    self.length = float(length)
+    self.step = float(step)
+
+    durations = numpy.array([float(k.frames)/k.frame_rate \
+        if (k.frames and k.frame_rate) else float(k.duration) \
+        for k in self.objects])
+    counts = numpy.floor((durations - self.length) / self.step).astype(int) + 1
+    self.counts = numpy.maximum(counts, 0)
+    self.offsets = numpy.concatenate(([0], numpy.cumsum(self.counts)))
+
+
+  def __len__(self):
+    return int(self.offsets[-1])
+
+
+  def __getitem__(self, index):
+
+    if isinstance(index, slice):
+      return [self[k] for k in range(*index.indices(len(self)))]
+
+    if index < 0: index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("window index out of range")
+
+    session = int(numpy.searchsorted(self.offsets, index, side='right')) - 1
+    start = (index - self.offsets[session]) * self.step
+    return Window(self.objects[session], start, start + self.length)
+
+
+  def __iter__(self):
+    for obj, count in zip(self.objects, self.counts):
+      for k in range(count):
+        yield Window(obj, k*self.step, k*self.step + self.length)